@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Merge notebook runtimes recorded by sharded runs into one timings file.
+The merged file is passed to `run_tests.py --timings` to balance later runs.
+"""
+
+import json
+import os
+import sys
+
+
+def merge_timings(output_path, timing_files):
+    """Update output_path with the runtimes in timing_files (later files win)."""
+    timings = {}
+    if os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            timings = json.load(f)
+    for timing_file in timing_files:
+        with open(timing_file, 'r', encoding='utf-8') as f:
+            timings.update(json.load(f))
+        print(f"Merged: {timing_file}")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(timings, f, indent=1, ensure_ascii=False, sort_keys=True)
+    print(f"Timings for {len(timings)} notebook(s) saved to: {output_path}")
+    return timings
+
+
+def main():
+    """Main entry point."""
+    if len(sys.argv) < 2:
+        print("Usage: python merge_timings.py <output.json> [timings.json ...]")
+        sys.exit(1)
+    merge_timings(sys.argv[1], sys.argv[2:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,64 +1,175 @@
+# Create the users and projects used by the E2E tests.
+#
+# Run with `python3 manage.py shell < setup_test_data.py`.
+#
+# When SEED_USERS is set, the script runs in bulk seeding mode instead: it creates
+# SEED_USERS users with SEED_PROJECTS_PER_USER projects each and prints the result
+# as a YAML fragment (between the BEGIN/END SEED CONFIG markers) that can be appended
+# to the configuration file read by TestRunner.load_config. Existing users and projects
+# are reused, so the script can be run repeatedly.
+#
+#   SEED_USERS              number of users to create
+#   SEED_PROJECTS_PER_USER  number of projects per user (default: 1)
+#   SEED_USERNAME_FORMAT    username of the i-th user (default: loaduser{:04d}@example.com)
+#   SEED_PASSWORD           password shared by all seeded users (default: loadpass123)
+#   SEED_BATCH_SIZE         number of rows per transaction (default: 500)
+import json
+import os
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.utils import timezone
-from osf.models import OSFUser, Node
+from osf.models import OSFUser, Node, Email, Guid
+from osf.models.base import generate_guid
 
 test_users = [
     {'username': 'testuser1@example.com', 'fullname': 'Test User 1', 'password': 'testpass123', 'is_superuser': True},
     {'username': 'testuser2@example.com', 'fullname': 'Test User 2', 'password': 'testpass456'},
 ]
 
-for user_data in test_users:
-    username = user_data['username']
-    if not OSFUser.objects.filter(username=username).exists():
-        # Create user manually instead of using create_user
-        user = OSFUser(
-            username=username,
-            fullname=user_data['fullname'],
-            is_active=True,
-            date_registered=timezone.now()
-        )
-        user.set_password(user_data['password'])
-        user.save()
-        # Set additional fields after save
-        user.is_registered = True
-        user.date_confirmed = timezone.now()
-        user.have_email = True
-        # Set superuser if specified
-        if user_data.get('is_superuser', False):
-            user.is_superuser = True
-            user.is_staff = True
-        user.save()
+seed_users = int(os.environ.get('SEED_USERS', '0'))
+
+if seed_users > 0:
+    projects_per_user = int(os.environ.get('SEED_PROJECTS_PER_USER', '1'))
+    username_format = os.environ.get('SEED_USERNAME_FORMAT', 'loaduser{:04d}@example.com')
+    password = os.environ.get('SEED_PASSWORD', 'loadpass123')
+    batch_size = int(os.environ.get('SEED_BATCH_SIZE', '500'))
+    started = timezone.now()
+
+    usernames = [username_format.format(i + 1) for i in range(seed_users)]
+    existing_usernames = set(
+        OSFUser.objects.filter(username__in=usernames).values_list('username', flat=True)
+    )
+    missing_usernames = [username for username in usernames if username not in existing_usernames]
+    user_numbers = {username: i + 1 for i, username in enumerate(usernames)}
+
+    # Hash the shared password once; hashing per user dominates the seeding time otherwise.
+    hashed_password = make_password(password)
+    user_content_type = ContentType.objects.get_for_model(OSFUser)
+    for offset in range(0, len(missing_usernames), batch_size):
+        batch = missing_usernames[offset:offset + batch_size]
+        now = timezone.now()
+        with transaction.atomic():
+            # bulk_create skips save() and its signals, so GUIDs and emails are created here as well
+            created_users = OSFUser.objects.bulk_create([
+                OSFUser(
+                    username=username,
+                    fullname=f"Load Test User {user_numbers[username]}",
+                    password=hashed_password,
+                    is_active=True,
+                    is_registered=True,
+                    have_email=True,
+                    date_registered=now,
+                    date_confirmed=now,
+                )
+                for username in batch
+            ])
+            Guid.objects.bulk_create([
+                Guid(_id=generate_guid(), content_type=user_content_type, object_id=user.pk)
+                for user in created_users
+            ])
+            Email.objects.bulk_create([
+                Email(address=user.username, user=user)
+                for user in created_users
+            ])
+    print(f"Created {len(missing_usernames)} users ({len(existing_usernames)} already existed)")
+
+    users = OSFUser.objects.filter(username__in=usernames)
+    users_by_name = {user.username: user for user in users}
+    existing_projects = {}
+    for project in Node.objects.filter(
+        creator__in=users, category='project', is_deleted=False
+    ).select_related('creator').prefetch_related('guids'):
+        existing_projects.setdefault(project.creator.username, {})[project.title] = project._id
+
+    # Nodes are saved one by one so that the creator is registered as an admin contributor,
+    # but they are still committed in batches.
+    pending = []
+    for index, username in enumerate(usernames):
+        for j in range(projects_per_user):
+            title = f"Load Test Project {index + 1}-{j + 1}"
+            if title not in existing_projects.get(username, {}):
+                pending.append((username, title))
+    for offset in range(0, len(pending), batch_size):
+        with transaction.atomic():
+            for username, title in pending[offset:offset + batch_size]:
+                project = Node(
+                    title=title,
+                    creator=users_by_name[username],
+                    category="project",
+                    is_public=False
+                )
+                project.save()
+                existing_projects.setdefault(username, {})[title] = project._id
+    print(f"Created {len(pending)} projects")
+    print(f"Seeding finished in {(timezone.now() - started).total_seconds():.1f}s")
+
+    # Each entry is written in flow style, which is both JSON and YAML.
+    print("# BEGIN SEED CONFIG")
+    print("load_users:")
+    for index, username in enumerate(usernames):
+        projects = [
+            {'id': existing_projects[username][f"Load Test Project {index + 1}-{j + 1}"],
+             'title': f"Load Test Project {index + 1}-{j + 1}"}
+            for j in range(projects_per_user)
+        ]
+        print("  - " + json.dumps({'username': username, 'password': password, 'projects': projects}))
+    print("# END SEED CONFIG")
+else:
+    for user_data in test_users:
+        username = user_data['username']
+        if not OSFUser.objects.filter(username=username).exists():
+            # Create user manually instead of using create_user
+            user = OSFUser(
+                username=username,
+                fullname=user_data['fullname'],
+                is_active=True,
+                date_registered=timezone.now()
+            )
+            user.set_password(user_data['password'])
+            user.save()
+            # Set additional fields after save
+            user.is_registered = True
+            user.date_confirmed = timezone.now()
+            user.have_email = True
+            # Set superuser if specified
+            if user_data.get('is_superuser', False):
+                user.is_superuser = True
+                user.is_staff = True
+            user.save()
         
-        # Create email for the user
-        user.emails.create(address=username)
-        print(f"Created test user: {username}")
+            # Create email for the user
+            user.emails.create(address=username)
+            print(f"Created test user: {username}")
         
-        # Create a project for the new user
-        project = Node(
-            title=f"Test Project for {user_data['fullname']}",
-            creator=user,
-            category="project",
-            is_public=False
-        )
-        project.save()
-        print(f"Created test project: {project._id} for user: {username}")
-        # Output for CI config
-        print(f"PROJECT_ID_{username}: {project._id}")
-        print(f"PROJECT_NAME_{username}: {project.title}")
-    else:
-        print(f"Test user already exists: {username}")
-        # Ensure existing user has at least one project
-        user = OSFUser.objects.get(username=username)
-        if not user.nodes.filter(category='project').exists():
+            # Create a project for the new user
             project = Node(
-                title=f"Test Project for {user.fullname}",
+                title=f"Test Project for {user_data['fullname']}",
                 creator=user,
                 category="project",
                 is_public=False
             )
             project.save()
-            print(f"Created test project: {project._id} for existing user: {username}")
+            print(f"Created test project: {project._id} for user: {username}")
+            # Output for CI config
+            print(f"PROJECT_ID_{username}: {project._id}")
+            print(f"PROJECT_NAME_{username}: {project.title}")
         else:
-            project = user.nodes.filter(category='project').first()
-        # Output for CI config
-        print(f"PROJECT_ID_{username}: {project._id}")
-        print(f"PROJECT_NAME_{username}: {project.title}")
\ No newline at end of file
+            print(f"Test user already exists: {username}")
+            # Ensure existing user has at least one project
+            user = OSFUser.objects.get(username=username)
+            if not user.nodes.filter(category='project').exists():
+                project = Node(
+                    title=f"Test Project for {user.fullname}",
+                    creator=user,
+                    category="project",
+                    is_public=False
+                )
+                project.save()
+                print(f"Created test project: {project._id} for existing user: {username}")
+            else:
+                project = user.nodes.filter(category='project').first()
+            # Output for CI config
+            print(f"PROJECT_ID_{username}: {project._id}")
+            print(f"PROJECT_NAME_{username}: {project.title}")
@@ -7,19 +7,101 @@ Manual tests (run_manual_notebook) are skipped.
 
 import os
 import sys
+import json
 import yaml
 import argparse
+import asyncio
 import tempfile
 import traceback
 import subprocess
 import shutil
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlparse
 import papermill as pm
 import nbformat
 
+from scripts import asyncExecutor
+from scripts import cpuProfile
+from scripts import kernelPool
+from scripts import liveReport
+from scripts import loadTest
+from scripts import networkProfile
+from scripts import noAnimation
+from scripts import prerequisites
+from scripts import projectPool
+from scripts import runManifest
+from scripts import stepTimeouts
+from scripts import testReport
+from scripts import playwright as pw
+from scripts import throttle
+from scripts import webPerf
+
+
+# Notebooks run by 取りまとめ-管理者機能.ipynb, in execution order
+ADMIN_NOTEBOOKS = [
+    'テスト手順-管理者機能-未ログイン.ipynb',
+    'テスト手順-管理者機能-ログイン.ipynb',
+    'テスト手順-管理者機能-ログイン可否設定.ipynb',
+    'テスト手順-管理者機能-ノード管理.ipynb',
+    'テスト手順-管理者機能-ユーザ管理.ipynb',
+    'テスト手順-管理者機能-機関設定.ipynb',
+    'テスト手順-管理者機能-RDMユーザメール.ipynb',
+    'テスト手順-管理者機能-RDM登録.ipynb',
+    'テスト手順-管理者機能-メンテナンスアラート.ipynb',
+    'テスト手順-管理者機能-アドオン利用制御.ipynb',
+    'テスト手順-管理者機能-利用統計.ipynb',
+    'テスト手順-管理者機能-アナウンス.ipynb',
+    'テスト手順-管理者機能-証跡管理.ipynb',
+    'テスト手順-管理者機能-NIIストレージのクォータ.ipynb',
+]
+
+# Runtime assumed for notebooks without any recorded timing (seconds)
+DEFAULT_NOTEBOOK_DURATION = 600
+
+
+def parse_shard(value):
+    """Parse a shard specification 'i/N' (1-based) into (i, N)."""
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid shard specification: {value} (expected i/N)')
+    if count < 1 or index < 1 or index > count:
+        raise argparse.ArgumentTypeError(f'Invalid shard specification: {value} (expected 1 <= i <= N)')
+    return (index, count)
+
+
+def load_timings(timings_path):
+    """Load historical notebook runtimes ({result_id: seconds}) from a JSON file."""
+    if timings_path is None or not os.path.exists(timings_path):
+        return {}
+    with open(timings_path) as f:
+        return json.load(f)
+
+
+def assign_shards(units, timings, shard_count):
+    """Assign units to shards (1-based) so that the total historical runtime per shard is balanced.
+    
+    Units are placed longest first on the currently lightest shard. Units without timing
+    use the median of the known timings. The result only depends on the arguments, so every
+    CI job computes the same plan.
+    """
+    known = sorted(timings[unit] for unit in units if unit in timings)
+    default_duration = known[len(known) // 2] if known else DEFAULT_NOTEBOOK_DURATION
+    durations = dict((unit, timings.get(unit, default_duration)) for unit in units)
+    loads = [0.0] * shard_count
+    plan = {}
+    for unit in sorted(units, key=lambda u: (-durations[u], u)):
+        shard = min(range(shard_count), key=lambda i: (loads[i], i))
+        loads[shard] += durations[unit]
+        plan[unit] = shard + 1
+    return plan, loads
+
 
 class TestRunner:
-    def __init__(self, config_path, show_disk_usage=False, failed_result_path=None):
+    def __init__(self, config_path, show_disk_usage=False, failed_result_path=None, shard=None, timings_path=None):
         self.config_path = config_path
         self.config = None
         self.work_dir = tempfile.mkdtemp()
@@ -28,10 +110,15 @@ class TestRunner:
         self.local_vars = {}
         self.show_disk_usage = show_disk_usage
         self.failed_result_path = failed_result_path
+        self.shard = shard
+        self.timings_path = timings_path
+        self.shard_plan = None
+        self.manifest = None
         
         # Default configuration values
         self.rdm_url = 'https://rdm.example.com/'
         self.admin_rdm_url = 'https://admin.rdm.example.com/'
+        self.rdm_api_url = 'https://api.rdm.example.com/'
         self.rdm_project_url_1 = 'https://rdm.example.com/tvuxd/'
         self.rdm_project_name_1 = 'test_login'
         self.rdm_project_url_2 = 'https://rdm.example.com/xwz59/'
@@ -63,6 +150,58 @@ class TestRunner:
             {'id': 's3compat', 'name': 'S3 Compatible Storage'},
         ]
         
+        # Storage matrix parallelism (1 = sequential)
+        self.storage_parallelism = 1
+        self.max_parallel_per_provider = 1
+        
+        # Client-side rate limit shared by all notebooks, e.g. {'rate': 5, 'burst': 10}
+        self.rate_limit = None
+        
+        # Number of pre-started kernels (0 = start a fresh kernel for each notebook)
+        self.kernel_pool_size = 0
+        self.kernel_pool = None
+        
+        # Network profile of browser contexts: 'off', 'revalidate', 'cache' or a dict such as
+        # {'mode': 'cache', 'block_tracking': True, 'block_third_party': True, 'allow_hosts': ['idp.example.com']}
+        self.network_profile = 'off'
+        
+        # Collect frontend performance (navigation timing, web vitals, CDP metrics) after every step
+        self.web_perf = False
+        
+        # Save a CPU profile of every step slower than this many seconds (None = only steps run with profile=True)
+        self.profile_threshold = None
+        
+        # Accounts for load test virtual users, e.g. the load_users fragment printed by setup_test_data.py
+        # [{'username': ..., 'password': ..., 'projects': [{'id': ..., 'title': ...}]}]
+        self.load_users = []
+        
+        # Projects pre-created for idp_username_1 and leased by grdm.ensure_project_exists, e.g.
+        # {'api_url': 'https://api.rdm.example.com/', 'token': '...', 'size': 6}
+        # 'projects' may list projects created beforehand (e.g. by setup_test_data.py) as [{'id': ..., 'title': ...}]
+        self.project_pool = None
+        
+        # Maximum number of pre-created browser contexts per notebook session (0 = create on demand).
+        # The first context is prepared when the session starts; further spares follow new_context=True demand.
+        self.context_pool_size = 0
+        
+        # Per-step timeouts learned from earlier runs, e.g.
+        # {'history': 'step-timeouts.json', 'multiplier': 3, 'floor': 15, 'ceiling': 300}
+        # Durations of this run are added to the history file when the run ends.
+        self.adaptive_timeouts = None
+        
+        # Disable CSS animations/transitions and jQuery effects in browser contexts, and skip the fixed
+        # waits for them in scripts/grdm.py. Compare against a normal run with
+        # python -m scripts.noAnimation <baseline_result_dir> <result_dir>
+        self.no_animation = False
+        
+        # Update the Excel/JSON/HTML report in the result directory whenever a notebook finishes.
+        # True or a dict such as {'author': 'GitHub Actions', 'ticket': '00000'}
+        self.live_report = False
+        
+        # Executor of leaf test notebooks: 'papermill' or 'inprocess' (scripts/asyncExecutor.py)
+        self.executor = 'papermill'
+        self.executor_concurrency = 4
+        
     def load_config(self):
         """Load configuration from YAML file."""
         if not os.path.exists(self.config_path):
@@ -87,15 +226,80 @@ class TestRunner:
                 print(f'Error: Required parameter {param} is not set in configuration.')
                 sys.exit(1)
                 
+    def list_shard_units(self):
+        """List the result IDs of all notebooks this configuration would run."""
+        units = []
+        if not self.skip_login and getattr(self, 'idp_name_1', None):
+            units += ['テスト手順-未ログイン', 'テスト手順-ログイン']
+        if not self.skip_default_storage:
+            units.append('取りまとめ-NIIストレージ')
+        for storage_info in self.storages_s3:
+            if getattr(self, f'{storage_info["id"]}_access_key_1', None):
+                units.append(f'取りまとめ-S3共通-{storage_info["name"]}')
+        if not self.skip_metadata:
+            units.append('取りまとめ-Metadataアドオン')
+        if not self.skip_admin:
+            units += [
+                os.path.splitext(notebook)[0] for notebook in ADMIN_NOTEBOOKS
+                if notebook not in self.exclude_notebooks
+            ]
+        return [unit for unit in units if f'{unit}.ipynb' not in self.exclude_notebooks]
+    
+    def plan_shard(self):
+        """Decide which notebooks belong to this shard, based on historical runtimes."""
+        if self.shard is None:
+            return
+        index, count = self.shard
+        timings = load_timings(self.timings_path)
+        self.shard_plan, loads = assign_shards(self.list_shard_units(), timings, count)
+        print(f'Shard {index}/{count}: estimated {loads[index - 1]:.0f}s')
+        for unit, shard in self.shard_plan.items():
+            if shard == index:
+                print(f'  - {unit}')
+    
+    def in_shard(self, result_id):
+        """Check whether the notebook with result_id should run in this shard."""
+        if self.shard_plan is None or result_id not in self.shard_plan:
+            return True
+        return self.shard_plan[result_id] == self.shard[0]
+    
     def make_result_dir(self):
         """Create result directory with timestamp."""
         run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        if self.shard is not None:
+            run_id += '-shard{}of{}'.format(*self.shard)
         self.result_dir = f'result/result-{run_id}'
         os.makedirs(self.result_dir)
+        # Coordinator notebooks started by papermill append their sub-notebooks to the same manifest
+        self.manifest = runManifest.configure_environ(self.result_dir)
+        # A login that failed in one notebook blocks the same login in the following notebooks
+        prerequisites.configure_environ(self.result_dir)
+        if self.rate_limit:
+            # Kernels started by papermill inherit the environment and share the token bucket
+            throttle.configure_environ(
+                os.path.join(self.result_dir, '.rate-limit.json'),
+                rate=self.rate_limit.get('rate', throttle.DEFAULT_RATE),
+                burst=self.rate_limit.get('burst', throttle.DEFAULT_BURST),
+                hosts=[
+                    urlparse(url).hostname for url in [self.rdm_url, self.rdm_api_url, self.admin_rdm_url]
+                    if urlparse(url).hostname
+                ],
+            )
+        # Static assets are cached once for the whole run and shared by all kernels
+        networkProfile.configure_environ(
+            self.network_profile,
+            cache_dir=os.path.join(self.work_dir, 'network-cache'),
+            first_party_hosts=[
+                urlparse(url).hostname for url in [self.rdm_url, self.admin_rdm_url] if urlparse(url).hostname
+            ],
+        )
         return self.result_dir
         
-    def run_notebook(self, base_notebook, optional_result_id=None, **optional_params):
-        """Execute a notebook using papermill."""
+    def prepare_notebook(self, base_notebook, optional_result_id=None, **optional_params):
+        """Decide the result notebook path and parameters of a notebook.
+        
+        Returns (result_notebook, params), or None if the notebook is skipped.
+        """
         _, filename = os.path.split(base_notebook)
         
         # Check if notebook should be excluded
@@ -106,6 +310,10 @@ class TestRunner:
         result_id, _ = os.path.splitext(filename)
         if optional_result_id:
             result_id += optional_result_id
+        
+        if not self.in_shard(result_id):
+            print(f'Skipping notebook in another shard: {base_notebook}')
+            return None
             
         result_notebook = os.path.join(self.result_dir, result_id + '.ipynb')
         result_path = os.path.join(self.result_dir, result_id)
@@ -125,6 +333,14 @@ class TestRunner:
             transition_timeout=self.transition_timeout,
         )
         params.update(optional_params)
+        return result_notebook, params
+        
+    def run_notebook(self, base_notebook, optional_result_id=None, **optional_params):
+        """Execute a notebook using papermill."""
+        prepared = self.prepare_notebook(base_notebook, optional_result_id, **optional_params)
+        if prepared is None:
+            return None
+        result_notebook, params = prepared
         
         print(f'Running notebook: {base_notebook}')
         print(f'  Result: {result_notebook}')
@@ -134,11 +350,21 @@ class TestRunner:
             subprocess.run(['df', '-h'])
         
         try:
-            pm.execute_notebook(
-                base_notebook,
-                result_notebook,
-                parameters=params
-            )
+            with self.record_notebook(base_notebook, result_notebook, params):
+                if self.kernel_pool is None:
+                    pm.execute_notebook(
+                        base_notebook,
+                        result_notebook,
+                        parameters=params
+                    )
+                else:
+                    with self.kernel_pool.kernel() as km:
+                        pm.execute_notebook(
+                            base_notebook,
+                            result_notebook,
+                            parameters=params,
+                            km=km,
+                        )
             print(f'  Status: SUCCESS')
         except pm.PapermillExecutionError:
             if not self.skip_failed_test:
@@ -152,6 +378,36 @@ class TestRunner:
             
         return result_notebook
         
+    def record_notebook(self, base_notebook, result_notebook, params):
+        """Record the execution of a notebook run by this runner in the run manifest."""
+        if self.manifest is None:
+            return nullcontext()
+        return self.manifest.record(
+            result_notebook,
+            input_notebook=base_notebook,
+            parameters=params,
+            result_path=params.get('default_result_path'),
+        )
+    
+    def list_sub_notebooks(self, notebook_path):
+        """List the notebooks run by a coordinator notebook, in execution order."""
+        if self.manifest is not None and os.path.exists(self.manifest.path):
+            notebook = os.path.relpath(os.path.abspath(notebook_path), self.manifest.base_dir)
+            return [
+                os.path.join(self.manifest.base_dir, entry['notebook'])
+                for entry in runManifest.ordered(self.manifest.entries())
+                if entry.get('parent') == notebook and os.path.exists(os.path.join(self.manifest.base_dir, entry['notebook']))
+            ]
+        # Results without a manifest: sub-notebooks are stored in the notebooks/ subdirectory
+        notebooks_dir = os.path.join(os.path.splitext(notebook_path)[0], 'notebooks')
+        if not os.path.isdir(notebooks_dir):
+            return []
+        return [
+            os.path.join(notebooks_dir, sub_notebook)
+            for sub_notebook in os.listdir(notebooks_dir)
+            if sub_notebook.endswith('.ipynb')
+        ]
+    
     def run_login_tests(self):
         """Run login-related tests."""
         print('\n=== Login Tests ===')
@@ -161,25 +417,57 @@ class TestRunner:
             return
         
         if hasattr(self, 'idp_name_1') and self.idp_name_1:
-            self.result_notebooks.append(
-                self.run_notebook(
-                    'テスト手順-未ログイン.ipynb',
+            login_jobs = [
+                dict(
+                    base_notebook='テスト手順-未ログイン.ipynb',
                     rdm_project_url_1=self.rdm_project_url_1,
                     rdm_project_url_2=self.rdm_project_url_2,
-                )
-            )
-            
-            self.result_notebooks.append(
-                self.run_notebook(
-                    'テスト手順-ログイン.ipynb',
+                ),
+                dict(
+                    base_notebook='テスト手順-ログイン.ipynb',
                     rdm_project_url_1=self.rdm_project_url_1,
                     rdm_project_name_1=self.rdm_project_name_1,
                     rdm_project_url_2=self.rdm_project_url_2,
-                )
-            )
+                ),
+            ]
+            if self.executor == 'inprocess':
+                self.result_notebooks.extend(self.run_notebooks_inprocess(login_jobs))
+            else:
+                self.result_notebooks.extend([self.run_notebook(**kwargs) for kwargs in login_jobs])
         else:
             print('Skipping login tests (IdP not configured)')
             
+    def run_notebooks_inprocess(self, notebook_jobs):
+        """Run leaf notebooks concurrently in this process, sharing one browser.
+        
+        Each job is a dict of run_notebook keyword arguments. The notebooks must not run
+        other notebooks through papermill. Results are returned in the order of notebook_jobs.
+        """
+        jobs = []
+        for kwargs in notebook_jobs:
+            prepared = self.prepare_notebook(**kwargs)
+            if prepared is None:
+                continue
+            result_notebook, params = prepared
+            jobs.append(dict(input_path=kwargs['base_notebook'], output_path=result_notebook, parameters=params))
+        if len(jobs) == 0:
+            return []
+        
+        print(f'Running {len(jobs)} notebook(s) in process with concurrency {self.executor_concurrency}')
+        results = asyncExecutor.run_notebooks(jobs, concurrency=self.executor_concurrency, manifest=self.manifest)
+        for job, result in zip(jobs, results):
+            print(f'  Result: {job["output_path"]}')
+            if isinstance(result, pm.PapermillExecutionError):
+                if not self.skip_failed_test:
+                    raise result
+                print(f'  Status: FAILED (continuing)')
+                print(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                print(f'  Status: SUCCESS')
+        return [job['output_path'] for job in jobs]
+        
     def run_storage_tests(self):
         """Run storage-related tests."""
         print('\n=== Storage Tests ===')
@@ -197,6 +485,7 @@ class TestRunner:
             )
             
         # S3 storage tests
+        storage_jobs = []
         rdm_project_prefixes = {}
         for storage_info in self.storages_s3:
             storage_id = storage_info['id']
@@ -214,9 +503,10 @@ class TestRunner:
                 datetime.now().strftime('%Y%m%d-%H%M%S')
             )
             
-            self.result_notebooks.append(
-                self.run_notebook(
-                    '取りまとめ-S3共通.ipynb',
+            storage_jobs.append((
+                storage_info.get('provider', storage_id),
+                dict(
+                    base_notebook='取りまとめ-S3共通.ipynb',
                     optional_result_id=f'-{storage_name}',
                     s3_access_key_1=getattr(self, f'{storage_id}_access_key_1', None),
                     s3_secret_access_key_1=getattr(self, f'{storage_id}_secret_access_key_1', None),
@@ -235,12 +525,41 @@ class TestRunner:
                     s3compat_type_name_1=getattr(self, 's3compat_type_name_1', None) if storage_id == 's3compat' else None,
                     s3compat_type_name_2=getattr(self, 's3compat_type_name_2', None) if storage_id == 's3compat' else None,
                     skip_too_many_files_check=storage_info.get('skip_too_many_files_check', False),
-                )
-            )
+                ),
+            ))
+            
+        self.result_notebooks.extend(self.run_storage_matrix(storage_jobs))
             
         # OAuth storage tests (require manual setup, so skip in automated tests)
         print('\nSkipping OAuth storage tests (require manual setup)')
         
+    def run_storage_matrix(self, storage_jobs):
+        """Run storage notebooks concurrently, limiting concurrent runs per provider.
+        
+        Each job is a tuple of (provider, run_notebook keyword arguments). Every run
+        executes in its own kernel (and therefore its own browser context) and writes
+        to its own result directory, so the runs do not share any state. Results are
+        returned in the order of storage_jobs.
+        """
+        if len(storage_jobs) == 0:
+            return []
+        if self.storage_parallelism <= 1:
+            return [self.run_notebook(**kwargs) for _, kwargs in storage_jobs]
+        
+        provider_limits = {}
+        for provider, _ in storage_jobs:
+            if provider not in provider_limits:
+                provider_limits[provider] = threading.Semaphore(self.max_parallel_per_provider)
+        
+        def run_job(provider, kwargs):
+            with provider_limits[provider]:
+                return self.run_notebook(**kwargs)
+        
+        print(f'Running {len(storage_jobs)} storage test(s) with parallelism {self.storage_parallelism}')
+        with ThreadPoolExecutor(max_workers=self.storage_parallelism) as executor:
+            futures = [executor.submit(run_job, provider, kwargs) for provider, kwargs in storage_jobs]
+            return [future.result() for future in futures]
+        
     def run_metadata_tests(self):
         """Run metadata addon tests."""
         print('\n=== Metadata Tests ===')
@@ -262,6 +581,14 @@ class TestRunner:
         print('\n=== Admin Tests ===')
         
         if not self.skip_admin:
+            # Admin notebooks are sharded individually; the others are excluded from the coordinator
+            exclude_notebooks = list(self.exclude_notebooks) + [
+                notebook for notebook in ADMIN_NOTEBOOKS
+                if notebook not in self.exclude_notebooks and not self.in_shard(os.path.splitext(notebook)[0])
+            ]
+            if all(notebook in exclude_notebooks for notebook in ADMIN_NOTEBOOKS):
+                print('Skipping admin tests (no admin notebooks in this shard)')
+                return
             self.result_notebooks.append(
                 self.run_notebook(
                     '取りまとめ-管理者機能.ipynb',
@@ -287,12 +614,15 @@ class TestRunner:
                     timestamp_user=getattr(self, 'admin_timestamp_user', None),
                     quota_user_id=getattr(self, 'admin_quota_user_id', None),
                     entitlement_text=getattr(self, 'admin_entitlement_text', None),
-                    exclude_notebooks=self.exclude_notebooks,
+                    exclude_notebooks=exclude_notebooks,
                 )
             )
             
     def check_notebook_errors(self, notebook_path):
-        """Check a notebook and all its sub-notebooks recursively for execution errors."""
+        """Check a notebook and all its sub-notebooks recursively for execution errors.
+        
+        Errors of steps skipped because a prerequisite failed (StepBlocked) are marked with 'blocked'.
+        """
         all_errors = []
         
         # Check the notebook itself
@@ -312,26 +642,41 @@ class TestRunner:
                     'cell': i,
                     'ename': output.get('ename', 'Unknown'),
                     'evalue': output.get('evalue', 'Unknown error'),
-                    'traceback': output.get('traceback', [])
+                    'traceback': output.get('traceback', []),
+                    'blocked': output.get('ename') == testReport.BLOCKED_ENAME,
                 })
         
-        # Check notebooks/ subdirectory recursively
-        base_path = os.path.splitext(notebook_path)[0]
-        notebooks_dir = os.path.join(base_path, 'notebooks')
-        
-        if not os.path.exists(notebooks_dir) or not os.path.isdir(notebooks_dir):
-            return all_errors
-        
-        for sub_notebook in os.listdir(notebooks_dir):
-            if not sub_notebook.endswith('.ipynb'):
-                continue
-                
-            sub_notebook_path = os.path.join(notebooks_dir, sub_notebook)
+        # Check sub-notebooks recursively
+        for sub_notebook_path in self.list_sub_notebooks(notebook_path):
             # Recursively check this sub-notebook and its children
             all_errors.extend(self.check_notebook_errors(sub_notebook_path))
         
         return all_errors
     
+    def collect_timings(self, notebook_path):
+        """Collect papermill runtimes ({result_id: seconds}) of a notebook and its sub-notebooks."""
+        timings = {}
+        with open(notebook_path, 'r') as f:
+            nb = nbformat.read(f, as_version=nbformat.NO_CONVERT)
+        duration = nb.metadata.get('papermill', {}).get('duration')
+        if duration is not None:
+            timings[os.path.splitext(os.path.basename(notebook_path))[0]] = duration
+        
+        for sub_notebook_path in self.list_sub_notebooks(notebook_path):
+            timings.update(self.collect_timings(sub_notebook_path))
+        return timings
+    
+    def save_timings(self, result_notebooks):
+        """Write runtimes of this run to timings.json in the result directory."""
+        timings = {}
+        for notebook_path in result_notebooks:
+            timings.update(self.collect_timings(notebook_path))
+        timings_file = os.path.join(self.result_dir, 'timings.json')
+        with open(timings_file, 'w') as f:
+            json.dump(timings, f, indent=1, ensure_ascii=False, sort_keys=True)
+        print(f'Timings saved to: {timings_file}')
+        return timings_file
+    
     def extract_failed_notebooks(self):
         """Extract and copy failed notebooks to a separate directory."""
         if self.failed_result_path is None:
@@ -378,16 +723,114 @@ class TestRunner:
         
         return failed_count
     
+    def provision_project_pool(self):
+        """Create the project pool configured by project_pool and share it with the kernels."""
+        if not self.project_pool:
+            return None
+        pool = projectPool.ProjectPool(
+            os.path.join(self.work_dir, 'project-pool.json'),
+            self.project_pool['api_url'],
+            self.project_pool['token'],
+        )
+        projects = self.project_pool.get('projects') or []
+        if projects:
+            pool.add_projects(projects)
+        size = self.project_pool.get('size', 0) - len(projects)
+        if size > 0:
+            pool.provision(size)
+        projectPool.configure_environ(pool)
+        return pool
+    
+    def run_load_test(self, scenario, users=10, ramp=0, duration=60, think_time=1.0, api_only=False, verbose=False):
+        """Run a load test scenario and save the per-step summary to the result directory."""
+        accounts = self.load_users or [
+            {'username': self.idp_username_1, 'password': self.idp_password_1},
+        ]
+        options = {
+            'rdm_url': self.rdm_url,
+            'rdm_api_url': self.rdm_api_url,
+            'rdm_project_url': self.rdm_project_url_1,
+            'idp_name': getattr(self, 'idp_name_1', None),
+            'transition_timeout': self.transition_timeout,
+            'upload_size': 1024,
+            'work_dir': self.work_dir,
+            'verbose': verbose,
+        }
+        print(f'Load test: {scenario} with {users} {"API-only" if api_only else "browser"} users '
+              f'({len(accounts)} accounts), ramp {ramp}s, duration {duration}s')
+        summary = asyncio.run(loadTest.run_load(
+            scenario, accounts, options,
+            users=users, ramp=ramp, duration=duration, think_time=think_time, api_only=api_only,
+        ))
+        print(loadTest.format_summary(summary))
+        summary_path = os.path.join(self.result_dir, f'load-{scenario}.json')
+        with open(summary_path, 'w') as f:
+            json.dump(dict(
+                scenario=scenario,
+                users=users,
+                ramp=ramp,
+                duration=duration,
+                think_time=think_time,
+                api_only=api_only,
+                **summary,
+            ), f, indent=2)
+        print(f'Load test summary: {summary_path}')
+        return summary
+    
+    def start_live_report(self):
+        """Start updating the report from the run manifest in the background, if enabled."""
+        if not self.live_report:
+            return None
+        options = self.live_report if isinstance(self.live_report, dict) else {}
+        reporter = liveReport.LiveReporter(
+            self.result_dir,
+            author=options.get('author', 'GitHub Actions'),
+            ticket_number=options.get('ticket', '00000'),
+            interval=options.get('interval', liveReport.DEFAULT_INTERVAL),
+        )
+        print(f'Live report: {os.path.join(self.result_dir, testReport.INDEX_HTML_FILENAME)}')
+        return reporter.start()
+    
     def run_all_tests(self):
         """Run all configured tests."""
         print(f'Starting test run at {datetime.now()}')
         print(f'Configuration: {self.config_path}')
         print(f'Result directory: {self.result_dir}')
         
-        self.run_login_tests()
-        self.run_storage_tests()
-        self.run_metadata_tests()
-        self.run_admin_tests()
+        # Every setting shared through the environment must be in place before any kernel starts
+        if self.context_pool_size > 0:
+            os.environ[pw.ENV_CONTEXT_POOL_SIZE] = str(self.context_pool_size)
+        if self.web_perf:
+            os.environ[webPerf.ENV_WEB_PERF] = '1'
+        if self.profile_threshold is not None:
+            os.environ[cpuProfile.ENV_PROFILE_THRESHOLD] = str(self.profile_threshold)
+        if self.no_animation:
+            os.environ[noAnimation.ENV_NO_ANIMATION] = '1'
+        if self.adaptive_timeouts:
+            stepTimeouts.configure_environ(
+                self.adaptive_timeouts['history'],
+                multiplier=self.adaptive_timeouts.get('multiplier', stepTimeouts.DEFAULT_MULTIPLIER),
+                floor=self.adaptive_timeouts.get('floor', stepTimeouts.DEFAULT_FLOOR),
+                ceiling=self.adaptive_timeouts.get('ceiling', stepTimeouts.DEFAULT_CEILING),
+            )
+        project_pool = self.provision_project_pool()
+        if self.kernel_pool_size > 0:
+            # Only the runner owns a pool; coordinator notebooks run their children in fresh kernels
+            self.kernel_pool = kernelPool.KernelPool(self.kernel_pool_size)
+        live_reporter = self.start_live_report()
+        try:
+            self.run_login_tests()
+            self.run_storage_tests()
+            self.run_metadata_tests()
+            self.run_admin_tests()
+        finally:
+            if self.kernel_pool is not None:
+                self.kernel_pool.close()
+                self.kernel_pool = None
+            if project_pool is not None:
+                project_pool.cleanup()
+            if live_reporter is not None:
+                print(f'Report saved to: {live_reporter.stop()}')
         
         result_notebooks = [result_notebook for result_notebook in self.result_notebooks if result_notebook is not None]
         
@@ -395,6 +838,13 @@ class TestRunner:
         print(f'Total notebooks executed: {len(result_notebooks)}')
         print(f'Results saved to: {self.result_dir}')
         
+        self.save_timings(result_notebooks)
+        if self.adaptive_timeouts:
+            added = stepTimeouts.update_history(self.adaptive_timeouts['history'], self.result_dir)
+            print(f'Step timings: {added} added to {self.adaptive_timeouts["history"]}')
+        if self.web_perf:
+            webPerf.write_report(self.result_dir)
+        
         # Extract failed notebooks for easier debugging
         self.extract_failed_notebooks()
         
@@ -408,6 +858,14 @@ class TestRunner:
                 if notebook_errors:
                     all_errors.extend(notebook_errors)
             
+            blocked_errors = [error for error in all_errors if error['blocked']]
+            all_errors = [error for error in all_errors if not error['blocked']]
+            if blocked_errors:
+                print(f'\n{len(blocked_errors)} step(s) blocked by a failed prerequisite:', file=sys.stderr)
+                for error in blocked_errors:
+                    rel_path = os.path.relpath(error['notebook'], os.path.dirname(self.result_dir))
+                    print(f"  - {rel_path} cell {error['cell']}: {error['evalue']}", file=sys.stderr)
+            
             if all_errors:
                 # Group errors by notebook
                 notebooks_with_errors = {}
@@ -433,7 +891,79 @@ class TestRunner:
         return result_notebooks
 
 
+def main_load():
+    parser = argparse.ArgumentParser(
+        prog='run_tests.py load',
+        description='Drive concurrent virtual users through GRDM user journeys and report per-step latency'
+    )
+    parser.add_argument(
+        'scenario',
+        choices=sorted(loadTest.SCENARIOS.keys()),
+        help='Journey repeated by each virtual user'
+    )
+    parser.add_argument(
+        'config',
+        help='Path to configuration YAML file'
+    )
+    parser.add_argument(
+        '--users',
+        type=int,
+        default=10,
+        help='Number of concurrent virtual users'
+    )
+    parser.add_argument(
+        '--ramp',
+        type=float,
+        default=0,
+        help='Seconds over which the virtual users are started'
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=60,
+        help='Seconds (including the ramp) after which the virtual users stop starting new journeys'
+    )
+    parser.add_argument(
+        '--think-time',
+        type=float,
+        default=1.0,
+        help='Seconds each virtual user waits between journeys'
+    )
+    parser.add_argument(
+        '--api-only',
+        action='store_true',
+        help='Use lightweight virtual users that only call the GRDM API instead of browser contexts'
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Print the traceback of every failed step'
+    )
+    
+    args = parser.parse_args(sys.argv[2:])
+    
+    runner = TestRunner(args.config)
+    runner.load_config()
+    runner.make_result_dir()
+    try:
+        runner.run_load_test(
+            args.scenario,
+            users=args.users,
+            ramp=args.ramp,
+            duration=args.duration,
+            think_time=args.think_time,
+            api_only=args.api_only,
+            verbose=args.verbose,
+        )
+    except KeyboardInterrupt:
+        print('\nLoad test interrupted by user')
+        sys.exit(1)
+
+
 def main():
+    if sys.argv[1:2] == ['load']:
+        main_load()
+        return
     parser = argparse.ArgumentParser(
         description='Run GRDM integration tests automatically'
     )
@@ -451,11 +981,28 @@ def main():
         help='Path to directory where failed notebooks will be copied (if not specified, failed notebooks are not extracted)'
     )
     
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        help='Run only the i-th of N shards (e.g. 2/4), balanced by historical runtime'
+    )
+    parser.add_argument(
+        '--timings',
+        help='Path to a timings JSON file ({result_id: seconds}) from earlier runs, used to balance shards'
+    )
+    
     args = parser.parse_args()
     
     # Create and run tests
-    runner = TestRunner(args.config, show_disk_usage=args.show_disk_usage, failed_result_path=args.failed_result_path)
+    runner = TestRunner(
+        args.config,
+        show_disk_usage=args.show_disk_usage,
+        failed_result_path=args.failed_result_path,
+        shard=args.shard,
+        timings_path=args.timings,
+    )
     runner.load_config()
+    runner.plan_shard()
     runner.make_result_dir()
     
     try:
@@ -0,0 +1,325 @@
+# papermillの代わりに、テスト手順のNotebookを同一プロセス内のasyncioタスクとして実行するためのユーティリティ
+#
+# Notebookごとのカーネル起動とブラウザ起動を省き、1つのChromiumを複数のNotebookで共有して並行に実行する。
+# 実行結果は papermill と互換のNotebook(出力、papermillメタデータのstart_time/duration)として保存するため、
+# stat.py や generate_excel_summary.py による集計はそのまま利用できる。
+#
+# 制約:
+# - 全てのNotebookが1つのイベントループで実行されるため、time.sleep などのブロッキング処理は他のNotebookも止める
+# - IPythonの構文はシェルエスケープ(!cmd)のみ対応する
+# - 子Notebookをpapermillで実行する取りまとめNotebookは対象外
+
+import argparse
+import ast
+import asyncio
+import inspect
+import io
+import os
+import subprocess
+import sys
+import traceback
+from base64 import b64encode
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+import nbformat
+import yaml
+from IPython.core.inputtransformer2 import TransformerManager
+from IPython.utils.text import DollarFormatter
+from papermill.execute import prepare_notebook_metadata, raise_for_execution_errors
+from papermill.iorw import load_notebook_node, write_ipynb
+from papermill.parameterize import parameterize_notebook
+from playwright.async_api import async_playwright
+
+from scripts import playwright as pw
+from scripts import resultAnalyzer
+from scripts import runManifest
+
+# 実行中のセルの標準出力・標準エラー出力の書き込み先
+_cell_streams = ContextVar('cell_streams', default=None)
+
+
+class _RoutedStream(io.TextIOBase):
+    """セルの実行中であればそのセルの出力に、そうでなければ元のストリームに書き込むストリーム。"""
+
+    def __init__(self, name, fallback):
+        self.name = name
+        self.fallback = fallback
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        streams = _cell_streams.get()
+        if streams is None:
+            return self.fallback.write(s)
+        return streams[self.name].write(s)
+
+    def flush(self):
+        self.fallback.flush()
+
+
+class _Shell:
+    """get_ipython() の代わりに、シェルエスケープ(!cmd)を実行する。"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    def var_expand(self, cmd):
+        try:
+            return DollarFormatter().vformat(cmd, [], self.namespace)
+        except Exception:
+            return cmd
+
+    def system(self, cmd):
+        result = subprocess.run(self.var_expand(cmd), shell=True, capture_output=True, text=True)
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
+
+    def getoutput(self, cmd, split=True):
+        result = subprocess.run(self.var_expand(cmd), shell=True, capture_output=True, text=True)
+        return result.stdout.splitlines() if split else result.stdout
+
+    def run_line_magic(self, name, line, _stack_depth=1):
+        raise NotImplementedError(f'Magic %{name} is not supported by the in-process executor')
+
+    def run_cell_magic(self, name, line, cell):
+        raise NotImplementedError(f'Magic %%{name} is not supported by the in-process executor')
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+async def _evaluate(code, namespace):
+    result = eval(code, namespace)
+    if code.co_flags & inspect.CO_COROUTINE:
+        result = await result
+    return result
+
+
+async def _run_source(source, namespace, filename):
+    """セルのソースを実行し、最後の式の値を返す。トップレベルのawaitを許可する。"""
+    tree = ast.parse(TransformerManager().transform_cell(source), filename=filename)
+    last_expr = None
+    if len(tree.body) > 0 and isinstance(tree.body[-1], ast.Expr):
+        last_expr = ast.Expression(tree.body.pop().value)
+    flags = ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    await _evaluate(compile(tree, filename, 'exec', flags=flags), namespace)
+    if last_expr is None:
+        return None
+    return await _evaluate(compile(last_expr, filename, 'eval', flags=flags), namespace)
+
+
+def _format_result(value):
+    data = {'text/plain': repr(value)}
+    repr_png = getattr(value, '_repr_png_', None)
+    if repr_png is not None:
+        png = repr_png()
+        if isinstance(png, tuple):
+            png, _ = png
+        if png is not None:
+            data['image/png'] = b64encode(png).decode('ascii')
+    return data
+
+
+def _step_headers(nb):
+    """コードセルのidから、そのセルが属するステップ(## 見出し)への対応を作成する。"""
+    headers = {}
+    for step_sequence in resultAnalyzer.iter_step_sequences(nb):
+        for header, cells in resultAnalyzer.iter_step_result(step_sequence):
+            for cell in cells:
+                headers[id(cell)] = resultAnalyzer.source_first_line(header)
+    return headers
+
+
+async def _execute_cell(cell, execution_count, namespace, filename):
+    """セルを実行して出力とpapermillメタデータを記録する。成功した場合はTrueを返す。"""
+    streams = dict(stdout=io.StringIO(), stderr=io.StringIO())
+    outputs = []
+    start_time = _now()
+    cell.metadata.papermill['start_time'] = start_time.isoformat()
+    cell.metadata.papermill['status'] = 'running'
+    cell.metadata.papermill['exception'] = False
+    token = _cell_streams.set(streams)
+    value = None
+    error = None
+    try:
+        value = await _run_source(cell.source, namespace, f'{filename}:In[{execution_count}]')
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        raise
+    except BaseException as e:
+        error = e
+    finally:
+        _cell_streams.reset(token)
+    for name in ['stdout', 'stderr']:
+        text = streams[name].getvalue()
+        if len(text) > 0:
+            outputs.append(nbformat.v4.new_output('stream', name=name, text=text))
+    if error is not None:
+        outputs.append(nbformat.v4.new_output(
+            'error',
+            ename=type(error).__name__,
+            evalue=str(error),
+            traceback=traceback.format_exception(type(error), error, error.__traceback__),
+        ))
+        cell.metadata.papermill['exception'] = True
+        cell.metadata.papermill['status'] = 'failed'
+    elif value is not None:
+        outputs.append(nbformat.v4.new_output(
+            'execute_result', data=_format_result(value), execution_count=execution_count,
+        ))
+    end_time = _now()
+    cell.outputs = outputs
+    cell.execution_count = execution_count
+    cell.metadata.papermill['end_time'] = end_time.isoformat()
+    cell.metadata.papermill['duration'] = (end_time - start_time).total_seconds()
+    if error is None:
+        cell.metadata.papermill['status'] = 'completed'
+    return error is None
+
+
+async def execute_notebook(input_path, output_path, parameters=None, browser=None):
+    """
+    Notebookを現在のイベントループ上で実行し、papermill互換の結果Notebookを保存する。
+
+    セルは先頭から順に実行し、例外が発生した時点で残りのセルの実行を中止する。
+    Notebook内の init_pw_context で作成されるセッションは、このNotebookの実行に固有となる。
+
+    :param input_path: 実行するNotebookパス
+    :param output_path: 実行後のNotebookの保存先
+    :param parameters: Notebookに注入するパラメータ
+    :param browser: Notebook間で共有するブラウザ。Noneの場合はNotebook内のセッションがブラウザを起動する
+    :return: 実行後のNotebookのパス
+    :raises papermill.PapermillExecutionError: セルの実行に失敗した場合
+    """
+    nb = load_notebook_node(input_path)
+    if parameters:
+        nb = parameterize_notebook(nb, parameters)
+    nb = prepare_notebook_metadata(nb, input_path, output_path)
+    step_headers = _step_headers(nb)
+
+    start_time = _now()
+    nb.metadata.papermill['start_time'] = start_time.isoformat()
+    nb.metadata.papermill['exception'] = None
+    for cell in nb.cells:
+        if cell.cell_type == 'code':
+            cell.execution_count = None
+            cell.outputs = []
+        cell.metadata.papermill = dict(start_time=None, end_time=None, duration=None, status='pending', exception=None)
+
+    _, filename = os.path.split(input_path)
+    namespace = dict(__name__='__main__')
+    shell = _Shell(namespace)
+    namespace['get_ipython'] = lambda: shell
+    execution_count = 0
+    current_header = None
+    async with pw.session_scope(browser=browser):
+        for cell in nb.cells:
+            if cell.cell_type != 'code':
+                continue
+            header = step_headers.get(id(cell))
+            if header is not None and header != current_header:
+                print(f'  [{filename}] {header}')
+                current_header = header
+            execution_count += 1
+            if not await _execute_cell(cell, execution_count, namespace, filename):
+                nb.metadata.papermill['exception'] = True
+                break
+
+    end_time = _now()
+    nb.metadata.papermill['end_time'] = end_time.isoformat()
+    nb.metadata.papermill['duration'] = (end_time - start_time).total_seconds()
+    for cell in nb.cells:
+        if cell.metadata.papermill['status'] == 'failed':
+            break
+        if cell.metadata.papermill['status'] == 'pending':
+            cell.metadata.papermill['status'] = 'completed'
+    raise_for_execution_errors(nb, output_path)
+    write_ipynb(nb, output_path)
+    return output_path
+
+
+async def execute_notebooks(jobs, concurrency=4, manifest=None):
+    """
+    複数のNotebookを、1つのブラウザを共有するasyncioタスクとして並行に実行する。
+
+    :param jobs: execute_notebook の引数(input_path, output_path, parameters)の辞書のリスト
+    :param concurrency: 同時に実行するNotebookの最大数
+    :param manifest: 実行を記録する runManifest.Manifest
+    :return: jobsの順に、実行後のNotebookのパスまたは発生した例外のリスト
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _RoutedStream('stdout', stdout)
+    sys.stderr = _RoutedStream('stderr', stderr)
+    try:
+        async with async_playwright() as playwright:
+            browser = await pw.launch_browser(playwright)
+
+            async def run_job(job):
+                async with semaphore:
+                    print(f'Running notebook: {job["input_path"]}')
+                    parameters = job.get('parameters') or {}
+                    recording = nullcontext() if manifest is None else manifest.record(
+                        job['output_path'],
+                        input_notebook=job['input_path'],
+                        parameters=parameters,
+                        result_path=parameters.get('default_result_path'),
+                    )
+                    with recording:
+                        return await execute_notebook(browser=browser, **job)
+
+            try:
+                return await asyncio.gather(*[run_job(job) for job in jobs], return_exceptions=True)
+            finally:
+                await browser.close()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def run_notebooks(jobs, concurrency=4, manifest=None):
+    """execute_notebooks を新しいイベントループで実行する。"""
+    return asyncio.run(execute_notebooks(jobs, concurrency=concurrency, manifest=manifest))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run test notebooks concurrently in a single process sharing one browser'
+    )
+    parser.add_argument('notebooks', nargs='+', help='Notebooks to run')
+    parser.add_argument('--result-dir', required=True, help='Directory to write executed notebooks to')
+    parser.add_argument('--parameters', help='YAML file with parameters injected into every notebook')
+    parser.add_argument('--concurrency', type=int, default=4, help='Maximum number of notebooks run at the same time')
+    args = parser.parse_args()
+
+    parameters = {}
+    if args.parameters:
+        with open(args.parameters) as f:
+            parameters = yaml.load(f.read(), yaml.SafeLoader) or {}
+    os.makedirs(args.result_dir, exist_ok=True)
+    jobs = []
+    for notebook in args.notebooks:
+        result_id, _ = os.path.splitext(os.path.basename(notebook))
+        result_path = os.path.join(args.result_dir, result_id)
+        os.makedirs(result_path, exist_ok=True)
+        jobs.append(dict(
+            input_path=notebook,
+            output_path=os.path.join(args.result_dir, result_id + '.ipynb'),
+            parameters=dict(parameters, default_result_path=result_path),
+        ))
+
+    manifest = runManifest.Manifest(os.path.join(args.result_dir, runManifest.FILENAME))
+    failed = 0
+    for job, result in zip(jobs, run_notebooks(jobs, concurrency=args.concurrency, manifest=manifest)):
+        if isinstance(result, BaseException):
+            failed += 1
+            print(f'FAILED: {job["input_path"]} ({type(result).__name__})')
+        else:
+            print(f'SUCCESS: {job["input_path"]}')
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
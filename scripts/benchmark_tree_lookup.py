@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of file tree lookups: document-wide XPath vs. grdm.FileTree.
+
+A synthetic Treebeard-like tree with N rows is rendered with page.set_content,
+then the same file row is located repeatedly with each strategy.
+
+Usage: python -m scripts.benchmark_tree_lookup [N ...]
+"""
+
+import asyncio
+import sys
+import time
+
+from playwright.async_api import async_playwright
+
+from scripts import grdm
+
+
+def build_tree_html(size):
+    rows = []
+    rows.append(
+        '<div class="tb-row" data-id="storage" data-level="1">'
+        '<div class="tb-td tb-td-first"><span class="tb-toggle-icon"><i class="fa fa-minus"></i></span>'
+        '<span class="tb-expand-icon-holder"><div style="background-image: url(/static/addons/osfstorage/comicon.png)"></div></span></div>'
+        '<div class="title-text"><span>NII Storage</span></div></div>'
+    )
+    for i in range(size):
+        rows.append(
+            f'<div class="tb-row" data-id="file-{i}" data-level="2">'
+            '<div class="tb-td tb-td-first"><span class="tb-expand-icon-holder"><div><span class="file-extension _txt"></span></div></span></div>'
+            f'<div class="title-text"><span>file-{i:06d}.txt</span></div></div>'
+        )
+    return f'<html><body><div id="tb-tbody">{"".join(rows)}</div></body></html>'
+
+
+async def measure(locator_factory, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        assert await (await locator_factory()).count() == 1
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def run(sizes, repeat=20):
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"])
+        page = await browser.new_page()
+        print(f'{"rows":>8} {"xpath(ms)":>10} {"resolve(ms)":>11} {"cached(ms)":>11}')
+        for size in sizes:
+            await page.set_content(build_tree_html(size))
+            name = f'file-{size - 1:06d}.txt'
+
+            async def xpath_locator():
+                return grdm.get_select_file_title_locator(page, name)
+            xpath_ms = await measure(xpath_locator, repeat)
+            tree = grdm.FileTree(page, storage='NII Storage')
+
+            async def uncached_locator():
+                tree.invalidate()
+                return await tree.file_title(name)
+            resolve_ms = await measure(uncached_locator, repeat)
+            cached_ms = await measure(lambda: tree.file_title(name), repeat)
+            print(f'{size:>8} {xpath_ms:>10.2f} {resolve_ms:>11.2f} {cached_ms:>11.2f}')
+        await browser.close()
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    asyncio.run(run(sizes))
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-import json
 import sys
 import re
 
+try:
+    from scripts import notebookStream
+except ImportError:
+    # Executed as `python scripts/clean_output.py`
+    import notebookStream
+
 def contains_rdm_nii_url(content):
     """Check if content contains rdm.nii.ac.jp URL."""
     if isinstance(content, str):
@@ -41,32 +46,21 @@ def contains_aws_access_token(content):
 
 def clean_outputs_with_rdm_nii(notebook_path):
     """Remove outputs from cells containing rdm.nii.ac.jp, email addresses, or AWS access tokens in outputs."""
-    with open(notebook_path, 'r', encoding='utf-8') as f:
-        notebook = json.load(f)
-    
-    modified = False
-    cleaned_count = 0
-    
-    # Process each cell
-    for cell in notebook.get('cells', []):
+    def clean_cell(cell):
         # Check outputs only
-        if 'outputs' in cell and len(cell['outputs']) > 0:
-            output_contains_sensitive = False
-            
-            for output in cell['outputs']:
-                if contains_rdm_nii_url(output) or contains_email(output) or contains_aws_access_token(output):
-                    output_contains_sensitive = True
-                    break
-            
-            # If output contains sensitive information, clear outputs
-            if output_contains_sensitive:
+        if 'outputs' not in cell or len(cell['outputs']) == 0:
+            return False
+        for output in cell['outputs']:
+            if contains_rdm_nii_url(output) or contains_email(output) or contains_aws_access_token(output):
+                # If output contains sensitive information, clear outputs
                 cell['outputs'] = []
-                modified = True
-                cleaned_count += 1
+                return True
+        return False
+    
+    # Cells are streamed one at a time so that huge result notebooks are not loaded at once
+    cleaned_count = notebookStream.rewrite_cells(notebook_path, clean_cell)
     
-    if modified:
-        with open(notebook_path, 'w', encoding='utf-8') as f:
-            json.dump(notebook, f, indent=1, ensure_ascii=False)
+    if cleaned_count > 0:
         print(f"Updated: {notebook_path} (cleaned outputs from {cleaned_count} cells containing sensitive information)")
     else:
         print(f"No changes needed: {notebook_path}")
@@ -0,0 +1,139 @@
+# ステップ実行中のCPUプロファイル(CDP Profiler)とChromiumトレースの取得
+#
+# run_pw でプロファイル対象に指定されたステップ、またはしきい値を設定した場合は全てのステップについて
+# プロファイラを動かしておき、指定されたステップとしきい値を超えたステップのみ結果を保存する。
+# サンプリングプロファイラの負荷は小さいため、しきい値による取得は常時有効にしても差し支えない。
+#
+# 保存するファイル(結果ディレクトリの profiles/ 配下):
+# - {name}.cpuprofile: Chrome DevToolsのPerformanceパネル等で開けるCPUプロファイル
+# - {name}.trace.json: トレース(Perfetto、chrome://tracing で開ける)。トレースを指定した場合のみ
+# - {name}.txt: 自己時間の長い関数の一覧
+#
+# ヘッドレスのChromiumで動作し、GPUは不要。
+
+import json
+import os
+
+ENV_PROFILE_THRESHOLD = 'GRDM_PROFILE_THRESHOLD'
+
+# サンプリング間隔(マイクロ秒)
+SAMPLING_INTERVAL = 1000
+TRACE_CATEGORIES = [
+    'devtools.timeline',
+    'disabled-by-default-devtools.timeline',
+    'disabled-by-default-devtools.timeline.frame',
+    'v8.execute',
+    'blink.user_timing',
+    'loading',
+    'latencyInfo',
+]
+# 自己時間の集計から除外する疑似ノード
+EXCLUDED_FUNCTIONS = ('(idle)', '(root)')
+
+
+def threshold_from_environ():
+    """環境変数で指定されたしきい値(秒)を返す。指定がなければNoneを返す。"""
+    value = os.environ.get(ENV_PROFILE_THRESHOLD)
+    if not value:
+        return None
+    return float(value)
+
+
+class StepProfiler:
+    """
+    1つのステップの間、ページのCPUプロファイル(とトレース)を取得する。
+
+    :param context: ページのブラウザコンテキスト
+    :param page: プロファイル対象のページ
+    :param browser: トレースも取得する場合はブラウザ。トレースはブラウザごとに同時に1つしか取得できないため、
+        他のステップがトレース中の場合はCPUプロファイルのみとなる
+    """
+
+    def __init__(self, context, page, browser=None):
+        self.context = context
+        self.page = page
+        self.browser = browser
+        self.cdp = None
+        self.tracing = False
+
+    async def start(self):
+        self.cdp = await self.context.new_cdp_session(self.page)
+        await self.cdp.send('Profiler.enable')
+        await self.cdp.send('Profiler.setSamplingInterval', dict(interval=SAMPLING_INTERVAL))
+        await self.cdp.send('Profiler.start')
+        if self.browser is not None:
+            try:
+                await self.browser.start_tracing(page=self.page, categories=TRACE_CATEGORIES)
+                self.tracing = True
+            except Exception as e:
+                print(f'Tracing is not available: {e}')
+        return self
+
+    async def stop(self):
+        """プロファイルを停止し、(CPUプロファイル, トレースのJSONバイト列またはNone)を返す。"""
+        trace = None
+        try:
+            if self.tracing:
+                trace = await self.browser.stop_tracing()
+                self.tracing = False
+            response = await self.cdp.send('Profiler.stop')
+            await self.cdp.send('Profiler.disable')
+        finally:
+            await self.cdp.detach()
+        return response['profile'], trace
+
+
+def top_self_time(profile, limit=15):
+    """
+    CPUプロファイルから、自己時間の長い関数を返す。
+
+    :return: function, url, line, self_time(ミリ秒), ratio(全サンプル時間に対する比率)を持つ辞書のリスト
+    """
+    nodes = dict((node['id'], node) for node in profile['nodes'])
+    self_times = {}
+    for node_id, delta in zip(profile.get('samples', []), profile.get('timeDeltas', [])):
+        self_times[node_id] = self_times.get(node_id, 0) + delta
+    total = sum(self_times.values())
+    functions = {}
+    for node_id, self_time in self_times.items():
+        frame = nodes[node_id]['callFrame']
+        name = frame['functionName'] or '(anonymous)'
+        if name in EXCLUDED_FUNCTIONS:
+            continue
+        key = (name, frame['url'], frame['lineNumber'] + 1)
+        functions[key] = functions.get(key, 0) + self_time
+    rows = sorted(functions.items(), key=lambda item: -item[1])[:limit]
+    return [
+        dict(
+            function=name,
+            url=url,
+            line=line,
+            self_time=self_time / 1000,
+            ratio=self_time / total if total > 0 else 0.0,
+        )
+        for (name, url, line), self_time in rows
+    ]
+
+
+def format_summary(rows):
+    """top_self_time の結果を表形式の文字列にする。"""
+    lines = ['self(ms)  ratio  function']
+    for row in rows:
+        location = f' {row["url"]}:{row["line"]}' if row['url'] else ''
+        lines.append(f'{row["self_time"]:8.1f}  {row["ratio"] * 100:4.1f}%  {row["function"]}{location}')
+    return '\n'.join(lines)
+
+
+def save(dest_dir, name, profile, trace=None):
+    """プロファイル、トレース、要約を保存し、CPUプロファイルと要約のパスを返す。"""
+    os.makedirs(dest_dir, exist_ok=True)
+    profile_path = os.path.join(dest_dir, f'{name}.cpuprofile')
+    with open(profile_path, 'w') as f:
+        json.dump(profile, f)
+    if trace is not None:
+        with open(os.path.join(dest_dir, f'{name}.trace.json'), 'wb') as f:
+            f.write(trace)
+    summary_path = os.path.join(dest_dir, f'{name}.txt')
+    with open(summary_path, 'w') as f:
+        f.write(format_summary(top_self_time(profile)) + '\n')
+    return profile_path, summary_path
@@ -6,8 +6,20 @@ import os
 import re
 import time
 import traceback
+from urllib.parse import urlparse
 from playwright.async_api import expect
 
+from scripts import prerequisites
+from scripts import projectPool
+from scripts import throttle
+
+
+async def animations_disabled(page):
+    """ページのアニメーションが無効(scripts/noAnimation.py)であればTrueを返す。"""
+    try:
+        return await page.evaluate('() => window.__grdmNoAnimation === true')
+    except Exception:
+        return False
 
 async def login_cas(page, username, password):
     # find_element_by_xpath_with_retry(driver, '').send_keys(username)
@@ -29,6 +41,11 @@ async def expect_idp_login(page, idp_name, timeout=30000):
     login_page_locators = _get_login_page_locators(idp_name)
     await expect(page.locator(login_page_locators['username'])).to_be_editable(timeout=timeout)
 
+def _account_scope(page, idp_name, idp_username, *args, **kwargs):
+    """ログインの失敗をテスト実行全体で共有する範囲(IdPとアカウント)"""
+    return f'{idp_name or "CAS"}/{idp_username}'
+
+@prerequisites.prerequisite(prerequisites.ADMIN_LOGIN, scope=_account_scope)
 async def login_as_admin(page, idp_name, idp_username, idp_password, transition_timeout=30000):
     if idp_name is None or idp_name == 'FakeCAS':
         # CAS/FakeCASでログイン
@@ -66,6 +83,7 @@ async def login_as_admin(page, idp_name, idp_username, idp_password, transition_
         # すでにIdP選択済みとみなし、ユーザー名とパスワード入力を試みる
         await _login_idp_pw(page, idp_name, idp_username, idp_password, transition_timeout=transition_timeout)
 
+@prerequisites.prerequisite(prerequisites.LOGIN, scope=_account_scope)
 async def login(page, idp_name, idp_username, idp_password, transition_timeout=30000):
     if idp_name is None:
         # CASでログイン
@@ -90,7 +108,8 @@ async def login(page, idp_name, idp_username, idp_password, transition_timeout=3
         # IdPが要素として作成されることを確認
         locator = page.locator(f'//*[@class = "list_idp" and text() = "{idp_name}"]')
         await expect(locator).to_be_visible(timeout=transition_timeout)
-        time.sleep(5)
+        if not await animations_disabled(page):
+            await asyncio.sleep(5)
         await locator.click()
 
         # 選択ボタンが有効になったことを確認
@@ -171,21 +190,39 @@ async def expect_dashboard(page, transition_timeout=30000, retries=3):
             remain -= 1
             traceback.print_exc()
             print('Retrying...')
-            # 1分待って再チャレンジ
-            await asyncio.sleep(60)            
+            # 流量制御が有効であればブロック解除まで、無効であれば1分待って再チャレンジ
+            await throttle.wait_after_rate_limited(default_wait=60)
     
-async def ensure_project_exists(page, project_name, transition_timeout=30000):
+@prerequisites.prerequisite(prerequisites.PROJECT, requires=prerequisites.LOGIN)
+async def ensure_project_exists(page, project_name, transition_timeout=30000, use_pool=True):
+    """
+    ダッシュボードに指定された名前のプロジェクトがなければ作成する。作成した場合はTrueを返す。
+
+    :param use_pool: プロジェクトプール(scripts/projectPool.py)が有効であれば、UIで作成する代わりに払い出しを受ける。
+        プロジェクト作成のUIそのものをテストする場合はFalseを指定する
+    """
     await expect(page.locator('//*[@data-test-create-project-modal-button]')).to_have_count(1, timeout=transition_timeout)
     try:
         await expect(page.locator(f'//*[@data-test-dashboard-item-title and text()="{project_name}"]')).to_be_visible()
         return False
     except:
         # プロジェクトが存在しない
+        pool = projectPool.from_environ() if use_pool else None
+        if pool is not None:
+            project_id = await asyncio.to_thread(pool.lease, project_name)
+            print(f'Leased project {project_id} from the project pool: {project_name}')
+            await page.reload()
+            await expect(page.locator('//*[text() = "プロジェクト管理者"]')).to_be_visible(timeout=transition_timeout)
+            await expect(page.locator(f'//*[@data-test-dashboard-item-title and text()="{project_name}"]')).to_be_visible(timeout=transition_timeout)
+            return True
+
         await page.locator('//*[@data-test-create-project-modal-button]').click()
 
         # プロジェクト名フィールドが表示される
         await expect(page.locator('//input[contains(@class, "project-name")]')).to_be_editable(timeout=transition_timeout)
-        time.sleep(1)
+        if not await animations_disabled(page):
+            # モーダルのフェードインを待つ
+            await asyncio.sleep(1)
 
         # プロジェクト名を入力
         await page.locator('//input[contains(@class, "project-name")]').fill(project_name)
@@ -206,18 +243,42 @@ async def ensure_project_exists(page, project_name, transition_timeout=30000):
         await expect(page.locator(f'//*[@data-test-dashboard-item-title and text()="{project_name}"]')).to_be_visible(timeout=transition_timeout)
         return True    
 
-async def delete_project(page, transition_timeout=30000):
+async def delete_project(page, transition_timeout=30000, use_pool=True):
+    """
+    表示中のプロジェクトを削除する。
+
+    :param use_pool: プロジェクトプールから払い出されたプロジェクトであれば、削除はテスト実行の終了時にまとめて行い、
+        ダッシュボードへ遷移するのみとする。プロジェクト削除のUIそのものをテストする場合はFalseを指定する
+    """
+    pool = projectPool.from_environ() if use_pool else None
+    if pool is not None:
+        url = urlparse(page.url)
+        project_id = url.path.strip('/').split('/')[0]
+        if await asyncio.to_thread(pool.is_leased, project_id):
+            await asyncio.to_thread(pool.mark_deleted, project_id)
+            print(f'Project {project_id} will be cleaned up by the project pool')
+            await page.goto(f'{url.scheme}://{url.netloc}/dashboard/')
+            return
+
     await page.locator(f'//ul[contains(@class, "navbar-nav")]//a[text() = "設定"]').click()
-    await asyncio.sleep(3)
-    await page.locator('//button[text() = "プロジェクトを削除" and @data-target = "#nodesDelete"]').click()
+    delete_project_button = page.locator('//button[text() = "プロジェクトを削除" and @data-target = "#nodesDelete"]')
+    no_animation = await animations_disabled(page)
+    if no_animation:
+        await expect(delete_project_button).to_be_visible(timeout=transition_timeout)
+    else:
+        await asyncio.sleep(3)
+    await delete_project_button.click()
 
     confirmation_label = page.locator('//strong[@data-bind = "text: confirmationString"]')
     await expect(confirmation_label).to_have_count(1, timeout=transition_timeout)
     confirmation = await confirmation_label.text_content()
     print(confirmation)
 
-    time.sleep(1)
     confirmation_input = page.locator('//*[@data-bind = "editableHTML: {observable: confirmInput, onUpdate: handleEditableUpdate}"]')
+    if no_animation:
+        await expect(confirmation_input).to_be_editable(timeout=transition_timeout)
+    else:
+        await asyncio.sleep(1)
     await confirmation_input.fill(confirmation)
 
     delete_button = page.locator('//a[contains(@class, "btn-danger") and text() = "削除"]')
@@ -283,9 +344,199 @@ def get_select_file_draggable_locator(page, provider):
 def get_select_file_draggable_xpath(name):
     return f'//*[contains(@class, "tb-expand-icon-holder")]//*[contains(@class, "file-extension")]/../../following-sibling::*[contains(@class, "title-text")]//*[text() = "{name}"]/../..'
 
-async def wait_for_uploaded(page, filename):
-    await expect(page.locator(f'//*[text() = "{filename}"]/../following-sibling::*//*[@role = "progressbar"]')).to_have_count(0, timeout=30000)
-    await expect(get_select_file_title_locator(page, filename)).to_be_visible(timeout=1000)    
+# Treebeardの行(.tb-row)は階層によらず兄弟要素として並び、data-level 属性が階層の深さを示す。
+# ある行の子孫は、その行に続く data-level がより大きい行の並びとなる
+_FIND_TREE_ROW_SCRIPT = '''({containerSelector, storage, names, kind}) => {
+    const container = document.querySelector(containerSelector);
+    if (!container) {
+        return null;
+    }
+    const rows = Array.from(container.querySelectorAll('.tb-row'));
+    const levelOf = (row) => parseInt(row.getAttribute('data-level'), 10);
+    const hasTitle = (row, name, prefix) => Array.from(row.querySelectorAll('.title-text *')).some(
+        (element) => Array.from(element.childNodes).some(
+            (node) => node.nodeType === Node.TEXT_NODE
+                && (prefix ? node.textContent.startsWith(name) : node.textContent === name)
+        )
+    );
+    const isStorage = (row) => row.querySelector('.tb-td-first [style*="/static/addons/"]') !== null;
+    const isFolder = (row) => row.querySelector('.tb-expand-icon-holder i.fa-folder') !== null;
+    const isFile = (row) => row.querySelector('.tb-expand-icon-holder .file-extension') !== null;
+    const isKind = (row, kind) => kind === 'folder' ? isFolder(row) : (kind === 'file' ? isFile(row) : true);
+    // [start, end) のうち、階層が level(nullの場合は問わない)で条件を満たす唯一の行。なければ、または複数あれば -1
+    const findOne = (start, end, level, predicate) => {
+        let found = -1;
+        for (let i = start; i < end; i++) {
+            if ((level === null || levelOf(rows[i]) === level) && predicate(rows[i])) {
+                if (found >= 0) {
+                    return -1;
+                }
+                found = i;
+            }
+        }
+        return found;
+    };
+    const subtreeEnd = (index) => {
+        const level = levelOf(rows[index]);
+        let end = index + 1;
+        while (end < rows.length && levelOf(rows[end]) > level) {
+            end++;
+        }
+        return end;
+    };
+    const storageIndex = (title) => findOne(0, rows.length, null, (row) => isStorage(row) && hasTitle(row, title, true));
+    if (kind === 'storage') {
+        const index = storageIndex(names[0]);
+        return index < 0 ? null : rows[index].getAttribute('data-id');
+    }
+    let start = 0;
+    let end = rows.length;
+    let level = null;
+    if (storage !== null) {
+        const index = storageIndex(storage);
+        if (index < 0) {
+            return null;
+        }
+        [start, end, level] = [index + 1, subtreeEnd(index), levelOf(rows[index]) + 1];
+    }
+    for (let i = 0; i < names.length; i++) {
+        const last = i === names.length - 1;
+        const index = findOne(
+            start, end, level, (row) => hasTitle(row, names[i], false) && isKind(row, last ? kind : 'folder')
+        );
+        if (index < 0) {
+            return null;
+        }
+        if (last) {
+            return rows[index].getAttribute('data-id');
+        }
+        [start, end, level] = [index + 1, subtreeEnd(index), levelOf(rows[index]) + 1];
+    }
+    return null;
+}'''
+
+class FileTree:
+    """
+    Treebeardのファイルツリーの行要素を探索するためのヘルパー。
+
+    行はツリーのコンテナ(#tb-tbody)内の `.tb-row` から、ストレージの行とパスの各要素の行を
+    `data-level` 属性による親子関係でたどって特定する。storage を指定した場合はそのストレージの行の
+    子孫に限定し、異なるストレージやフォルダにある同名の行とは区別する。
+    一度特定した行は (storage, path) をキーとして `data-id` 属性を記録し、以降は
+    `.tb-row[data-id="..."]` で直接参照する。ツリーの内容が変化した(フォルダの削除・移動など)場合は
+    invalidate() を呼び出すこと。
+
+    use_css=False の場合は従来のXPathをコンテナ内で評価し、パスの末尾の要素の名前のみで特定する。
+
+    :param storage: 探索を限定するストレージの名前(「NII Storage」など、表示名の先頭部分)
+    """
+
+    def __init__(self, page, storage=None, container_selector='#tb-tbody', use_css=True):
+        self.page = page
+        self.storage = storage
+        self.container_selector = container_selector
+        self.container = page.locator(container_selector)
+        self.use_css = use_css
+        self._row_ids = {}
+
+    def _key(self, path):
+        return (self.storage, path)
+
+    def _xpath_row_locator(self, path, kind):
+        name = path.split('/')[-1]
+        if kind == 'storage':
+            title_xpath = get_select_storage_title_xpath(name)
+        elif kind == 'folder':
+            title_xpath = get_select_folder_title_xpath(name)
+        elif kind == 'file':
+            title_xpath = get_select_file_title_xpath(name)
+        else:
+            title_xpath = f'//*[contains(@class, "title-text")]//*[text() = "{name}"]'
+        return self.container.locator(f'{title_xpath}/ancestor::*[contains(@class, "tb-row")][1]')
+
+    async def row(self, path, kind=None, timeout=30000):
+        """
+        指定されたパスの行を特定し、その行を示すLocatorを返す。
+
+        該当する行が1つに定まらない(同じ階層に同名の行が複数ある)場合は、タイムアウトまで待って失敗する。
+        :param path: ストレージ以下のパス('/'区切り)。kind='storage' の場合はストレージの名前
+        :param kind: 'storage', 'folder', 'file' のいずれか、またはNone(種別を問わない)
+        """
+        if not self.use_css:
+            return self._xpath_row_locator(path, kind)
+        row_id = self._row_ids.get(self._key(path))
+        if row_id is None:
+            handle = await self.page.wait_for_function(
+                _FIND_TREE_ROW_SCRIPT,
+                arg=dict(
+                    containerSelector=self.container_selector,
+                    storage=self.storage,
+                    names=[name for name in path.split('/') if name],
+                    kind=kind,
+                ),
+                polling=100,
+                timeout=timeout,
+            )
+            row_id = await handle.json_value()
+            await handle.dispose()
+            self._row_ids[self._key(path)] = row_id
+        return self.container.locator(f'.tb-row[data-id="{row_id}"]')
+
+    def invalidate(self, path=None):
+        """キャッシュされた行を破棄する。pathを省略した場合は全て破棄する。"""
+        if path is None:
+            self._row_ids.clear()
+            return
+        self._row_ids.pop(self._key(path), None)
+
+    async def _locate(self, path, kind, xpath, timeout):
+        if not self.use_css:
+            return self.container.locator(xpath)
+        # 行の内側に限定してXPathを評価する(Playwrightは連結されたXPathを相対パスとして扱う)
+        row = await self.row(path, kind=kind, timeout=timeout)
+        return row.locator(xpath)
+
+    async def storage_title(self, provider=None, expanded=False, timeout=30000):
+        provider = provider or self.storage
+        if expanded:
+            xpath = get_select_expanded_storage_title_xpath(provider)
+        else:
+            xpath = get_select_storage_title_xpath(provider)
+        return await self._locate(provider, 'storage', xpath, timeout)
+
+    async def folder_title(self, path, timeout=30000):
+        return await self._locate(path, 'folder', get_select_folder_title_xpath(path.split('/')[-1]), timeout)
+
+    async def folder_toggle(self, path, expanded=False, collapsed=False, timeout=30000):
+        xpath = get_select_folder_toggle_xpath(path.split('/')[-1], expanded=expanded, collapsed=collapsed)
+        return await self._locate(path, 'folder', xpath, timeout)
+
+    async def folder_droppable(self, path, timeout=30000):
+        return await self._locate(path, 'folder', get_select_folder_droppable_xpath(path.split('/')[-1]), timeout)
+
+    async def folder_draggable(self, path, timeout=30000):
+        return await self._locate(path, 'folder', get_select_folder_draggable_xpath(path.split('/')[-1]), timeout)
+
+    async def file_title(self, path, timeout=30000):
+        return await self._locate(path, 'file', get_select_file_title_xpath(path.split('/')[-1]), timeout)
+
+    async def file_extension(self, path, timeout=30000):
+        return await self._locate(path, 'file', get_select_file_extension_xpath(path.split('/')[-1]), timeout)
+
+    async def file_draggable(self, path, timeout=30000):
+        return await self._locate(path, 'file', get_select_file_draggable_xpath(path.split('/')[-1]), timeout)
+
+async def wait_for_uploaded(page, filename, storage=None):
+    """
+    ファイルのアップロードの完了を待つ。
+
+    :param filename: ファイル名、またはストレージ以下のパス('/'区切り)
+    :param storage: ファイルをアップロードしたストレージの名前。指定した場合、他のストレージの同名のファイルと区別する
+    """
+    name = filename.split('/')[-1]
+    await expect(page.locator(f'//*[text() = "{name}"]/../following-sibling::*//*[@role = "progressbar"]')).to_have_count(0, timeout=30000)
+    title = await FileTree(page, storage=storage).file_title(filename, timeout=1000)
+    await expect(title).to_be_visible(timeout=1000)
 
 def _bytes_to_data_url(byte_data, mime_type="application/octet-stream"):
     """バイト配列をDataURLに変換"""
@@ -332,29 +583,86 @@ async def drop_file(page, element_locator, path):
     })
     await data_transfer.dispose()
 
-async def drag_and_drop(page, source, dest):
+_CENTER_SCRIPT = '''element => {
+    const rect = element.getBoundingClientRect();
+    return {
+        x: rect.left + rect.width / 2,
+        y: rect.top + rect.height / 2
+    };
+}'''
+
+async def _is_hovered(dest, hover_class):
+    return await dest.evaluate('(element, hoverClass) => element.classList.contains(hoverClass)', hover_class)
+
+async def drag_and_drop(page, source, dest, timeout=5000, max_steps=30, hover_class='ui-droppable-hover', fixed_delay=None):
+    """
+    jQuery UIのdraggableをdroppableにドラッグ&ドロップする。
+
+    固定の待ち時間の代わりに、ドラッグの開始(ui-draggable-dragging)とドロップ先のホバー(hover_class)を待つ。
+    ドロップ先までは少ないステップで移動し、ホバーが報告されない場合のみ細かく移動する(最大 max_steps ステップ)。
+    ドラッグを開始できなかった場合や、max_steps までにドロップ先のホバーが報告されなかった場合は、
+    ドロップせずにドラッグ元に戻して離し、例外を送出する。
+
+    :param fixed_delay: 比較用。ミリ秒を指定すると従来どおり固定の待ち時間と30ステップで移動する
+    :return: 所要時間(秒)
+    """
+    start_time = time.time()
     await expect(source).to_have_class(re.compile('.*ui-draggable.*'))
     await expect(dest).to_have_class(re.compile('.*ui-droppable.*'))
 
-    center_coordinates_source = await source.evaluate('''element => {
-        const rect = element.getBoundingClientRect();
-        return {
-            x: rect.left + rect.width / 2,
-            y: rect.top + rect.height / 2
-        };
-    }''')
-
-    center_coordinates_dest = await dest.evaluate('''element => {
-        const rect = element.getBoundingClientRect();
-        return {
-            x: rect.left + rect.width / 2,
-            y: rect.top + rect.height / 2
-        };
-    }''')
+    center_coordinates_source = await source.evaluate(_CENTER_SCRIPT)
+    center_coordinates_dest = await dest.evaluate(_CENTER_SCRIPT)
+    sx, sy = center_coordinates_source['x'], center_coordinates_source['y']
+    dx, dy = center_coordinates_dest['x'], center_coordinates_dest['y']
 
-    await page.mouse.move(center_coordinates_source['x'], center_coordinates_source['y'])
+    await page.mouse.move(sx, sy)
     await page.mouse.down()
-    await page.wait_for_timeout(1000)
-    await page.mouse.move(center_coordinates_dest['x'], center_coordinates_dest['y'], steps=30)
-    await page.wait_for_timeout(1000)
+    if fixed_delay is not None:
+        await page.wait_for_timeout(fixed_delay)
+        await page.mouse.move(dx, dy, steps=30)
+        await page.wait_for_timeout(fixed_delay)
+        await page.mouse.up()
+        elapsed = time.time() - start_time
+        print(f'drag_and_drop: {elapsed:.2f}s (fixed delay {fixed_delay}ms)')
+        return elapsed
+
+    steps = 0
+    try:
+        # jQuery UIはマウスが distance 以上動いてからドラッグを開始する
+        await page.mouse.move(sx + 5, sy + 5, steps=2)
+        steps += 2
+        await expect(page.locator('.ui-draggable-dragging').first).to_be_attached(timeout=timeout)
+    except:
+        # ドラッグを開始できなかった場合は、元の位置で離して中止する
+        await page.mouse.move(sx, sy)
+        await page.mouse.up()
+        raise
+    await page.mouse.move(dx, dy, steps=5)
+    steps += 5
+    hovered = await _is_hovered(dest, hover_class)
+    while not hovered and steps < max_steps:
+        # ドロップ先の中心付近で小さく動かし、ホバー判定を促す
+        offset = 2 if steps % 2 == 0 else -2
+        await page.mouse.move(dx + offset, dy + offset)
+        steps += 1
+        hovered = await _is_hovered(dest, hover_class)
+    if not hovered:
+        # カーソル下の別の要素にドロップしないよう、ドラッグ元に戻して離す
+        await page.mouse.move(sx, sy, steps=5)
+        await page.mouse.up()
+        raise Exception(f'Drop target did not report {hover_class} within {steps} steps')
     await page.mouse.up()
+    elapsed = time.time() - start_time
+    print(f'drag_and_drop: {elapsed:.2f}s ({steps} steps)')
+    return elapsed
+
+async def drag_and_drop_all(page, pairs, **kwargs):
+    """
+    複数の(ドラッグ元, ドロップ先)を順にドラッグ&ドロップする。
+
+    :param pairs: (source, dest) のロケータの組のリスト
+    :return: 各ドラッグ&ドロップの所要時間(秒)のリスト
+    """
+    elapsed = [await drag_and_drop(page, source, dest, **kwargs) for source, dest in pairs]
+    print(f'drag_and_drop_all: {sum(elapsed):.2f}s for {len(elapsed)} drag(s)')
+    return elapsed
@@ -0,0 +1,247 @@
+# テスト結果の静的HTML報告書
+#
+# Excelの報告書(testReport.create_workbook)と同じ列を持つ、次の構成のHTMLを結果ディレクトリの report/ に作成する。
+# - index.html: サマリ(workbook.summary_columns の列)
+# - cases/<テストID>.html: テストケースごとのページ(workbook.case_result_sheet_headers の列)
+# - thumbnails/<テストID>/<ステップ番号>.webp: スクリーンショットの縮小画像
+# ステップのスクリーンショットは縮小画像を遅延読み込みで表示し、screenshots/ の元の画像へリンクする。
+# 動画(video-*.webm)とHAR(har.zip)は、実行マニフェストに記録されたNotebookの証跡へリンクする。
+# テストケースのページと縮小画像は、テストケースごとに別プロセスで並列に作成する。
+# 縮小画像は元の画像より新しければ作り直さない。
+#
+# 報告書のファイルは結果ディレクトリからの相対パスでリンクするため、結果ディレクトリごと移動・展開しても開ける。
+
+import html
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from PIL import Image
+
+from scripts import runManifest
+from scripts import testReport
+from scripts.workbook import case_result_sheet_headers, summary_columns
+
+REPORT_DIRNAME = 'report'
+THUMBNAIL_WIDTH = 480
+THUMBNAIL_QUALITY = 70
+
+STYLE = '''body { font-family: sans-serif; font-size: 13px; margin: 16px; }
+table { border-collapse: collapse; margin-bottom: 16px; }
+th { background: #AED6F1; }
+th, td { border: 1px solid #ccc; padding: 2px 6px; vertical-align: top; }
+td.purpose, td.comment { white-space: pre-wrap; }
+.failed .result, tr.failed .succeeded { color: #c0392b; font-weight: bold; }
+.blocked .result, tr.blocked .succeeded { color: #7f8c8d; font-weight: bold; }
+img.thumbnail { display: block; background: #eee; }
+'''
+
+
+def _thumbnail(source, dest):
+    """スクリーンショットを THUMBNAIL_WIDTH に縮小したWebPを作成し、(幅, 高さ)を返す。"""
+    if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(source):
+        with Image.open(dest) as image:
+            return image.size
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with Image.open(source) as image:
+        image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4))
+        image.save(dest, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        return image.size
+
+
+def _link(href, text):
+    return f'<a href="{html.escape(href)}">{html.escape(text)}</a>'
+
+
+def _table(headers, rows, classes=None):
+    header_cells = ''.join(f'<th>{html.escape(text)}</th>' for _, text in headers)
+    body = []
+    for i, row in enumerate(rows):
+        row_class = f' class="{classes[i]}"' if classes else ''
+        cells = ''.join(f'<td class="{key}">{row.get(key, "")}</td>' for key, _ in headers)
+        body.append(f'<tr{row_class}>{cells}</tr>')
+    return f'<table>\n<thead><tr>{header_cells}</tr></thead>\n<tbody>\n' + '\n'.join(body) + '\n</tbody>\n</table>'
+
+
+def _page(title, body, style_href):
+    return f'''<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<link rel="stylesheet" href="{html.escape(style_href)}">
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+
+def _headers(name):
+    """case_result_sheet_headers の列のうち、見出しのある列を返す。"""
+    return [(key, text) for key, text in case_result_sheet_headers[name] if text]
+
+
+def _write_case_page(task):
+    """テストケースのページと縮小画像を作成する。別プロセスで実行するため、引数はまとめて1つの辞書で受け取る。"""
+    case = task['case']
+    result_dir = task['result_dir']
+    report_dir = os.path.join(result_dir, REPORT_DIRNAME)
+    cases_dir = os.path.join(report_dir, 'cases')
+    test_id = case['id']
+    attrs = case['attrs']
+    escape = lambda value: html.escape(str(value))
+    result = testReport.RESULT_LABELS[case['status']]
+
+    formal = dict(
+        id=escape(test_id),
+        subsystem_name=escape(attrs.get('サブシステム名', '')),
+        category=escape(attrs.get('機能分類', '')),
+        target_type=escape(attrs.get('ページ/アドオン', '')),
+        designer=escape(task['author']),
+        create_date=escape(task['date']),
+        fix_date='',
+    )
+    semantical = dict(
+        abstract=escape(attrs.get('概要', case['title'])),
+        required_data=escape(attrs.get('用意するテストデータ', '')),
+        result=escape(result),
+        ticket_url=escape(task['ticket_number']),
+        owner=escape(task['author']),
+        date=escape(task['date']),
+        comment='',
+        confirmed='',
+        confirm_date='',
+    )
+
+    screenshots = dict(case['screenshots'])
+    steps = []
+    for step in case['steps']:
+        # ステップの結果を示すスクリーンショットは、そのステップのセルの出力(次のステップの直前)にある
+        screenshot = ''
+        source = testReport.screenshot_path(result_dir, test_id, step['index'])
+        if step['index'] in screenshots and os.path.exists(source):
+            dest = os.path.join(report_dir, 'thumbnails', test_id, f'{step["index"]:05d}.webp')
+            width, height = _thumbnail(source, dest)
+            screenshot = (
+                f'<a href="{html.escape(os.path.relpath(source, cases_dir))}">'
+                f'<img class="thumbnail" src="{html.escape(os.path.relpath(dest, cases_dir))}" '
+                f'width="{width}" height="{height}" loading="lazy" alt="{escape(step["title"])}"></a>'
+            )
+        steps.append(dict(
+            index=escape(step['index']),
+            title=escape(step['title']),
+            purpose=escape(step['purpose']),
+            succeeded=testReport.STEP_MARKS[step['status']],
+            comment=escape(step['comment']),
+            who_executed='Playwright',
+            date=escape(task['date']),
+            screenshot=screenshot,
+        ))
+
+    evidences = [_link(os.path.relpath(case['notebook'], cases_dir), os.path.basename(case['notebook']))]
+    evidences += [_link(os.path.relpath(path, cases_dir), os.path.basename(path)) for path in task['artifacts']]
+    body = '\n'.join([
+        f'<p>{_link("../index.html", "サマリ")}</p>',
+        f'<h1>{escape(test_id)} {escape(case["title"])}</h1>',
+        _table(_headers('formal'), [formal]),
+        _table(_headers('semantical'), [semantical], classes=[case['status']]),
+        '<table><tbody><tr><th>確認環境</th><td>Ubuntu</td><td>Chrome(Playwright)</td><td>ja-JP</td></tr></tbody></table>',
+        f'<p>証跡: {" / ".join(evidences)}</p>',
+        _table(_headers('steps'), steps, classes=[step['status'] for step in case['steps']]),
+    ])
+    with open(os.path.join(cases_dir, f'{test_id}.html'), 'w', encoding='utf-8') as f:
+        f.write(_page(f'{test_id} {case["title"]}', body, '../style.css'))
+    return test_id
+
+
+def _evidence_artifacts(paths):
+    """証跡のうち、動画とHARのパスを返す。"""
+    return [
+        str(path) for path in paths
+        if os.path.basename(path) == 'har.zip'
+        or (os.path.basename(path).startswith('video-') and str(path).endswith('.webm'))
+    ]
+
+
+def build(cases, result_dir, author='GitHub Actions', ticket_number='00000', artifacts=None, workers=None):
+    """
+    テストIDを割り当て、スクリーンショットをコピーしたテストケースからHTMLの報告書を作成する。
+
+    :param artifacts: Notebookのパスから、その証跡のパスのリストへの辞書(runManifest のエントリの artifacts)。
+        指定のないNotebookは、Notebookと同名のディレクトリの直下から探す
+    :param workers: 並列に処理するプロセスの数。Noneの場合はCPUの数
+    :return: index.html のパス
+    """
+    artifacts = artifacts or {}
+    date = datetime.now().strftime('%Y-%m-%d')
+    report_dir = os.path.join(result_dir, REPORT_DIRNAME)
+    os.makedirs(os.path.join(report_dir, 'cases'), exist_ok=True)
+    with open(os.path.join(report_dir, 'style.css'), 'w') as f:
+        f.write(STYLE)
+
+    tasks = []
+    for case in cases:
+        paths = artifacts.get(case['notebook'])
+        if paths is None:
+            evidence_dir = os.path.splitext(case['notebook'])[0]
+            paths = [os.path.join(evidence_dir, name) for name in sorted(os.listdir(evidence_dir))] \
+                if os.path.isdir(evidence_dir) else []
+        tasks.append(dict(
+            case=case,
+            result_dir=result_dir,
+            author=author,
+            ticket_number=ticket_number,
+            date=date,
+            artifacts=_evidence_artifacts(paths),
+        ))
+    with testReport.process_pool(workers) as executor:
+        for _ in executor.map(_write_case_page, tasks, chunksize=4):
+            pass
+
+    rows = []
+    for case in cases:
+        row = dict(
+            (key, html.escape(str(value)))
+            for key, value in testReport.summary_row(case, author, ticket_number, date).items()
+        )
+        row['sheet'] = _link(f'cases/{case["id"]}.html', case['id'])
+        row['link'] = _link(os.path.relpath(case['notebook'], report_dir), os.path.basename(case['notebook']))
+        rows.append(row)
+    failed = sum(1 for case in cases if case['status'] == testReport.FAILED)
+    blocked = sum(1 for case in cases if case['status'] == testReport.BLOCKED)
+    body = '\n'.join([
+        f'<p>{len(cases)}件(失敗 {failed}件、ブロック {blocked}件) {html.escape(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}</p>',
+        _table(summary_columns, rows, classes=[case['status'] for case in cases]),
+    ])
+    index_path = os.path.join(report_dir, 'index.html')
+    with open(index_path, 'w', encoding='utf-8') as f:
+        f.write(_page('テスト結果', body, 'style.css'))
+    return index_path
+
+
+def build_from_result_dir(result_dir, author='GitHub Actions', ticket_number='00000', workers=None):
+    """実行マニフェストに記録されたNotebookからHTMLの報告書を作成する。"""
+    entries = runManifest.load_entries(result_dir)
+    if entries is None:
+        raise ValueError(f'No run manifest found in {result_dir}')
+    cases = []
+    artifacts = {}
+    with tempfile.TemporaryDirectory() as image_dir:
+        for index, entry in enumerate(entries):
+            if not entry['notebook'].exists():
+                continue
+            artifacts[str(entry['notebook'])] = entry['artifacts']
+            cases += testReport.extract_cases(str(entry['notebook']), os.path.join(image_dir, str(index)))
+        cases = testReport.assign_test_ids(cases)
+        testReport.copy_screenshots(cases, result_dir)
+    return build(cases, result_dir, author=author, ticket_number=ticket_number, artifacts=artifacts, workers=workers)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python -m scripts.htmlReport <result_dir> [author] [ticket]', file=sys.stderr)
+        sys.exit(2)
+    print(f'HTML report saved to: {build_from_result_dir(*sys.argv[1:4])}')
@@ -0,0 +1,148 @@
+# papermillで実行するNotebookのために、事前に起動したJupyterカーネルを払い出すためのユーティリティ
+#
+# カーネルの起動と重いモジュール(pandas, playwright, scripts.*)のimportをバックグラウンドで済ませておき、
+# papermillの実行時に `km` 引数として渡す。Notebook間の独立性を保つため、使用済みのカーネルは
+# 再利用せずに停止し、代わりのカーネルを起動して補充する。
+# プールを持つのは最上位のプロセス(ランナー、または直接実行した取りまとめNotebook)のみとし、
+# プールから払い出すカーネルの環境変数からは GRDM_KERNEL_POOL_SIZE を除く。
+
+import atexit
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_core.utils import run_sync
+
+ENV_POOL_SIZE = 'GRDM_KERNEL_POOL_SIZE'
+
+# Notebookは scripts.playwright と scripts.grdm を importlib.reload で読み込み直すため、
+# それら自体ではなく、読み込み直されない依存モジュールをimportしておく
+PRELOAD_CODE = '''
+import importlib
+import pandas
+import IPython.display
+import playwright.async_api
+import nbformat
+import openpyxl
+import PIL.Image
+import scripts.cpuProfile
+import scripts.networkProfile
+import scripts.noAnimation
+import scripts.prerequisites
+import scripts.projectPool
+import scripts.stepTimeouts
+import scripts.throttle
+import scripts.webPerf
+import scripts.papermillHelpers
+'''
+
+
+def _kernel_env():
+    """払い出すカーネルの環境変数。カーネル内の取りまとめNotebookが入れ子のプールを起動しないようにする。"""
+    env = dict(os.environ)
+    env.pop(ENV_POOL_SIZE, None)
+    return env
+
+
+async def _start_kernel(kernel_name, cwd, preload_code, startup_timeout):
+    km = AsyncKernelManager(kernel_name=kernel_name)
+    await km.start_kernel(cwd=cwd, env=_kernel_env())
+    kc = km.client()
+    kc.start_channels()
+    try:
+        await kc.wait_for_ready(timeout=startup_timeout)
+        if preload_code:
+            reply = await kc.execute_interactive(preload_code, store_history=False, timeout=startup_timeout)
+            if reply['content']['status'] != 'ok':
+                print(f'Failed to preload modules: {reply["content"].get("evalue")}')
+    finally:
+        kc.stop_channels()
+    return km
+
+
+async def _shutdown_kernel(km):
+    await km.shutdown_kernel(now=True)
+
+
+class KernelPool:
+    """
+    事前に起動したカーネルを保持するプール。
+
+    :param size: 起動しておくカーネル数
+    :param kernel_name: カーネル名
+    :param cwd: カーネルの作業ディレクトリ(Notebookの配置ディレクトリ)
+    :param preload_code: カーネル起動直後に実行するコード
+    """
+
+    def __init__(self, size, kernel_name='python3', cwd=None, preload_code=PRELOAD_CODE, startup_timeout=60):
+        self.size = size
+        self.kernel_name = kernel_name
+        self.cwd = cwd or os.getcwd()
+        self.preload_code = preload_code
+        self.startup_timeout = startup_timeout
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='kernel-pool')
+        self._lock = threading.Lock()
+        self._pending = []
+        self._closed = False
+        for _ in range(size):
+            self._refill()
+
+    def _refill(self):
+        future = self._executor.submit(
+            run_sync(_start_kernel), self.kernel_name, self.cwd, self.preload_code, self.startup_timeout,
+        )
+        self._pending.append(future)
+
+    def acquire(self):
+        """起動済みのカーネルを1つ取り出す。プールが空の場合は起動を待つ。"""
+        with self._lock:
+            if self._closed:
+                raise Exception('Kernel pool is closed')
+            future = self._pending.pop(0)
+            self._refill()
+        return future.result()
+
+    def release(self, km):
+        """使用済みのカーネルを停止する。"""
+        try:
+            run_sync(_shutdown_kernel)(km)
+        except:
+            traceback.print_exc()
+
+    @contextmanager
+    def kernel(self):
+        km = self.acquire()
+        try:
+            yield km
+        finally:
+            self.release(km)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            pending = self._pending
+            self._pending = []
+        for future in pending:
+            try:
+                self.release(future.result())
+            except:
+                traceback.print_exc()
+        self._executor.shutdown(wait=True)
+
+
+_default_pool = None
+
+
+def default_pool():
+    """環境変数でプールサイズが指定されていれば、プロセス内で共有するKernelPoolを返す。指定がなければNoneを返す。"""
+    global _default_pool
+    size = int(os.environ.get(ENV_POOL_SIZE, '0') or 0)
+    if size <= 0:
+        return None
+    if _default_pool is None:
+        _default_pool = KernelPool(size)
+        atexit.register(_default_pool.close)
+    return _default_pool
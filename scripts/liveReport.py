@@ -0,0 +1,144 @@
+# テスト実行中の報告書の逐次更新
+#
+# ランナーと取りまとめNotebookが実行マニフェスト(run-manifest.jsonl)に追記する終了イベントを
+# バックグラウンドのスレッドで監視し、終了したNotebookからテストケースを1回だけ取り出す。
+# 新たにNotebookが終了するたびに、それまでの結果から次の報告書を結果ディレクトリに作り直す。
+# - test-summary-{日付}.xlsx: generate_excel_summary.py と同じ形式のワークブック
+# - test-summary.json: テストケースとステップの結果、Notebookの実行状況
+# - test-summary.html: テストケースの一覧(実行中は自動で再読み込みする)
+# テストIDは実行の木構造の順に割り当てるため、実行中は後から終了したNotebookによってずれることがある。
+# スクリーンショットの screenshots/<テストID>/ へのコピーと、テストケースごとのページを持つHTMLの報告書
+# (htmlReport、report/index.html)の作成は、テストIDが確定する終了時(stop)にのみ行う。
+
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+
+from scripts import htmlReport
+from scripts import runManifest
+from scripts import testReport
+
+# マニフェストを確認する間隔(秒)
+DEFAULT_INTERVAL = 5.0
+
+
+class LiveReporter:
+    """
+    実行マニフェストを監視し、Notebookの終了に合わせて報告書を更新する。
+
+    :param result_dir: 結果ディレクトリ(run-manifest.jsonl のあるディレクトリ)
+    :param author: 報告書の担当者
+    :param ticket_number: 関連チケット
+    :param interval: マニフェストを確認する間隔(秒)
+    """
+
+    def __init__(self, result_dir, author='GitHub Actions', ticket_number='00000', interval=DEFAULT_INTERVAL):
+        self.result_dir = result_dir
+        self.author = author
+        self.ticket_number = ticket_number
+        self.interval = interval
+        self.manifest_path = os.path.join(result_dir, runManifest.FILENAME)
+        self.image_dir = None
+        self._offset = 0
+        self._entries = {}
+        self._cases = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.image_dir = tempfile.mkdtemp(prefix='live-report-')
+        self._thread = threading.Thread(target=self._run, name='live-report', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.poll() > 0:
+                    self.update()
+            except Exception:
+                # 報告書の作成に失敗しても、テストの実行は止めない
+                traceback.print_exc()
+
+    def _read_events(self):
+        """前回の読み込み以降に追記されたイベントを返す。書きかけの行は次回に読む。"""
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        self._offset += len(complete)
+        return runManifest.parse_events(complete.decode('utf-8'))
+
+    def poll(self):
+        """新たに終了したNotebookからテストケースを取り出し、処理したNotebookの数を返す。"""
+        processed = 0
+        for event in self._read_events():
+            entry = self._entries.setdefault(event['notebook'], {})
+            entry.update(event)
+            if event['event'] != 'end' or event['notebook'] in self._cases:
+                continue
+            notebook_path = os.path.join(self.result_dir, event['notebook'])
+            cases = []
+            if os.path.exists(notebook_path):
+                try:
+                    cases = testReport.extract_cases(
+                        notebook_path, os.path.join(self.image_dir, str(len(self._cases))),
+                    )
+                except Exception as e:
+                    print(f'Failed to extract test cases from {event["notebook"]}: {e}')
+            self._cases[event['notebook']] = cases
+            processed += 1
+        return processed
+
+    def _ordered_cases(self):
+        cases = []
+        for entry in runManifest.ordered(list(self._entries.values())):
+            cases += self._cases.get(entry['notebook'], [])
+        return testReport.assign_test_ids(cases)
+
+    def update(self, final=False):
+        """それまでに処理したNotebookの結果から報告書を作り直す。"""
+        cases = self._ordered_cases()
+        notebooks = [
+            dict((key, entry.get(key)) for key in ('notebook', 'parent', 'status', 'start', 'end'))
+            for entry in runManifest.ordered(list(self._entries.values()))
+        ]
+        if final:
+            testReport.copy_screenshots(cases, self.result_dir)
+            artifacts = dict(
+                (os.path.join(self.result_dir, entry['notebook']),
+                 [os.path.join(self.result_dir, path) for path in entry.get('artifacts', [])])
+                for entry in self._entries.values()
+            )
+            htmlReport.build(cases, self.result_dir, author=self.author, ticket_number=self.ticket_number,
+                             artifacts=artifacts)
+        workbook_path = os.path.join(self.result_dir, testReport.workbook_filename())
+        thumbnails = testReport.prepare_thumbnails(cases, os.path.join(self.image_dir, 'thumbnails'))
+        testReport.save_workbook(
+            testReport.create_workbook(cases, self.author, self.ticket_number, thumbnails=thumbnails), workbook_path,
+        )
+        testReport.write_summary_json(
+            cases, os.path.join(self.result_dir, testReport.SUMMARY_JSON_FILENAME),
+            self.author, self.ticket_number, notebooks=notebooks,
+        )
+        testReport.write_html_index(
+            cases, os.path.join(self.result_dir, testReport.INDEX_HTML_FILENAME),
+            self.author, self.ticket_number, running=not final,
+        )
+        return workbook_path
+
+    def stop(self):
+        """監視を終了し、残りのNotebookを処理して最終的な報告書を作成する。ワークブックのパスを返す。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.poll()
+            return self.update(final=True)
+        finally:
+            shutil.rmtree(self.image_dir, ignore_errors=True)
@@ -0,0 +1,402 @@
+# GRDMの利用操作を複数の仮想ユーザーで並行に繰り返す負荷試験
+#
+# 各仮想ユーザーは、1つのChromium上の個別のブラウザコンテキスト(またはAPIのみを呼び出す軽量なHTTPセッション)で
+# grdm.py のヘルパーを用いた操作(ジャーニー)を、指定された時間が経過するまで繰り返す。
+# 操作はステップに分けて計測し、ステップごとのスループット、エラー率、レイテンシのパーセンタイルを集計する。
+#
+# 利用例(run_tests.py経由):
+#   python run_tests.py load dashboard config.yaml --users 50 --ramp 60 --duration 300
+#   python run_tests.py load project config.yaml --users 500 --api-only
+#
+# 全ての仮想ユーザーが1つのイベントループで実行されるため、ヘルパー内の待機は asyncio.sleep とし、他の仮想ユーザーを止めない。
+# ブラウザコンテキストではアニメーションを無効にし(scripts/noAnimation.py)、ヘルパーの固定の待ち時間を要素の状態の待機に置き換える。
+
+import asyncio
+import os
+import tempfile
+import time
+import traceback
+from collections import Counter
+from urllib.parse import urlparse
+
+import requests
+from playwright.async_api import async_playwright, expect
+
+from scripts import grdm
+from scripts import noAnimation
+from scripts import playwright as pw
+
+DEFAULT_STORAGE = 'NII Storage'
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """昇順に並べた値のpパーセンタイル(最近傍順位法)を返す。"""
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[rank - 1]
+
+
+class StepStats:
+    """1つのステップの計測結果。"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = Counter()
+
+    @property
+    def count(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        errors = sum(self.errors.values())
+        summary = dict(
+            count=self.count,
+            errors=errors,
+            error_rate=errors / self.count if self.count > 0 else 0.0,
+            throughput=len(latencies) / elapsed if elapsed > 0 else 0.0,
+        )
+        for p in PERCENTILES:
+            summary[f'p{p}'] = percentile(latencies, p)
+        summary['max'] = latencies[-1] if len(latencies) > 0 else None
+        summary['error_types'] = dict(self.errors)
+        return summary
+
+
+class Recorder:
+    """全仮想ユーザーのステップの計測結果を集める。"""
+
+    def __init__(self):
+        self.steps = {}
+        self.iterations = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, name, latency=None, error=None):
+        stats = self.steps.setdefault(name, StepStats())
+        if error is None:
+            stats.latencies.append(latency)
+        else:
+            stats.errors[type(error).__name__] += 1
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        elapsed = self.elapsed
+        return dict(
+            elapsed=elapsed,
+            iterations=self.iterations,
+            steps=dict((name, stats.summary(elapsed)) for name, stats in self.steps.items()),
+        )
+
+
+class VirtualUser:
+    """
+    仮想ユーザー。
+
+    :param index: 仮想ユーザーの番号(1から)
+    :param account: username, password, projects([{'id', 'title'}])を持つ辞書
+    :param options: rdm_url, rdm_api_url, idp_name, transition_timeout などのジャーニー共通の設定
+    """
+
+    def __init__(self, index, account, options, recorder):
+        self.index = index
+        self.account = account
+        self.options = options
+        self.recorder = recorder
+        self.page = None
+        self.http = None
+        self.logged_in = False
+        self.iteration = 0
+
+    @property
+    def project_id(self):
+        projects = self.account.get('projects') or []
+        if len(projects) > 0:
+            return projects[0]['id']
+        return urlparse(self.options['rdm_project_url']).path.strip('/').split('/')[0]
+
+    @property
+    def project_url(self):
+        return self.options['rdm_url'].rstrip('/') + f'/{self.project_id}/'
+
+    async def step(self, name, f):
+        """f()を実行して所要時間を記録する。失敗した場合は記録した上で例外を送出する。"""
+        start = time.monotonic()
+        try:
+            result = await f()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.recorder.record(name, error=e)
+            raise
+        self.recorder.record(name, latency=time.monotonic() - start)
+        return result
+
+    async def api(self, method, path, **kwargs):
+        """GRDM API v2 を呼び出す。requestsはブロッキングのため、スレッドで実行する。"""
+        url = self.options['rdm_api_url'].rstrip('/') + '/v2/' + path
+        response = await asyncio.to_thread(self.http.request, method, url, timeout=60, **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+
+async def _expect_dashboard(vu):
+    # grdm.expect_dashboard はレート制限からの回復のために待機と再試行を行うため、計測には用いない
+    await expect(vu.page.locator('//*[text() = "プロジェクト管理者"]')).to_be_visible(
+        timeout=vu.options['transition_timeout']
+    )
+
+
+async def _login(vu):
+    page = vu.page
+    await page.goto(vu.options['rdm_url'])
+    consent = page.locator('//button[text() = "同意する"]')
+    try:
+        await expect(consent).to_be_visible(timeout=5000)
+        await consent.click()
+    except AssertionError:
+        # 同意済み
+        pass
+    await grdm.login(
+        page, vu.options['idp_name'], vu.account['username'], vu.account['password'],
+        transition_timeout=vu.options['transition_timeout'],
+    )
+    await _expect_dashboard(vu)
+
+
+async def _open_dashboard(vu):
+    await vu.page.goto(vu.options['rdm_url'].rstrip('/') + '/dashboard/')
+    await _expect_dashboard(vu)
+
+
+async def _open_project(vu):
+    await vu.page.goto(vu.project_url)
+    await expect(vu.page.locator('//span[@id = "nodeTitleEditable"]')).to_be_visible(
+        timeout=vu.options['transition_timeout']
+    )
+
+
+async def _upload(vu):
+    page = vu.page
+    filename = f'load-{vu.index}-{vu.iteration}.txt'
+    path = os.path.join(vu.options['work_dir'], filename)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(vu.options['upload_size']))
+    try:
+        tree = grdm.FileTree(page, storage=DEFAULT_STORAGE)
+        storage = await tree.storage_title(timeout=vu.options['transition_timeout'])
+        await expect(storage).to_be_visible(timeout=vu.options['transition_timeout'])
+        await storage.click()
+        await grdm.upload_file(page, path)
+        await grdm.wait_for_uploaded(page, filename, storage=DEFAULT_STORAGE)
+    finally:
+        os.remove(path)
+
+
+async def browser_dashboard(vu):
+    await vu.step('dashboard', lambda: _open_dashboard(vu))
+
+
+async def browser_project(vu):
+    await vu.step('dashboard', lambda: _open_dashboard(vu))
+    await vu.step('open_project', lambda: _open_project(vu))
+
+
+async def browser_upload(vu):
+    await vu.step('open_project', lambda: _open_project(vu))
+    await vu.step('upload', lambda: _upload(vu))
+
+
+async def browser_create_project(vu):
+    project_name = f'load-{vu.index}-{vu.iteration}-{int(time.time())}'
+    timeout = vu.options['transition_timeout']
+    await vu.step('dashboard', lambda: _open_dashboard(vu))
+    await vu.step('create_project', lambda: grdm.ensure_project_exists(
+        vu.page, project_name, transition_timeout=timeout, use_pool=False,
+    ))
+
+    async def open_created_project():
+        await vu.page.locator(f'//*[@data-test-dashboard-item-title and text()="{project_name}"]').click()
+        await expect(vu.page.locator('//span[@id = "nodeTitleEditable"]')).to_be_visible(timeout=timeout)
+    await vu.step('open_project', open_created_project)
+
+    async def delete_created_project():
+        await grdm.delete_project(vu.page, transition_timeout=timeout, use_pool=False)
+        await _expect_dashboard(vu)
+    await vu.step('delete_project', delete_created_project)
+
+
+async def api_dashboard(vu):
+    await vu.step('api_me', lambda: vu.api('GET', 'users/me/'))
+    await vu.step('api_my_nodes', lambda: vu.api('GET', 'users/me/nodes/'))
+
+
+async def api_project(vu):
+    await vu.step('api_node', lambda: vu.api('GET', f'nodes/{vu.project_id}/'))
+    await vu.step('api_node_files', lambda: vu.api('GET', f'nodes/{vu.project_id}/files/osfstorage/'))
+
+
+async def api_create_project(vu):
+    created = await vu.step('api_create_project', lambda: vu.api('POST', 'nodes/', json=dict(data=dict(
+        type='nodes',
+        attributes=dict(title=f'load-{vu.index}-{vu.iteration}-{int(time.time())}', category='project'),
+    ))))
+    project_id = created['data']['id']
+    await vu.step('api_delete_project', lambda: vu.api('DELETE', f'nodes/{project_id}/'))
+
+
+# シナリオ名 -> (ブラウザでのジャーニー, APIのみでのジャーニー)
+SCENARIOS = {
+    'dashboard': (browser_dashboard, api_dashboard),
+    'project': (browser_project, api_project),
+    'upload': (browser_upload, None),
+    'create_project': (browser_create_project, api_create_project),
+}
+
+
+async def _run_browser_user(vu, journey, browser, start_at, deadline, think_time):
+    await asyncio.sleep(max(0, start_at - time.monotonic()))
+    context = await browser.new_context(locale='ja-JP', reduced_motion='reduce')
+    await noAnimation.apply(context)
+    try:
+        vu.page = await context.new_page()
+        while time.monotonic() < deadline:
+            vu.iteration += 1
+            try:
+                if not vu.logged_in:
+                    await vu.step('login', lambda: _login(vu))
+                    vu.logged_in = True
+                await journey(vu)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if vu.options['verbose']:
+                    traceback.print_exc()
+                # ログイン状態が不明になるため、次の繰り返しでログインからやり直す
+                vu.logged_in = False
+            vu.recorder.iterations += 1
+            await asyncio.sleep(think_time)
+    finally:
+        await context.close()
+
+
+async def _run_api_user(vu, journey, start_at, deadline, think_time):
+    await asyncio.sleep(max(0, start_at - time.monotonic()))
+    vu.http = requests.Session()
+    vu.http.auth = (vu.account['username'], vu.account['password'])
+    vu.http.headers['Accept'] = 'application/vnd.api+json'
+    try:
+        while time.monotonic() < deadline:
+            vu.iteration += 1
+            try:
+                await journey(vu)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if vu.options['verbose']:
+                    traceback.print_exc()
+            vu.recorder.iterations += 1
+            await asyncio.sleep(think_time)
+    finally:
+        vu.http.close()
+
+
+async def _report_progress(recorder, interval):
+    while True:
+        await asyncio.sleep(interval)
+        samples = sum(stats.count for stats in recorder.steps.values())
+        errors = sum(sum(stats.errors.values()) for stats in recorder.steps.values())
+        print(f'[{recorder.elapsed:.0f}s] {recorder.iterations} iterations, {samples} steps, {errors} errors')
+
+
+async def run_load(scenario, accounts, options, users=1, ramp=0, duration=60, think_time=1.0,
+                   api_only=False, progress_interval=10):
+    """
+    仮想ユーザーでシナリオを実行し、計測結果を返す。
+
+    :param scenario: SCENARIOS のキー
+    :param accounts: 仮想ユーザーに順に割り当てるアカウント(username, password, projects)のリスト
+    :param options: rdm_url, rdm_api_url, rdm_project_url, idp_name, transition_timeout, upload_size, verbose
+    :param users: 仮想ユーザー数
+    :param ramp: 全ての仮想ユーザーが開始するまでの秒数。仮想ユーザーはこの間に均等に開始される
+    :param duration: 計測の開始からジャーニーの繰り返しを止めるまでの秒数(rampを含む)
+    :param think_time: ジャーニーの繰り返しの間隔(秒)
+    :param api_only: ブラウザを使用せず、APIのみを呼び出す仮想ユーザーとする
+    :return: Recorder.summary() の結果
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f'Unknown scenario: {scenario} (available: {", ".join(SCENARIOS)})')
+    if len(accounts) == 0:
+        raise ValueError('No accounts for virtual users')
+    browser_journey, api_journey = SCENARIOS[scenario]
+    journey = api_journey if api_only else browser_journey
+    if journey is None:
+        raise ValueError(f'Scenario {scenario} is not available for {"API-only" if api_only else "browser"} users')
+
+    recorder = Recorder()
+    options = dict(options)
+    options.setdefault('work_dir', tempfile.mkdtemp())
+    virtual_users = [
+        VirtualUser(i + 1, accounts[i % len(accounts)], options, recorder)
+        for i in range(users)
+    ]
+    recorder.started = time.monotonic()
+    deadline = recorder.started + duration
+    start_times = [recorder.started + (ramp * i / users if users > 0 else 0) for i in range(users)]
+    progress = asyncio.ensure_future(_report_progress(recorder, progress_interval))
+    try:
+        if api_only:
+            await asyncio.gather(*[
+                _run_api_user(vu, journey, start_at, deadline, think_time)
+                for vu, start_at in zip(virtual_users, start_times)
+            ])
+        else:
+            async with async_playwright() as playwright:
+                browser = await pw.launch_browser(playwright)
+                try:
+                    await asyncio.gather(*[
+                        _run_browser_user(vu, journey, browser, start_at, deadline, think_time)
+                        for vu, start_at in zip(virtual_users, start_times)
+                    ])
+                finally:
+                    await browser.close()
+    finally:
+        progress.cancel()
+        recorder.finished = time.monotonic()
+    return recorder.summary()
+
+
+def _format_seconds(value):
+    return '-' if value is None else f'{value:.3f}'
+
+
+def format_summary(summary):
+    """計測結果を表形式の文字列にする。"""
+    columns = ['step', 'count', 'errors', 'error%', 'req/s'] + [f'p{p}' for p in PERCENTILES] + ['max']
+    rows = []
+    for name, step in summary['steps'].items():
+        rows.append([
+            name,
+            str(step['count']),
+            str(step['errors']),
+            f'{step["error_rate"] * 100:.1f}',
+            f'{step["throughput"]:.2f}',
+        ] + [_format_seconds(step[f'p{p}']) for p in PERCENTILES] + [_format_seconds(step['max'])])
+    widths = [max(len(row[i]) for row in [columns] + rows) for i in range(len(columns))]
+    lines = [
+        f'Elapsed: {summary["elapsed"]:.1f}s, iterations: {summary["iterations"]}',
+        '  '.join(c.ljust(w) for c, w in zip(columns, widths)),
+    ]
+    for row in rows:
+        lines.append('  '.join(c.ljust(w) for c, w in zip(row, widths)))
+    for name, step in summary['steps'].items():
+        if len(step['error_types']) > 0:
+            lines.append(f'{name} errors: ' + ', '.join(f'{k}={v}' for k, v in step['error_types'].items()))
+    return '\n'.join(lines)
@@ -0,0 +1,265 @@
+# ブラウザコンテキストのネットワークプロファイル
+#
+# テスト対象のホストの静的アセットのパス(/static/ など)にあるCSS、JavaScript、フォント、画像を
+# テスト実行全体で共有するディスクキャッシュに保存し、コンテキストをまたいで再利用する。
+# キャッシュはURLをキーとし、ETag(またはLast-Modified)を用いて再検証する。
+# ユーザーごとに内容の異なり得るレスポンス(Cache-Control: private, no-cache, no-store、Set-Cookieを伴うもの、
+# Vary: Cookie/Authorization)は保存しない。
+# また、トラッキングや第三者ホストへのリクエストを遮断することができる。
+#
+# プロファイルのモード:
+# - off: 何もしない(実際の読み込みを観測する必要のあるテスト向け)
+# - revalidate: キャッシュ済みのアセットは If-None-Match で再検証し、304であればキャッシュから応答する
+# - cache: キャッシュ済みのアセットのうち、十分に長い max-age(LONG_MAX_AGE以上)を持ち期限内のものは
+#   再検証せずにキャッシュから応答する。それ以外は revalidate と同様に再検証する
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from urllib.parse import urlparse
+
+ENV_PROFILE = 'GRDM_NETWORK_PROFILE'
+
+MODES = ('off', 'revalidate', 'cache')
+CACHEABLE_RESOURCE_TYPES = ('stylesheet', 'script', 'font', 'image')
+# キャッシュの対象とするテスト対象ホストのパス
+STATIC_PATH_PREFIXES = ('/static/',)
+# 保存しない Cache-Control のディレクティブと、Vary のヘッダ
+UNCACHEABLE_DIRECTIVES = ('no-store', 'no-cache', 'private')
+UNCACHEABLE_VARY = ('cookie', 'authorization', '*')
+# cache モードで再検証を省略する max-age の下限(秒)
+LONG_MAX_AGE = 24 * 60 * 60
+TRACKING_HOSTS = (
+    'google-analytics.com',
+    'analytics.google.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'connect.facebook.net',
+    'hotjar.com',
+    'nr-data.net',
+    'newrelic.com',
+)
+# キャッシュから応答する際に引き継がないヘッダ(ボディは展開済みのため)
+EXCLUDED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+
+def _host_matches(host, domains):
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def _cache_directives(headers):
+    directives = {}
+    for directive in headers.get('cache-control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name] = value.strip('"')
+    return directives
+
+
+def _max_age(headers):
+    directives = _cache_directives(headers)
+    value = directives.get('s-maxage') or directives.get('max-age')
+    if value is None or not re.fullmatch(r'\d+', value):
+        return None
+    return int(value)
+
+
+def is_storable(status, headers):
+    """ユーザーをまたいで共有してよいレスポンスであればTrueを返す。"""
+    if status != 200 or 'set-cookie' in headers:
+        return False
+    if any(directive in UNCACHEABLE_DIRECTIVES for directive in _cache_directives(headers)):
+        return False
+    vary = [v.strip().lower() for v in headers.get('vary', '').split(',')]
+    return not any(v in UNCACHEABLE_VARY for v in vary)
+
+
+class NetworkProfile:
+    """
+    コンテキストのリクエストを横取りし、静的アセットのキャッシュとリクエストの遮断を行う。
+
+    :param mode: 'revalidate' または 'cache'
+    :param cache_dir: キャッシュを保存するディレクトリ。同一ディレクトリを指定した全てのプロセスで共有される
+    :param block_tracking: TRACKING_HOSTS へのリクエストを遮断する
+    :param block_third_party: first_party_hosts と allow_hosts 以外のホストへの、ページ遷移以外のリクエストを遮断する
+    :param first_party_hosts: テスト対象のホスト
+    :param allow_hosts: 第三者ホストの遮断から除外するホスト(IdPなど)
+    :param static_paths: キャッシュの対象とする、テスト対象のホストのパスの接頭辞
+    """
+
+    def __init__(self, mode='cache', cache_dir=None, block_tracking=True, block_third_party=False,
+                 first_party_hosts=None, allow_hosts=None, static_paths=STATIC_PATH_PREFIXES):
+        if mode not in MODES or mode == 'off':
+            raise ValueError(f'Invalid network profile mode: {mode}')
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.block_tracking = block_tracking
+        self.block_third_party = block_third_party
+        self.first_party_hosts = list(first_party_hosts or [])
+        self.allow_hosts = list(allow_hosts or [])
+        self.static_paths = list(static_paths)
+        self.hits = 0
+        self.misses = 0
+        self.blocked = 0
+
+    def is_blocked(self, request):
+        host = urlparse(request.url).hostname or ''
+        if self.block_tracking and _host_matches(host, TRACKING_HOSTS):
+            return True
+        if not self.block_third_party or len(self.first_party_hosts) == 0:
+            return False
+        if request.resource_type == 'document':
+            # IdPへの遷移などを妨げないよう、ページ遷移は遮断しない
+            return False
+        return not _host_matches(host, self.first_party_hosts + self.allow_hosts)
+
+    def is_cacheable(self, request):
+        """テスト対象のホストの静的アセットへのGETリクエストであればTrueを返す。"""
+        if self.cache_dir is None or request.method != 'GET' or request.resource_type not in CACHEABLE_RESOURCE_TYPES:
+            return False
+        url = urlparse(request.url)
+        if not _host_matches(url.hostname or '', self.first_party_hosts):
+            return False
+        return any(url.path.startswith(prefix) for prefix in self.static_paths)
+
+    def is_fresh(self, meta):
+        """再検証せずに応答してよいキャッシュであればTrueを返す。"""
+        max_age = meta.get('max_age')
+        if max_age is None or max_age < LONG_MAX_AGE:
+            return False
+        return time.time() - meta.get('stored_at', 0) < max_age
+
+    def _entry_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def load(self, url):
+        """キャッシュされたレスポンス(メタデータ, ボディ)を返す。存在しなければNoneを返す。"""
+        entry_path = self._entry_path(url)
+        try:
+            with open(entry_path + '.json', 'r') as f:
+                meta = json.load(f)
+            with open(entry_path + '.body', 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def store(self, url, status, headers, body):
+        """キャッシュ可能なレスポンスを保存する。ボディ、メタデータの順に置き換えるため、並行して読み出されても壊れない。"""
+        if not is_storable(status, headers):
+            return
+        entry_path = self._entry_path(url)
+        directory = os.path.dirname(entry_path)
+        os.makedirs(directory, exist_ok=True)
+        meta = dict(
+            url=url,
+            status=status,
+            etag=headers.get('etag'),
+            last_modified=headers.get('last-modified'),
+            max_age=_max_age(headers),
+            stored_at=time.time(),
+            headers=dict((k, v) for k, v in headers.items() if k.lower() not in EXCLUDED_HEADERS),
+        )
+        for suffix, data in [('.body', body), ('.json', json.dumps(meta).encode('utf-8'))]:
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, entry_path + suffix)
+
+    async def _fulfill_from_cache(self, route, cached):
+        meta, body = cached
+        self.hits += 1
+        await route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+
+    async def handle(self, route):
+        request = route.request
+        if self.is_blocked(request):
+            self.blocked += 1
+            await route.abort('blockedbyclient')
+            return
+        if not self.is_cacheable(request):
+            await route.fallback()
+            return
+        cached = self.load(request.url)
+        if cached is not None and self.mode == 'cache' and self.is_fresh(cached[0]):
+            await self._fulfill_from_cache(route, cached)
+            return
+        headers = dict(request.headers)
+        if cached is not None and cached[0].get('etag'):
+            headers['if-none-match'] = cached[0]['etag']
+        elif cached is not None and cached[0].get('last_modified'):
+            headers['if-modified-since'] = cached[0]['last_modified']
+        response = await route.fetch(headers=headers)
+        if response.status == 304 and cached is not None:
+            await self._fulfill_from_cache(route, cached)
+            return
+        self.misses += 1
+        body = await response.body()
+        self.store(request.url, response.status, response.headers, body)
+        await route.fulfill(response=response, body=body)
+
+    async def attach(self, context):
+        """ブラウザコンテキストの全てのリクエストにプロファイルを適用する。"""
+        await context.route('**/*', self.handle)
+
+    def summary(self):
+        return f'Network profile ({self.mode}): {self.hits} cached, {self.misses} fetched, {self.blocked} blocked'
+
+
+def from_config(config, **defaults):
+    """
+    設定値からNetworkProfileを作成する。'off' またはNoneの場合はNoneを返す。
+
+    :param config: モード名の文字列、または mode, cache_dir, block_tracking などをキーとする辞書
+    :param defaults: configで指定されなかった項目の値
+    """
+    if config is None:
+        return None
+    if isinstance(config, str):
+        config = dict(mode=config)
+    options = dict(defaults)
+    options.update(config)
+    if options.get('mode', 'cache') == 'off':
+        return None
+    return NetworkProfile(**options)
+
+
+def from_environ():
+    """環境変数でプロファイルが指定されていればNetworkProfileを返す。指定がなければNoneを返す。"""
+    value = os.environ.get(ENV_PROFILE)
+    if not value:
+        return None
+    return from_config(json.loads(value))
+
+
+def resolve(profile):
+    """セッションに指定された値(NetworkProfile、設定値、または環境変数に従う場合はNone)を解決する。"""
+    if profile is None:
+        return from_environ()
+    if isinstance(profile, NetworkProfile):
+        return profile
+    return from_config(profile)
+
+
+def configure_environ(config, **defaults):
+    """以降に起動されるカーネルが同一のプロファイルとキャッシュを使用するよう、環境変数を設定する。"""
+    profile = from_config(config, **defaults)
+    if profile is None:
+        os.environ.pop(ENV_PROFILE, None)
+        return None
+    os.environ[ENV_PROFILE] = json.dumps(dict(
+        mode=profile.mode,
+        cache_dir=os.path.abspath(profile.cache_dir) if profile.cache_dir else None,
+        block_tracking=profile.block_tracking,
+        block_third_party=profile.block_third_party,
+        first_party_hosts=profile.first_party_hosts,
+        allow_hosts=profile.allow_hosts,
+        static_paths=profile.static_paths,
+    ))
+    return profile
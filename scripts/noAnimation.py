@@ -0,0 +1,183 @@
+# アニメーションを無効にした描画(ヘッドレスのテスト用コンテキスト)
+#
+# コンテキストに INIT_SCRIPT を登録し、reduced_motion を 'reduce' とすることで、次のアニメーションを無効にする。
+# - CSSのアニメーションとトランジション(Bootstrapのモーダルのフェードなどを含む)
+# - jQueryのエフェクト(jQuery.fx.off)と、Bootstrap 3がトランジションの終了を待つ処理($.support.transition)
+# 無効にしたページでは window.__grdmNoAnimation が true となり、grdm.py のヘルパーは
+# アニメーションの完了を待つための固定の待ち時間を、要素の状態を待つ処理に切り替える。
+#
+# compare で、通常の実行結果と無効にした実行結果のNotebookごとの所要時間とスクリーンショットの差異を比較できる。
+#
+#     python -m scripts.noAnimation <通常の結果ディレクトリ> <無効にした結果ディレクトリ>
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from PIL import Image, ImageChops, ImageStat
+
+from scripts import runManifest
+from scripts import testReport
+
+ENV_NO_ANIMATION = 'GRDM_NO_ANIMATION'
+
+INIT_SCRIPT = '''
+(() => {
+  if (window.__grdmNoAnimation) {
+    return;
+  }
+  window.__grdmNoAnimation = true;
+  const css = '*, *::before, *::after {'
+    + ' transition: none !important; transition-duration: 0s !important; transition-delay: 0s !important;'
+    + ' animation: none !important; animation-duration: 0s !important; animation-delay: 0s !important;'
+    + ' scroll-behavior: auto !important; }';
+  const addStyle = () => {
+    const parent = document.head || document.documentElement;
+    if (!parent || document.getElementById('grdm-no-animation')) {
+      return;
+    }
+    const style = document.createElement('style');
+    style.id = 'grdm-no-animation';
+    style.textContent = css;
+    parent.appendChild(style);
+  };
+  const disableEffects = (jq) => {
+    if (!jq) {
+      return;
+    }
+    if (jq.fx) {
+      jq.fx.off = true;
+    }
+    if (jq.support) {
+      // Bootstrap 3はトランジションに対応したブラウザでのみ transitionend を待つ
+      jq.support.transition = false;
+    }
+  };
+  let jq = window.jQuery;
+  Object.defineProperty(window, 'jQuery', {
+    configurable: true,
+    get: () => jq,
+    set: (value) => {
+      jq = value;
+      disableEffects(value);
+    },
+  });
+  addStyle();
+  document.addEventListener('DOMContentLoaded', () => {
+    addStyle();
+    disableEffects(window.jQuery || window.$);
+  });
+  // Bootstrapは DOMContentLoaded 後に $.support.transition を設定するため、読み込みの完了時にも無効にする
+  window.addEventListener('load', () => disableEffects(window.jQuery || window.$));
+})();
+'''
+
+# スクリーンショットを同等とみなす差異(縮小したグレースケール画像の平均絶対差の、最大値に対する比率)
+DEFAULT_DIFF_THRESHOLD = 0.02
+COMPARE_WIDTH = 320
+
+
+def enabled_by_environ():
+    return os.environ.get(ENV_NO_ANIMATION, '').lower() in ('1', 'true', 'yes')
+
+
+async def apply(context):
+    """コンテキストのアニメーションを無効にする。reduced_motion はコンテキストの作成時に指定する。"""
+    await context.add_init_script(INIT_SCRIPT)
+
+
+def image_difference(path_a, path_b):
+    """2つのスクリーンショットの差異(0.0〜1.0)を返す。サイズが異なる場合は1.0とする。"""
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        if a.size != b.size:
+            return 1.0
+        height = max(1, int(a.height * COMPARE_WIDTH / a.width))
+        a = a.convert('L').resize((COMPARE_WIDTH, height))
+        b = b.convert('L').resize((COMPARE_WIDTH, height))
+        return ImageStat.Stat(ImageChops.difference(a, b)).mean[0] / 255
+
+
+def _duration(entry):
+    if entry.get('end') is None:
+        return None
+    return (datetime.fromisoformat(entry['end']) - datetime.fromisoformat(entry['start'])).total_seconds()
+
+
+def _load_run(result_dir, image_dir):
+    """結果ディレクトリのNotebookごとの(所要時間, 状態, テストケース)を、Notebookのファイル名をキーとして返す。"""
+    entries = runManifest.load_entries(result_dir)
+    if entries is None:
+        raise ValueError(f'No run manifest found in {result_dir}')
+    notebooks = {}
+    for index, entry in enumerate(entries):
+        cases = []
+        if entry['notebook'].exists():
+            cases = testReport.extract_cases(str(entry['notebook']), os.path.join(image_dir, str(index)))
+        notebooks[entry['notebook'].name] = (_duration(entry), entry['status'], cases)
+    return notebooks
+
+
+def compare(baseline_dir, candidate_dir, threshold=DEFAULT_DIFF_THRESHOLD):
+    """
+    2つの実行結果について、Notebookごとの所要時間とスクリーンショットの差異を比較する。
+
+    スクリーンショットは、同じNotebookの同じテストケース・ステップのもの同士を比較する。
+
+    :return: notebook, baseline, candidate(所要時間、秒), saved(短縮した時間), screenshots(比較した数),
+        different(しきい値を超えた数), max_difference を持つ辞書のリスト
+    """
+    with tempfile.TemporaryDirectory() as image_dir:
+        baseline = _load_run(baseline_dir, os.path.join(image_dir, 'baseline'))
+        candidate = _load_run(candidate_dir, os.path.join(image_dir, 'candidate'))
+        rows = []
+        for name, (duration, status, cases) in candidate.items():
+            if name not in baseline:
+                continue
+            baseline_duration, baseline_status, baseline_cases = baseline[name]
+            differences = []
+            for case, baseline_case in zip(cases, baseline_cases):
+                baseline_screenshots = dict(baseline_case['screenshots'])
+                for stepindex, image in case['screenshots']:
+                    if stepindex in baseline_screenshots:
+                        differences.append(image_difference(baseline_screenshots[stepindex], image))
+            rows.append(dict(
+                notebook=name,
+                baseline=baseline_duration,
+                candidate=duration,
+                saved=baseline_duration - duration if None not in (baseline_duration, duration) else None,
+                status=status if status == baseline_status else f'{baseline_status} -> {status}',
+                screenshots=len(differences),
+                different=sum(1 for d in differences if d > threshold),
+                max_difference=max(differences) if len(differences) > 0 else None,
+            ))
+    return rows
+
+
+def format_comparison(rows):
+    def seconds(value):
+        return f'{value:8.1f}' if value is not None else '       -'
+    lines = ['baseline(s) no-anim(s) saved(s)  screenshots(different/max diff)  notebook']
+    for row in rows:
+        max_difference = f'{row["max_difference"]:.3f}' if row['max_difference'] is not None else '-'
+        lines.append(
+            f'{seconds(row["baseline"])}    {seconds(row["candidate"])} {seconds(row["saved"])}  '
+            f'{row["screenshots"]:4d} ({row["different"]}/{max_difference})'.ljust(62)
+            + f'{row["notebook"]} [{row["status"]}]'
+        )
+    saved = [row['saved'] for row in rows if row['saved'] is not None]
+    baseline = sum(row['baseline'] for row in rows if row['saved'] is not None)
+    if len(saved) > 0 and baseline > 0:
+        lines.append(f'Total saved: {sum(saved):.1f}s ({sum(saved) / baseline * 100:.1f}% of {baseline:.1f}s)')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python -m scripts.noAnimation <baseline_result_dir> <no_animation_result_dir>', file=sys.stderr)
+        sys.exit(2)
+    comparison = compare(sys.argv[1], sys.argv[2])
+    print(format_comparison(comparison))
+    if any(row['different'] > 0 for row in comparison):
+        print(f'Some screenshots differ by more than {DEFAULT_DIFF_THRESHOLD:.0%}', file=sys.stderr)
+        sys.exit(1)
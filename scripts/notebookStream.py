@@ -0,0 +1,121 @@
+"""
+Streaming rewrite of Jupyter notebook files.
+
+The notebook is read incrementally and each element of the top-level "cells"
+array is decoded, transformed and written one at a time, so memory use is bounded
+by the largest single cell instead of the whole notebook. The output is
+byte-identical to json.dump(notebook, f, indent=1, ensure_ascii=False).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class _StreamReader:
+    """Incremental reader of JSON values from a text file."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=CHUNK_SIZE):
+        if self.pos > 0:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(max(size, CHUNK_SIZE))
+        if chunk == '':
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at the end of file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the buffer geometrically so that large values are re-scanned only a few times
+            self._fill(len(self.buffer) - self.pos)
+
+
+def _dumps(value, level):
+    """Encode value as json.dump(indent=1) would at the given nesting level."""
+    return json.dumps(value, indent=1, ensure_ascii=False).replace('\n', '\n' + ' ' * level)
+
+
+def rewrite_cells(notebook_path, transform):
+    """
+    Apply transform(cell) -> bool (True if the cell was modified in place) to each cell.
+
+    The notebook is rewritten only if some cell was modified.
+    Return the number of modified cells.
+    """
+    directory = os.path.dirname(os.path.abspath(notebook_path))
+    modified_count = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.ipynb.tmp')
+    try:
+        with open(notebook_path, 'r', encoding='utf-8') as src, os.fdopen(fd, 'w', encoding='utf-8') as dst:
+            reader = _StreamReader(src)
+            reader.expect('{')
+            dst.write('{')
+            first_key = True
+            while reader.peek() != '}':
+                if not first_key:
+                    reader.expect(',')
+                key = reader.value()
+                reader.expect(':')
+                dst.write(('' if first_key else ',') + '\n ' + _dumps(key, 1) + ': ')
+                first_key = False
+                if key != 'cells' or reader.peek() != '[':
+                    dst.write(_dumps(reader.value(), 1))
+                    continue
+                reader.expect('[')
+                first_cell = True
+                while reader.peek() != ']':
+                    if not first_cell:
+                        reader.expect(',')
+                    cell = reader.value()
+                    if transform(cell):
+                        modified_count += 1
+                    dst.write(('[' if first_cell else ',') + '\n  ' + _dumps(cell, 2))
+                    first_cell = False
+                reader.expect(']')
+                dst.write('[]' if first_cell else '\n ]')
+            reader.expect('}')
+            dst.write('}' if first_key else '\n}')
+        if modified_count > 0:
+            shutil.copymode(notebook_path, tmp_path)
+            os.replace(tmp_path, notebook_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return modified_count
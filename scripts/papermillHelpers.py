@@ -2,11 +2,15 @@
 
 import os
 import traceback
+from contextlib import nullcontext
 from typing import Callable
 import papermill as pm
 import shutil
 import yaml
 
+from scripts import kernelPool
+from scripts import runManifest
+
 def run_notebook(
     result_dir: str,
     base_notebook: str,
@@ -15,6 +19,7 @@ def run_notebook(
     extra_params: dict = None,
     skip_failed_test: bool = False,
     optional_result_id: str = None,
+    kernel_pool: kernelPool.KernelPool | None = None,
 ) -> str:
     """
     Jupyter Notebook を指定のパラメータで実行し、結果を保存する。
@@ -26,6 +31,7 @@ def run_notebook(
     :param extra_params: base_notebookに固有の追加パラメータ
     :param skip_failed_test: base_notebookの実行に失敗したとき、処理を続行する(True)か例外を投げて停止する(False、デフォルト)か
     :param optional_result_id: 実行後のNotebookのファイル名に前置する識別子
+    :param kernel_pool: 事前に起動したカーネルを払い出すプール。Noneの場合は環境変数 GRDM_KERNEL_POOL_SIZE に従う
     :return: 実行後のNotebookのパス
     """
     _, filename = os.path.split(base_notebook)
@@ -46,8 +52,23 @@ def run_notebook(
     if extra_params:
         params.update(extra_params)
 
+    kernel_pool = kernel_pool or kernelPool.default_pool()
+    # ランナーが実行マニフェストを用意していれば、この取りまとめNotebookの子として記録する
+    manifest = runManifest.from_environ()
+    recording = nullcontext() if manifest is None else manifest.record(
+        result_notebook,
+        input_notebook=base_notebook,
+        parent=manifest.find_parent(result_dir),
+        parameters=params,
+        result_path=result_path,
+    )
     try:
-        pm.execute_notebook(base_notebook, result_notebook, parameters=params)
+        with recording:
+            if kernel_pool is None:
+                pm.execute_notebook(base_notebook, result_notebook, parameters=params)
+            else:
+                with kernel_pool.kernel() as km:
+                    pm.execute_notebook(base_notebook, result_notebook, parameters=params, km=km)
     except pm.PapermillExecutionError:
         if not skip_failed_test:
             raise
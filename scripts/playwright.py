@@ -1,5 +1,9 @@
 # ユーティリティ関数群
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime
+import json
 import os
 import shutil
 import sys
@@ -10,179 +14,542 @@ import traceback
 from IPython.display import Image
 from playwright.async_api import async_playwright, expect
 
-playwright = None
-current_session_id = None
-current_browser = None
-current_contexts = None
-default_last_path = None
-context_close_on_fail = True
-temp_dir = None
-
-async def run_pw(f, last_path=default_last_path, screenshot=True, permissions=None, new_context=False, new_page=False):
-    global current_browser
-    if current_browser is None:
-        current_browser = await playwright.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-dev-shm-usage", "--lang=ja"],
-        )
-        # , "--timeout=25000"
-    
-    global current_contexts
-    if current_contexts is None or len(current_contexts) == 0 or new_context:
-        videos_dir = os.path.join(temp_dir, 'videos/')
+from scripts import cpuProfile
+from scripts import networkProfile
+from scripts import noAnimation
+from scripts import prerequisites
+from scripts import stepTimeouts
+from scripts import throttle
+from scripts import webPerf
+from scripts.prerequisites import StepBlocked
+
+BROWSER_ARGS = ["--no-sandbox", "--disable-dev-shm-usage", "--lang=ja"]
+
+# 事前に作成しておくコンテキストの数
+ENV_CONTEXT_POOL_SIZE = 'GRDM_CONTEXT_POOL_SIZE'
+
+
+def default_pool_size():
+    return int(os.environ.get(ENV_CONTEXT_POOL_SIZE, '0') or 0)
+
+
+async def launch_browser(playwright):
+    return await playwright.chromium.launch(
+        headless=True,
+        args=BROWSER_ARGS,
+    )
+    # , "--timeout=25000"
+
+
+class Session:
+    """
+    ブラウザ、コンテキスト、ページ、証跡(動画・HAR・スクリーンショット)、一時ディレクトリを保持するセッション。
+
+    コンテキストとページはスタックとして管理され、操作は最後に積まれたページに対して行われる。
+    複数のセッションを同一のイベントループで同時に利用できる。
+
+        async with Session(last_path=result_path) as session:
+            await session.run(_step)
+
+    :param last_path: 証跡の保存先。Noneの場合は ~/last-screenshots/{session_id}
+    :param close_on_fail: ステップ失敗時にコンテキストを閉じて証跡を保存する(True)か、スクリーンショットのみ保存する(False)か
+    :param browser: 他のセッションと共有するブラウザ。Noneの場合はセッション自身がブラウザを起動し、終了時に閉じる
+    :param pool_size: バックグラウンドで事前に作成しておくコンテキスト(最初のページを開いた状態)の数の上限。
+        セッションの開始時に最初のコンテキストを用意し、以降は new_context で追加のコンテキストを要求した数だけ
+        (上限まで)予備を保つ。追加のコンテキストを使わないNotebookでは予備を持たない
+    :param permissions: 全てのコンテキストに付与する権限
+    :param network_profile: 静的アセットのキャッシュとリクエスト遮断の設定(networkProfile.from_config を参照)。
+        Noneの場合は環境変数 GRDM_NETWORK_PROFILE に従い、'off' の場合は適用しない
+    :param web_perf: ステップごとにフロントエンド性能を計測し、証跡とともに web-perf.jsonl に保存する(scripts/webPerf.py)。
+        Noneの場合は環境変数 GRDM_WEB_PERF に従う
+    :param profile_threshold: 所要時間がこの秒数を超えたステップのCPUプロファイルを保存する(scripts/cpuProfile.py)。
+        Noneの場合は環境変数 GRDM_PROFILE_THRESHOLD に従い、指定がなければ run の profile で指定したステップのみ保存する
+    :param timeout_advisor: 過去の所要時間からステップのタイムアウトを求める stepTimeouts.TimeoutAdvisor。
+        Noneの場合は環境変数 GRDM_STEP_TIMEOUT_HISTORY に従い、指定がなければタイムアウトを適用しない
+    :param no_animation: コンテキストのCSSアニメーション・トランジションとjQueryのエフェクトを無効にし、
+        reduced_motion を 'reduce' とする(scripts/noAnimation.py)。Noneの場合は環境変数 GRDM_NO_ANIMATION に従う
+    """
+
+    def __init__(self, last_path=None, close_on_fail=True, browser=None, pool_size=0, permissions=None,
+                 network_profile=None, web_perf=None, profile_threshold=None, timeout_advisor=None, no_animation=None):
+        self.session_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.last_path = last_path or os.path.join(os.path.expanduser('~/last-screenshots'), self.session_id)
+        self.close_on_fail = close_on_fail
+        self.playwright = None
+        self.browser = browser
+        self.owns_browser = browser is None
+        self.contexts = []
+        self.temp_dir = None
+        self.pool_size = pool_size
+        self.permissions = permissions
+        self.network_profile = networkProfile.resolve(network_profile)
+        self.web_perf = webPerf.enabled_by_environ() if web_perf is None else web_perf
+        self._web_perf_collector = webPerf.Collector()
+        self.profile_threshold = cpuProfile.threshold_from_environ() if profile_threshold is None else profile_threshold
+        # ステップの前提条件(scripts/prerequisites.py)の成否。ログインの失敗などはテスト実行全体で共有する
+        self.prerequisites = prerequisites.Tracker(shared=prerequisites.from_environ())
+        self.timeout_advisor = stepTimeouts.from_environ() if timeout_advisor is None else timeout_advisor
+        self.no_animation = noAnimation.enabled_by_environ() if no_animation is None else no_animation
+        # ステップの識別子ごとの実行回数(ステップの所要時間の記録に用いる)
+        self._step_occurrences = {}
+        # 作成中または作成済みの予備のコンテキスト(asyncio.Task)
+        self._spare_contexts = []
+        # new_context で取り出したコンテキストの数(予備の数の決定に用いる)
+        self._context_requests = 0
+        # コンテキストごとの動画とHARの保存先
+        self._context_dirs = {}
+        # コンテキストごとに事前に開いておいたページ(asyncio.Task)
+        self._spare_pages = {}
+
+    async def start(self):
+        if self.owns_browser:
+            self.playwright = await async_playwright().start()
+        self.temp_dir = tempfile.mkdtemp()
+        if self.pool_size > 0:
+            # 最初のステップで使うコンテキストを、セッションの開始時から用意しておく
+            await self._ensure_browser()
+            self._fill_pool()
+        return self
+
+    async def close(self):
+        """ブラウザとPlaywrightを停止する。証跡は保存しない。共有ブラウザの場合は自身のコンテキストのみ閉じる。"""
+        await self._discard_spares()
+        if not self.owns_browser:
+            while len(self.contexts) > 0:
+                context, _ = self.contexts.pop()
+                await context.close()
+        elif self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        self.contexts = []
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            await self.finish(screenshot=exc_type is not None)
+        finally:
+            await self.close()
+
+    async def _ensure_browser(self):
+        if self.browser is None:
+            self.browser = await launch_browser(self.playwright)
+        return self.browser
+
+    async def _create_context(self, no_animation=None):
+        browser = await self._ensure_browser()
+        # 予備のコンテキストが互いの証跡を上書きしないよう、コンテキストごとに保存先を分ける
+        context_dir = tempfile.mkdtemp(prefix='context-', dir=self.temp_dir)
+        videos_dir = os.path.join(context_dir, 'videos/')
         os.makedirs(videos_dir, exist_ok=True)
-        har_path = os.path.join(temp_dir, 'har.zip')
+        har_path = os.path.join(context_dir, 'har.zip')
+        no_animation = self.no_animation if no_animation is None else no_animation
 
-        context = await current_browser.new_context(
+        context = await browser.new_context(
             locale="ja-JP",  # Playwrightでは直接ロケールを設定可能
             record_video_dir=videos_dir,
             record_har_path=har_path,
+            permissions=self.permissions,
+            reduced_motion='reduce' if no_animation else 'no-preference',
         )
-        if current_contexts is None:
-            current_contexts = [(context, [])]
+        self._context_dirs[context] = context_dir
+        governor = throttle.from_environ()
+        if governor is not None:
+            await governor.attach(context)
+        if self.network_profile is not None:
+            await self.network_profile.attach(context)
+        if self.web_perf:
+            await context.add_init_script(webPerf.INIT_SCRIPT)
+        if no_animation:
+            await noAnimation.apply(context)
+        return context
+
+    async def _prepare_context(self):
+        context = await self._create_context()
+        self._spare_pages[context] = asyncio.ensure_future(context.new_page())
+        return context
+
+    def _spare_target(self):
+        """保つ予備のコンテキストの数。最初のコンテキストの後は、追加で要求されたコンテキストの数に合わせる。"""
+        if self._context_requests == 0:
+            return min(self.pool_size, 1)
+        return min(self.pool_size, self._context_requests - 1)
+
+    def _fill_pool(self):
+        while len(self._spare_contexts) < self._spare_target():
+            self._spare_contexts.append(asyncio.ensure_future(self._prepare_context()))
+
+    async def _discard_spare_page(self, context):
+        task = self._spare_pages.pop(context, None)
+        if task is None:
+            return
+        try:
+            page = await task
+            await page.close()
+        except:
+            traceback.print_exc()
+
+    async def _discard_spares(self):
+        """未使用の予備のコンテキストとページを閉じる。"""
+        spare_contexts = self._spare_contexts
+        self._spare_contexts = []
+        for task in spare_contexts:
+            try:
+                context = await task
+                await self._discard_spare_page(context)
+                await context.close()
+                self._context_dirs.pop(context, None)
+            except:
+                traceback.print_exc()
+        for context in list(self._spare_pages.keys()):
+            await self._discard_spare_page(context)
+
+    async def new_context(self, no_animation=None):
+        """
+        動画とHARを記録するコンテキストを作成し、スタックに積む。プールがあれば作成済みのものを取り出す。
+
+        :param no_animation: アニメーションを無効にするか。Noneの場合はセッションの設定に従う
+        """
+        if no_animation is not None and no_animation != self.no_animation:
+            # プールのコンテキストはセッションの設定で作成されているため、個別に作成する
+            context = await self._create_context(no_animation=no_animation)
+        elif len(self._spare_contexts) > 0:
+            context = await self._spare_contexts.pop(0)
         else:
-            current_contexts.append((context, []))
-
-    current_context, current_pages = current_contexts[-1]
-    if len(current_pages) == 0 or new_page:
-        current_pages.append(await current_context.new_page())
-
-    current_time = time.time()
-    print(f'Start epoch: {current_time} seconds')
-    if permissions is not None:
-        await current_context.grant_permissions(permissions)
-    next_page = None
-    if f is not None:
+            context = await self._create_context()
+        self._context_requests += 1
+        if self.pool_size > 0:
+            self._fill_pool()
+        self.contexts.append((context, []))
+        return context
+
+    async def new_page(self, context, prewarm=False):
+        """
+        ページを開く。事前に開いておいたページがあればそれを返す。
+
+        :param prewarm: プールが有効な場合に、次に開くページをバックグラウンドで用意しておく
+        """
+        task = self._spare_pages.pop(context, None)
+        page = await task if task is not None else await context.new_page()
+        if prewarm and self.pool_size > 0:
+            self._spare_pages[context] = asyncio.ensure_future(context.new_page())
+        return page
+
+    @property
+    def current_page(self):
+        if len(self.contexts) == 0:
+            raise Exception('No contexts')
+        _, pages = self.contexts[-1]
+        if len(pages) == 0:
+            raise Exception('Unexpected state')
+        return pages[-1]
+
+    async def _collect_web_perf(self, context, page, start_epoch):
+        """ステップ終了時のフロントエンド性能を取得して記録する。計測の失敗はステップの失敗としない。"""
         try:
-            next_page = await f(current_pages[-1])
+            record = await self._web_perf_collector.collect(context, page)
         except:
-            if context_close_on_fail:
-                await finish_pw_context(screenshot=screenshot, last_path=last_path)
-                raise
-            if screenshot:
-                await _save_screenshot()
-            raise
-    if next_page is not None:
-        current_pages.append(next_page)
-    screenshot_path = os.path.join(temp_dir, 'screenshot.png')
-    await current_pages[-1].screenshot(path=screenshot_path)
-    return Image(screenshot_path)
+            print('フロントエンド性能の取得に失敗しました。', file=sys.stderr)
+            traceback.print_exc()
+            return
+        record['start_epoch'] = start_epoch
+        record['end_epoch'] = time.time()
+        with open(os.path.join(self.temp_dir, webPerf.RECORDS_FILENAME), 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(webPerf.format_record(record))
 
-async def close_latest_page(last_path=None):
-    global current_contexts
-    if current_contexts is None or len(current_contexts) == 0:
-        raise Exception('No contexts')
-    current_context, current_pages = current_contexts[-1]
-    if len(current_contexts) <= 1 and len(current_pages) <= 1:
-        raise Exception('It is only possible to close when two or more contexts or pages are stacked')
-    os.makedirs(last_path or default_last_path, exist_ok=True)
-    last_page = current_pages[-1]
-    if last_page in current_pages[:-1] or any([last_page in p for _, p in current_contexts[:-1]]):
-        # まだインスタンスがページ一覧に存在する場合は、スタックから削除するだけ
-        assert len(current_pages) > 0, current_pages
-        current_contexts[-1] = (current_context, current_pages[:-1])
-        return
-    video_path = await last_page.video.path()
-    index = len(current_pages)
-    dest_video_path = os.path.join(last_path or default_last_path, f'video-{index}.webm')
-    shutil.copyfile(video_path, dest_video_path)
-    current_pages = current_pages[:-1]
-    current_contexts[-1] = (current_context, current_pages)
-    await last_page.close()
-    if len(current_pages) > 0:
-        return
-    current_contexts = current_contexts[:-1]
-    await current_context.close()
-
-async def init_pw_context(close_on_fail=True, last_path=None):
-    global playwright, current_session_id, default_last_path, current_browser, temp_dir, context_close_on_fail, current_contexts
-    if current_browser is not None:
-        await current_browser.close()
-        current_browser = None
-    if playwright is not None:
-        await playwright.stop()
-        playwright = None
-    playwright = await async_playwright().start()
-    current_session_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-    default_last_path = last_path or os.path.join(os.path.expanduser('~/last-screenshots'), current_session_id)
-    temp_dir = tempfile.mkdtemp()
-    context_close_on_fail = close_on_fail
-    if current_contexts is not None:
-        for current_context in current_contexts:
-            await current_context.close()
-    current_contexts = None
-    return (current_session_id, temp_dir)
+    def _step_identifier(self, f, step_name):
+        """ステップの所要時間を記録する識別子。step_name がなければステップ関数のコードのハッシュとする。"""
+        identifier = step_name or (stepTimeouts.code_digest(f) if f is not None else 'none')
+        occurrence = self._step_occurrences.get(identifier, 0) + 1
+        self._step_occurrences[identifier] = occurrence
+        return identifier if occurrence == 1 else f'{identifier}~{occurrence}'
 
-async def finish_pw_context(screenshot=False, last_path=None):
-    global current_browser
-    await _finish_pw_context(screenshot=screenshot, last_path=last_path)
-    if current_browser is not None:
-        await current_browser.close()
-        current_browser = None
+    def _record_step_timing(self, last_path, key, start_epoch, status):
+        """ステップの所要時間を証跡の保存先の step-timings.jsonl に記録する。"""
+        os.makedirs(last_path, exist_ok=True)
+        record = dict(step=key, start_epoch=start_epoch, duration=time.time() - start_epoch, status=status)
+        with open(os.path.join(last_path, stepTimeouts.RECORDS_FILENAME), 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
 
-async def save_screenshot(path):
-    if current_contexts is None or len(current_contexts) == 0:
-        raise Exception('No contexts')
-    _, current_pages = current_contexts[-1]
-    if current_pages is None or len(current_pages) == 0:
-        raise Exception('Unexpected state')
-    await current_pages[-1].screenshot(path=path)
-    return path
-
-async def _save_screenshot(last_path=None):
-    if current_contexts is None or len(current_contexts) == 0:
-        raise Exception('No contexts')
-    _, current_pages = current_contexts[-1]
-    os.makedirs(last_path or default_last_path, exist_ok=True)
-    if current_pages is None or len(current_pages) == 0:
-        return
-    screenshot_path = os.path.join(temp_dir, 'last-screenshot.png')
-    await current_pages[-1].screenshot(path=screenshot_path)
-    dest_screenshot_path = os.path.join(last_path or default_last_path, 'last-screenshot.png')
-    shutil.copyfile(screenshot_path, dest_screenshot_path)
-    print(f'Screenshot: {dest_screenshot_path}')
-
-async def _finish_pw_context(screenshot=False, last_path=None):
-    global current_contexts
-    if current_contexts is None or len(current_contexts) == 0:
-        return
-    current_context, current_pages = current_contexts[-1]
-    os.makedirs(last_path or default_last_path, exist_ok=True)
-    timeout_on_screenshot = False
-    if screenshot and current_pages is not None and len(current_pages) > 0:
+    async def _run_step(self, f, page, key):
+        """ステップを実行する。過去の所要時間から求めたタイムアウトがあれば、それを超えた時点で StepTimeout とする。"""
+        timeout = self.timeout_advisor.timeout(key) if self.timeout_advisor is not None else None
+        if timeout is None:
+            return await f(page)
         try:
-            await _save_screenshot(last_path=last_path)
+            return await asyncio.wait_for(f(page), timeout)
+        except asyncio.TimeoutError:
+            raise stepTimeouts.StepTimeout(f'Step {key} did not finish in {timeout:.1f}s (adaptive timeout)')
+
+    async def _start_profiler(self, context, page, profile):
+        """ステップのプロファイルを開始する。プロファイルしない場合、または開始できなかった場合はNoneを返す。"""
+        if profile is False or (not profile and self.profile_threshold is None):
+            return None
+        profiler = cpuProfile.StepProfiler(context, page, browser=self.browser if profile == 'trace' else None)
+        try:
+            return await profiler.start()
         except:
-            print('スクリーンショットの取得に失敗しました。', file=sys.stderr)
+            print('CPUプロファイルを開始できませんでした。', file=sys.stderr)
             traceback.print_exc()
-            timeout_on_screenshot = True
-    if timeout_on_screenshot:
-        return
-    current_contexts = current_contexts[::-1]
-    await current_context.close()
-    for i, current_page in enumerate(current_pages):
-        index = i + 1
+            return None
+
+    async def _finish_profiler(self, profiler, profile, start_epoch, last_path=None):
+        """ステップのプロファイルを停止し、指定されたステップかしきい値を超えたステップであれば保存する。"""
+        if profiler is None:
+            return
+        elapsed = time.time() - start_epoch
         try:
-            video_path = await current_page.video.path()
-            dest_video_path = os.path.join(last_path or default_last_path, f'video-{index}.webm')
-            shutil.copyfile(video_path, dest_video_path)
-            print(f'Video: {dest_video_path}')
+            profile_data, trace = await profiler.stop()
         except:
-            print('スクリーンキャプチャ動画の取得に失敗しました。', file=sys.stderr)
+            print('CPUプロファイルの取得に失敗しました。', file=sys.stderr)
             traceback.print_exc()
-            timeout_on_screenshot = True
-    if timeout_on_screenshot:
-        return   
-    har_path = os.path.join(temp_dir, 'har.zip')
-    dest_har_path = os.path.join(last_path or default_last_path, 'har.zip')
-    if os.path.exists(har_path):
-        shutil.copyfile(har_path, dest_har_path)
-        print(f'HAR: {dest_har_path}')
+            return
+        if not profile and elapsed < self.profile_threshold:
+            return
+        dest_dir = os.path.join(last_path or self.last_path, 'profiles')
+        profile_path, _ = cpuProfile.save(dest_dir, f'profile-{int(start_epoch * 1000)}', profile_data, trace)
+        print(f'CPU profile ({elapsed:.1f}s): {profile_path}')
+        print(cpuProfile.format_summary(cpuProfile.top_self_time(profile_data)))
+
+    async def run(self, f, last_path=None, screenshot=True, permissions=None, new_context=False, new_page=False,
+                  web_perf=None, profile=None, requires=None, provides=None, no_animation=None, step_name=None):
+        """
+        最後に積まれたページに対してステップ f(page) を実行し、スクリーンショットを返す。
+
+        :param profile: True(または'cpu')の場合はステップのCPUプロファイルを、'trace'の場合はトレースも保存する。
+            Noneの場合は profile_threshold を超えた場合のみ保存し、Falseの場合はプロファイルしない
+        :param requires: ステップが必要とする前提条件(名前またはそのリスト)。いずれかが失敗していれば、
+            ステップを実行せずに StepBlocked を送出する
+        :param provides: ステップが満たす前提条件(名前またはそのリスト)。ステップが失敗すると、この前提条件も失敗となる。
+            grdm.login などの組み込みの前提条件は、ステップ内で呼び出すと自動的に記録される
+        :param no_animation: このステップでコンテキストを作成する場合に、アニメーションを無効にするか。
+            Noneの場合はセッションの設定に従う
+        :param step_name: ステップの所要時間の履歴(scripts/stepTimeouts.py)でステップを識別する名前。
+            Noneの場合はステップ関数のコードから求める
+        """
+        step_key = stepTimeouts.step_key(last_path or self.last_path, self._step_identifier(f, step_name))
+        try:
+            self.prerequisites.check(requires, provides=provides)
+        except StepBlocked as e:
+            # 前提条件の失敗によるもので、ステップ自体の失敗ではないため証跡は保存しない
+            print(f'Blocked: {e}', file=sys.stderr)
+            raise
+        if len(self.contexts) == 0 or new_context:
+            await self.new_context(no_animation=no_animation)
+
+        current_context, current_pages = self.contexts[-1]
+        if len(current_pages) == 0 or new_page:
+            current_pages.append(await self.new_page(current_context, prewarm=new_page))
+
+        current_time = time.time()
+        print(f'Start epoch: {current_time} seconds')
+        if permissions is not None:
+            await current_context.grant_permissions(permissions)
+        next_page = None
+        if f is not None:
+            profiler = await self._start_profiler(current_context, current_pages[-1], profile)
+            try:
+                with self.prerequisites.step(provides=provides):
+                    next_page = await self._run_step(f, current_pages[-1], step_key)
+            except:
+                self._record_step_timing(last_path or self.last_path, step_key, current_time, 'failed')
+                await self._finish_profiler(profiler, profile, current_time, last_path=last_path)
+                if self.close_on_fail:
+                    await self.finish(screenshot=screenshot, last_path=last_path)
+                    raise
+                if screenshot:
+                    await self._save_last_screenshot()
+                raise
+            self._record_step_timing(last_path or self.last_path, step_key, current_time, 'succeeded')
+            await self._finish_profiler(profiler, profile, current_time, last_path=last_path)
+        if next_page is not None:
+            current_pages.append(next_page)
+        if self.web_perf if web_perf is None else web_perf:
+            await self._collect_web_perf(current_context, current_pages[-1], current_time)
+        screenshot_path = os.path.join(self.temp_dir, 'screenshot.png')
+        await current_pages[-1].screenshot(path=screenshot_path)
+        return Image(screenshot_path)
+
+    async def close_latest_page(self, last_path=None):
+        if len(self.contexts) == 0:
+            raise Exception('No contexts')
+        current_context, current_pages = self.contexts[-1]
+        if len(self.contexts) <= 1 and len(current_pages) <= 1:
+            raise Exception('It is only possible to close when two or more contexts or pages are stacked')
+        last_path = last_path or self.last_path
+        os.makedirs(last_path, exist_ok=True)
+        last_page = current_pages[-1]
+        if last_page in current_pages[:-1] or any([last_page in p for _, p in self.contexts[:-1]]):
+            # まだインスタンスがページ一覧に存在する場合は、スタックから削除するだけ
+            assert len(current_pages) > 0, current_pages
+            current_pages.pop()
+            return
+        video_path = await last_page.video.path()
+        index = len(current_pages)
+        dest_video_path = os.path.join(last_path, f'video-{index}.webm')
+        shutil.copyfile(video_path, dest_video_path)
+        current_pages.pop()
+        self._web_perf_collector.forget(last_page)
+        await last_page.close()
+        if len(current_pages) > 0:
+            return
+        self.contexts.pop()
+        await self._discard_spare_page(current_context)
+        await current_context.close()
+
+    async def save_screenshot(self, path):
+        await self.current_page.screenshot(path=path)
+        return path
+
+    async def _save_last_screenshot(self, last_path=None):
+        if len(self.contexts) == 0:
+            raise Exception('No contexts')
+        _, current_pages = self.contexts[-1]
+        last_path = last_path or self.last_path
+        os.makedirs(last_path, exist_ok=True)
+        if len(current_pages) == 0:
+            return
+        screenshot_path = os.path.join(self.temp_dir, 'last-screenshot.png')
+        await current_pages[-1].screenshot(path=screenshot_path)
+        dest_screenshot_path = os.path.join(last_path, 'last-screenshot.png')
+        shutil.copyfile(screenshot_path, dest_screenshot_path)
+        print(f'Screenshot: {dest_screenshot_path}')
+
+    async def finish(self, screenshot=False, last_path=None):
+        """最後に積まれたコンテキストの証跡を保存し、全てのコンテキストとブラウザを閉じる。"""
+        await self._finish_contexts(screenshot=screenshot, last_path=last_path)
+        await self._discard_spares()
+        if self.owns_browser and self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+
+    async def _finish_contexts(self, screenshot=False, last_path=None):
+        if len(self.contexts) == 0:
+            return
+        current_context, current_pages = self.contexts[-1]
+        last_path = last_path or self.last_path
+        os.makedirs(last_path, exist_ok=True)
+        if screenshot and len(current_pages) > 0:
+            try:
+                await self._save_last_screenshot(last_path=last_path)
+            except:
+                print('スクリーンショットの取得に失敗しました。', file=sys.stderr)
+                traceback.print_exc()
+                return
+        await self._discard_spares()
+        self.contexts.pop()
+        await current_context.close()
+        for i, current_page in enumerate(current_pages):
+            index = i + 1
+            try:
+                video_path = await current_page.video.path()
+                dest_video_path = os.path.join(last_path, f'video-{index}.webm')
+                shutil.copyfile(video_path, dest_video_path)
+                print(f'Video: {dest_video_path}')
+            except:
+                print('スクリーンキャプチャ動画の取得に失敗しました。', file=sys.stderr)
+                traceback.print_exc()
+                return
+        web_perf_path = os.path.join(self.temp_dir, webPerf.RECORDS_FILENAME)
+        if os.path.exists(web_perf_path):
+            dest_web_perf_path = os.path.join(last_path, webPerf.RECORDS_FILENAME)
+            shutil.copyfile(web_perf_path, dest_web_perf_path)
+            print(f'Web perf: {dest_web_perf_path}')
+        har_path = os.path.join(self._context_dirs.pop(current_context, self.temp_dir), 'har.zip')
+        dest_har_path = os.path.join(last_path, 'har.zip')
+        if os.path.exists(har_path):
+            shutil.copyfile(har_path, dest_har_path)
+            print(f'HAR: {dest_har_path}')
+        else:
+            print('.harファイルの取得に失敗しました。', file=sys.stderr)
+        if self.network_profile is not None:
+            print(self.network_profile.summary())
+        shutil.rmtree(self.temp_dir)
+        for page in current_pages:
+            self._web_perf_collector.forget(page)
+            await page.close()
+        # 残りのコンテキストの証跡は一時ディレクトリとともに破棄されているため、閉じるのみとする
+        while len(self.contexts) > 0:
+            context, _ = self.contexts.pop()
+            await context.close()
+
+
+# Notebookから利用される既定のセッション
+default_session = None
+
+# session_scope の中では、既定のセッションはasyncioタスクごとに保持される。
+# Notebookは importlib.reload(scripts.playwright) を行うため、再読み込み時も同じ変数を引き継ぐ
+_session_scope = globals().get('_session_scope') or ContextVar('session_scope', default=None)
+
+@asynccontextmanager
+async def session_scope(browser=None):
+    """
+    現在のasyncioタスク(とそこから生成されたタスク)に固有の既定セッションを用意する。
+
+    同一プロセスで複数のNotebookを並行に実行する場合に、init_pw_context や run_pw が
+    互いのセッションを上書きしないようにする。スコープを抜ける際に残っているセッションは閉じられる。
+
+    :param browser: スコープ内のセッションが共有するブラウザ
+    """
+    scope = dict(session=None, browser=browser)
+    token = _session_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _session_scope.reset(token)
+        if scope['session'] is not None:
+            await scope['session'].close()
+
+def _get_default_session():
+    scope = _session_scope.get()
+    session = default_session if scope is None else scope['session']
+    if session is None:
+        raise Exception('init_pw_context has not been called')
+    return session
+
+async def run_pw(f, last_path=None, screenshot=True, permissions=None, new_context=False, new_page=False,
+                 web_perf=None, profile=None, requires=None, provides=None, no_animation=None, step_name=None):
+    return await _get_default_session().run(
+        f, last_path=last_path, screenshot=screenshot, permissions=permissions,
+        new_context=new_context, new_page=new_page, web_perf=web_perf, profile=profile,
+        requires=requires, provides=provides, no_animation=no_animation, step_name=step_name,
+    )
+
+async def close_latest_page(last_path=None):
+    await _get_default_session().close_latest_page(last_path=last_path)
+
+async def init_pw_context(close_on_fail=True, last_path=None, pool_size=None, permissions=None, network_profile=None,
+                          web_perf=None, profile_threshold=None, timeout_advisor=None, no_animation=None):
+    global default_session
+    scope = _session_scope.get()
+    previous = default_session if scope is None else scope['session']
+    if previous is not None:
+        await previous.close()
+    session = await Session(
+        last_path=last_path,
+        close_on_fail=close_on_fail,
+        browser=None if scope is None else scope['browser'],
+        pool_size=default_pool_size() if pool_size is None else pool_size,
+        permissions=permissions,
+        network_profile=network_profile,
+        web_perf=web_perf,
+        profile_threshold=profile_threshold,
+        timeout_advisor=timeout_advisor,
+        no_animation=no_animation,
+    ).start()
+    if scope is None:
+        default_session = session
     else:
-        print('.harファイルの取得に失敗しました。', file=sys.stderr)
-    shutil.rmtree(temp_dir)
-    for page in current_pages:
-        await page.close()
-    if len(current_contexts) == 0:
-        return
-    await _finish_pw_context(screenshot=False, last_path=last_path)
\ No newline at end of file
+        scope['session'] = session
+    return (session.session_id, session.temp_dir)
+
+async def finish_pw_context(screenshot=False, last_path=None):
+    await _get_default_session().finish(screenshot=screenshot, last_path=last_path)
+
+async def save_screenshot(path):
+    return await _get_default_session().save_screenshot(path)
@@ -0,0 +1,208 @@
+# ステップの前提条件(ログイン、プロジェクトの作成、ストレージの選択など)
+#
+# 前提条件を満たすステップ(provides)が失敗すると、その前提条件は失敗として記録される。
+# 以降、その前提条件を必要とするステップ(requires)は、ページ遷移のタイムアウトを待たずに
+# StepBlocked を送出して直ちに終了する。ブロックされたステップが提供する前提条件も失敗となり、連鎖的にブロックされる。
+#
+# 前提条件の状態はセッション(scripts.playwright.Session)ごとに保持される。
+# grdm.login などの共通処理は prerequisite デコレータにより、ステップ内で呼び出されると組み込みの前提条件を記録する。
+# 管理者ページへのログイン(grdm.login_as_admin)はGRDMへのログインとは別の前提条件(admin-login)とする。
+#
+# papermillは最初に失敗したセルでNotebookを終了するため、セッション内の記録だけでは後続のNotebookをブロックできない。
+# そこで scope を指定した prerequisite デコレータの失敗(IdPやアカウントごとのログインの失敗など)は、
+# テスト実行全体で共有する状態ファイル(結果ディレクトリ内)にも記録する。以降のNotebookで同じ scope の処理が
+# 呼び出されると、ログイン画面のタイムアウトを待たずに StepBlocked を送出する。
+#
+#     await run_pw(_step, provides='storage', requires=['login', 'project'])
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import fcntl
+import functools
+import json
+import os
+
+ENV_STATE_PATH = 'GRDM_PREREQUISITES_STATE'
+# 結果ディレクトリ内の状態ファイル名
+FILENAME = '.prerequisites.json'
+
+# 組み込みの前提条件
+LOGIN = 'login'
+ADMIN_LOGIN = 'admin-login'
+PROJECT = 'project'
+STORAGE = 'storage'
+
+# 実行中のステップのトラッカー。再読み込み時も同じ変数を引き継ぐ
+_current = globals().get('_current') or ContextVar('prerequisites', default=None)
+
+
+class StepBlocked(Exception):
+    """前提条件が失敗しているため、ステップを実行しなかったことを示す。"""
+
+    def __init__(self, prerequisite, reason=None):
+        self.prerequisite = prerequisite
+        self.reason = reason
+        message = f'prerequisite "{prerequisite}" failed'
+        if reason:
+            message += f': {reason}'
+        super().__init__(message)
+
+
+def _names(names):
+    if names is None:
+        return []
+    if isinstance(names, str):
+        return [names]
+    return list(names)
+
+
+def _reason(error):
+    if isinstance(error, StepBlocked):
+        return f'blocked by "{error.prerequisite}"'
+    return f'{type(error).__name__}: {error}'.strip()
+
+
+class SharedFailures:
+    """
+    テスト実行全体で共有する前提条件の失敗。
+
+    :param state_path: 状態を保存するJSONファイルのパス。同一パスを指定した全てのプロセスで状態が共有される
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.lock_path = state_path + '.lock'
+
+    def _read(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def get(self, key):
+        """key の失敗の理由を返す。失敗していなければNoneを返す。"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                return self._read().get(key)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def record(self, key, reason):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                failures = self._read()
+                failures[key] = reason
+                tmp_path = self.state_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(failures, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def from_environ():
+    """環境変数で状態ファイルが指定されていればSharedFailuresを返す。指定がなければNoneを返す。"""
+    state_path = os.environ.get(ENV_STATE_PATH)
+    if not state_path:
+        return None
+    return SharedFailures(state_path)
+
+
+def configure_environ(result_dir):
+    """以降に起動されるカーネルが結果ディレクトリ内の同一の状態ファイルを共有するよう、環境変数を設定する。"""
+    shared = SharedFailures(os.path.abspath(os.path.join(result_dir, FILENAME)))
+    os.environ[ENV_STATE_PATH] = shared.state_path
+    return shared
+
+
+class Tracker:
+    """
+    前提条件ごとの成否(失敗の場合はその理由)を保持する。
+
+    :param shared: テスト実行全体で共有する失敗(SharedFailures)。Noneの場合はセッション内でのみ保持する
+    """
+
+    def __init__(self, shared=None):
+        self.failures = {}
+        self.shared = shared
+
+    def check(self, requires, provides=None):
+        """requires のいずれかが失敗していれば、provides の前提条件も失敗として StepBlocked を送出する。"""
+        for name in _names(requires):
+            if name in self.failures:
+                blocked = StepBlocked(name, self.failures[name])
+                for provided in _names(provides):
+                    self.failed(provided, blocked)
+                raise blocked
+
+    def satisfied(self, name):
+        self.failures.pop(name, None)
+
+    def failed(self, name, error):
+        self.failures[name] = _reason(error)
+
+    def check_shared(self, name, key):
+        """先行するNotebookで key が失敗していれば、name を失敗として StepBlocked を送出する。"""
+        if self.shared is None:
+            return
+        reason = self.shared.get(key)
+        if reason is None:
+            return
+        blocked = StepBlocked(name, f'failed earlier in this run ({key}): {reason}')
+        self.failed(name, blocked)
+        raise blocked
+
+    def failed_shared(self, key, error):
+        if self.shared is not None:
+            self.shared.record(key, _reason(error))
+
+    @contextmanager
+    def step(self, provides=None):
+        """ブロック内をステップとして実行し、成否に応じて provides の前提条件を記録する。"""
+        token = _current.set(self)
+        try:
+            yield self
+        except BaseException as e:
+            for name in _names(provides):
+                self.failed(name, e)
+            raise
+        else:
+            for name in _names(provides):
+                self.satisfied(name)
+        finally:
+            _current.reset(token)
+
+
+def prerequisite(name, requires=None, scope=None):
+    """
+    非同期関数を前提条件 name を満たす処理とするデコレータ。
+
+    ステップ内で呼び出された場合、requires が失敗していれば実行せずに StepBlocked を送出し、
+    実行結果に応じて name の成否を記録する。ステップ外(負荷試験など)では何もしない。
+
+    :param scope: 関数の引数から失敗を共有する範囲(IdPとアカウントなど)を返す関数。
+        指定した場合、失敗をテスト実行全体で共有し、同じ範囲で失敗済みであれば実行せずに StepBlocked を送出する
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            tracker = _current.get()
+            if tracker is None:
+                return await f(*args, **kwargs)
+            tracker.check(requires)
+            key = f'{name}:{scope(*args, **kwargs)}' if scope is not None else None
+            if key is not None:
+                tracker.check_shared(name, key)
+            try:
+                result = await f(*args, **kwargs)
+            except BaseException as e:
+                tracker.failed(name, e)
+                if key is not None:
+                    tracker.failed_shared(key, e)
+                raise
+            tracker.satisfied(name)
+            return result
+        return wrapper
+    return decorator
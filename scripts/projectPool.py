@@ -0,0 +1,268 @@
+# テストで使用するGRDMプロジェクトを事前に作成し、Notebookに払い出すためのユーティリティ
+#
+# テスト実行の開始前にGRDM API v2でプロジェクトをまとめて作成しておき、Notebookが
+# grdm.ensure_project_exists でプロジェクトを要求した際に、その1つを要求された名前に変更して払い出す。
+# grdm.delete_project で削除されたプロジェクトはその場では削除せず、テスト実行の終了時にまとめて削除する。
+# 作成済みのプロジェクト(setup_test_data.py で作成したものなど)をプールに追加した場合、それらは削除せず、
+# 払い出し時に変更した名前を元に戻す(grdm.delete_project で削除された場合は、その場で元の名前に戻してプールに返す)。
+# 払い出そうとしたプロジェクトが既に存在しない(404/410)場合は、プールから取り除いて次のプロジェクトを払い出す。
+#
+# プールの状態はJSONファイルに保存し、並列に実行される複数のカーネル(プロセス)間でファイルロックを用いて共有する。
+# トークンは状態ファイルには保存せず、環境変数でカーネルに引き継ぐ。
+
+import fcntl
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ENV_STATE_PATH = 'GRDM_PROJECT_POOL_STATE'
+ENV_API_URL = 'GRDM_PROJECT_POOL_API_URL'
+ENV_TOKEN = 'GRDM_PROJECT_POOL_TOKEN'
+
+JSONAPI_CONTENT_TYPE = 'application/vnd.api+json'
+BULK_CONTENT_TYPE = 'application/vnd.api+json; ext=bulk'
+# GRDM API v2 の一括操作で指定できる最大件数
+BULK_LIMIT = 100
+# プロジェクトが存在しないことを示すステータスコード
+GONE_STATUS_CODES = (404, 410)
+
+
+class ProjectPool:
+    """
+    事前に作成したプロジェクトのプール。
+
+    :param state_path: 状態を保存するJSONファイルのパス。同一パスを指定した全てのプロセスで状態が共有される
+    :param api_url: GRDM APIのURL(例: https://api.rdm.example.com/)
+    :param token: プロジェクトを作成するユーザーのPersonal Access Token
+    :param title_prefix: 払い出し前のプロジェクトのタイトルの接頭辞
+    """
+
+    def __init__(self, state_path, api_url, token, title_prefix='E2E-POOL'):
+        self.state_path = state_path
+        self.lock_path = state_path + '.lock'
+        self.api_url = api_url
+        self.token = token
+        self.title_prefix = title_prefix
+
+    def _read(self):
+        if not os.path.exists(self.state_path):
+            return dict(projects=[])
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def _update(self, f):
+        """ロックを取得した状態で状態を読み出し、f(state)で更新して書き戻す。fの戻り値を返す。"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read()
+                result = f(state)
+                tmp_path = self.state_path + '.tmp'
+                with open(tmp_path, 'w') as sf:
+                    json.dump(state, sf, indent=1, ensure_ascii=False)
+                os.replace(tmp_path, self.state_path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _request(self, method, path, content_type=JSONAPI_CONTENT_TYPE, **kwargs):
+        response = requests.request(
+            method,
+            self.api_url.rstrip('/') + '/v2/' + path,
+            headers={
+                'Authorization': f'Bearer {self.token}',
+                'Content-Type': content_type,
+            },
+            timeout=60,
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    def _create(self, title):
+        response = self._request('POST', 'nodes/', json=dict(data=dict(
+            type='nodes',
+            attributes=dict(title=title, category='project'),
+        )))
+        return response.json()['data']['id']
+
+    def _rename(self, project_id, title):
+        self._request('PATCH', f'nodes/{project_id}/', json=dict(data=dict(
+            type='nodes',
+            id=project_id,
+            attributes=dict(title=title),
+        )))
+
+    def provision(self, size, max_workers=4):
+        """size個のプロジェクトを並行に作成し、プールに追加する。"""
+        run_id = time.strftime('%Y%m%d-%H%M%S')
+        titles = [f'{self.title_prefix}-{run_id}-{i + 1}' for i in range(size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            project_ids = list(executor.map(self._create, titles))
+
+        def add(state):
+            state['projects'] += [
+                dict(id=project_id, title=title, leased_by=None, deleted=False, provisioned=True)
+                for project_id, title in zip(project_ids, titles)
+            ]
+        self._update(add)
+        print(f'Provisioned {len(project_ids)} project(s) for the project pool')
+        return project_ids
+
+    def add_projects(self, projects):
+        """
+        他の手段(Django ORMなど)で作成済みのプロジェクト({'id', 'title'}のリスト)をプールに追加する。
+
+        これらのプロジェクトは削除せず、払い出されていれば元の名前に戻す。
+        """
+        def add(state):
+            known = set(p['id'] for p in state['projects'])
+            state['projects'] += [
+                dict(id=project['id'], title=project['title'], leased_by=None, deleted=False, provisioned=False)
+                for project in projects
+                if project['id'] not in known
+            ]
+        self._update(add)
+
+    def lease(self, project_name):
+        """
+        未使用のプロジェクトを1つ取り出し、project_nameに名前を変更して払い出す。
+
+        プールが空の場合はAPIで新たに作成する。既に存在しないプロジェクトはプールから取り除き、次のプロジェクトを払い出す。
+        :return: プロジェクトID
+        """
+        def take(state):
+            for project in state['projects']:
+                if project['leased_by'] is None and not project['deleted']:
+                    project['leased_by'] = project_name
+                    return project['id']
+            return None
+        while True:
+            project_id = self._update(take)
+            if project_id is None:
+                break
+            try:
+                self._rename(project_id, project_name)
+                return project_id
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in GONE_STATUS_CODES:
+                    raise
+                print(f'Project {project_id} no longer exists, removed from the project pool')
+                self._remove(project_id)
+        project_id = self._create(project_name)
+
+        def add(state):
+            state['projects'].append(dict(
+                id=project_id, title=project_name, leased_by=project_name, deleted=False, provisioned=True,
+            ))
+        self._update(add)
+        return project_id
+
+    def _remove(self, project_id):
+        def remove(state):
+            state['projects'] = [p for p in state['projects'] if p['id'] != project_id]
+        self._update(remove)
+
+    def is_leased(self, project_id):
+        return any(
+            project['id'] == project_id and project['leased_by'] is not None
+            for project in self._read()['projects']
+        )
+
+    def mark_deleted(self, project_id):
+        """
+        プロジェクトを削除予定とする。実際の削除は cleanup でまとめて行う。
+
+        作成済みのプロジェクトとして追加されたものは削除せず、元の名前に戻してプールに返す。
+        """
+        def mark(state):
+            for project in state['projects']:
+                if project['id'] != project_id:
+                    continue
+                if project.get('provisioned', True):
+                    project['deleted'] = True
+                    return None
+                return project['title']
+            return None
+        title = self._update(mark)
+        if title is None:
+            return
+        try:
+            self._rename(project_id, title)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in GONE_STATUS_CODES:
+                raise
+            self._remove(project_id)
+            return
+
+        def release(state):
+            for project in state['projects']:
+                if project['id'] == project_id:
+                    project['leased_by'] = None
+        self._update(release)
+
+    def _delete(self, project_ids):
+        try:
+            self._request('DELETE', 'nodes/', content_type=BULK_CONTENT_TYPE, json=dict(data=[
+                dict(type='nodes', id=project_id) for project_id in project_ids
+            ]))
+            return
+        except requests.RequestException:
+            traceback.print_exc()
+            print('Bulk deletion failed, deleting projects one by one')
+        for project_id in project_ids:
+            try:
+                self._request('DELETE', f'nodes/{project_id}/')
+            except requests.RequestException:
+                traceback.print_exc()
+
+    def cleanup(self):
+        """
+        プールが作成したプロジェクト(未使用のもの、削除予定のものを含む)をまとめて削除する。
+
+        作成済みのプロジェクトとして追加されたものは削除せず、払い出されていれば元の名前に戻す。
+        :return: 削除したプロジェクトIDのリスト
+        """
+        projects = self._update(lambda state: state['projects'])
+        project_ids = [
+            project['id'] for project in projects
+            if project.get('provisioned', True)
+        ]
+        for i in range(0, len(project_ids), BULK_LIMIT):
+            self._delete(project_ids[i:i + BULK_LIMIT])
+        restored = [
+            project for project in projects
+            if project['id'] not in project_ids and project['leased_by'] is not None
+        ]
+        for project in restored:
+            try:
+                self._rename(project['id'], project['title'])
+            except requests.RequestException:
+                traceback.print_exc()
+
+        processed = set(project['id'] for project in projects)
+
+        def clear(state):
+            state['projects'] = [p for p in state['projects'] if p['id'] not in processed]
+        self._update(clear)
+        print(f'Deleted {len(project_ids)} project(s) and restored {len(restored)} title(s) of the project pool')
+        return project_ids
+
+
+def from_environ():
+    """環境変数で状態ファイルが指定されていればProjectPoolを返す。指定がなければNoneを返す。"""
+    state_path = os.environ.get(ENV_STATE_PATH)
+    if not state_path:
+        return None
+    return ProjectPool(state_path, os.environ.get(ENV_API_URL), os.environ.get(ENV_TOKEN))
+
+
+def configure_environ(pool):
+    """以降に起動されるカーネルが同一のプールを共有するよう、環境変数を設定する。"""
+    os.environ[ENV_STATE_PATH] = os.path.abspath(pool.state_path)
+    os.environ[ENV_API_URL] = pool.api_url
+    os.environ[ENV_TOKEN] = pool.token
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-import json
 import sys
 import re
 
+try:
+    from scripts import notebookStream
+except ImportError:
+    # Executed as `python scripts/replace_rdm_url.py`
+    import notebookStream
+
 def replace_rdm_urls_in_content(content):
     """Replace rdm.nii.ac.jp URLs with rdm.example.com in content."""
     if isinstance(content, str):
@@ -32,38 +37,33 @@ def replace_emails_in_content(content):
 
 def replace_rdm_urls_in_notebook(notebook_path):
     """Replace rdm.nii.ac.jp URLs and emails in parameters cells."""
-    with open(notebook_path, 'r', encoding='utf-8') as f:
-        notebook = json.load(f)
-    
-    modified = False
-    
-    # Process each cell
-    for cell in notebook.get('cells', []):
+    def replace_cell(cell):
         # Process source
-        if 'source' in cell:
-            original = cell['source']
-            
-            # Check if this is a markdown cell or a code cell with parameters tag
-            is_markdown = cell.get('cell_type') == 'markdown'
-            is_parameters_code = (
-                cell.get('cell_type') == 'code' and
-                'metadata' in cell and 
-                'tags' in cell['metadata'] and 
-                'parameters' in cell['metadata']['tags']
-            )
-            
-            if is_markdown or is_parameters_code:
-                # Replace RDM URLs
-                cell['source'] = replace_rdm_urls_in_content(cell['source'])
-                # Replace emails
-                cell['source'] = replace_emails_in_content(cell['source'])
-            
-            if original != cell['source']:
-                modified = True
+        if 'source' not in cell:
+            return False
+        original = cell['source']
+        
+        # Check if this is a markdown cell or a code cell with parameters tag
+        is_markdown = cell.get('cell_type') == 'markdown'
+        is_parameters_code = (
+            cell.get('cell_type') == 'code' and
+            'metadata' in cell and 
+            'tags' in cell['metadata'] and 
+            'parameters' in cell['metadata']['tags']
+        )
+        
+        if is_markdown or is_parameters_code:
+            # Replace RDM URLs
+            cell['source'] = replace_rdm_urls_in_content(cell['source'])
+            # Replace emails
+            cell['source'] = replace_emails_in_content(cell['source'])
+        
+        return original != cell['source']
+    
+    # Cells are streamed one at a time so that huge result notebooks are not loaded at once
+    modified = notebookStream.rewrite_cells(notebook_path, replace_cell) > 0
     
     if modified:
-        with open(notebook_path, 'w', encoding='utf-8') as f:
-            json.dump(notebook, f, indent=1, ensure_ascii=False)
         print(f"Updated: {notebook_path}")
     else:
         print(f"No changes needed: {notebook_path}")
@@ -7,6 +7,8 @@ from dataclasses import dataclass
 from typing import Iterator
 from itertools import islice
 
+from scripts import runManifest
+
 def is_markdown_cell(cell):
     return cell['cell_type'] == 'markdown'
 
@@ -29,8 +31,12 @@ def is_step_sequence_header(markdown_cell):
     m = re.match(r'#\s+(.+)', source_first_line(markdown_cell))
     return bool(m) and m.group(1) != '報告書出力'
 
+# `notebook_file` may also be an already loaded notebook.
 def iter_step_sequences(notebook_file):
-    notebook = nbformat.read(notebook_file, as_version=nbformat.NO_CONVERT)
+    if isinstance(notebook_file, NotebookNode):
+        notebook = notebook_file
+    else:
+        notebook = nbformat.read(notebook_file, as_version=nbformat.NO_CONVERT)
     cells = notebook['cells']
     current_header = None
     for i, cell in enumerate(cells):
@@ -48,9 +54,13 @@ def iter_step_sequences(notebook_file):
     if current_header is not None:
         yield islice(cells, current_header, None)
 
-# As long as the test notebooks are executed sequentially, this
-# implementation must be enough.
+# Notebooks are listed from the run manifest in execution order. Results
+# without a manifest fall back to sorting by mtime, which is only correct
+# while the test notebooks are executed sequentially.
 def collect_all_notebooks(result_dir):
+    notebooks = runManifest.collect_notebooks(result_dir)
+    if notebooks is not None:
+        return notebooks
     return sorted(
         (
             p for p in Path(result_dir).rglob("*.ipynb")
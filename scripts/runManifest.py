@@ -0,0 +1,221 @@
+# テスト実行の記録(実行マニフェスト)
+#
+# ランナーと取りまとめNotebook(papermillHelpers.run_notebook)は、Notebookの実行開始時と終了時に
+# 結果ディレクトリの run-manifest.jsonl へ1行ずつイベントを追記する。
+# 集計処理はこのファイルのみを読み込み、結果ディレクトリを走査せずに実行済みNotebookとその順序を得る。
+#
+# イベントの項目:
+# - event: 'start' または 'end'
+# - notebook: 実行後のNotebookのパス(マニフェストのあるディレクトリからの相対パス)
+# - input: 実行したNotebook
+# - parent: このNotebookを実行した取りまとめNotebook(ランナーが直接実行した場合はNone)
+# - params_hash: パラメータのハッシュ
+# - result_path: スクリーンショットなどの証跡の保存先ディレクトリ
+# - start, end: 開始・終了日時(UTC、ISO 8601)
+# - status: 'running'、'completed'、'failed'(セルの実行に失敗)、'error'(Notebookを実行できなかった)
+# - artifacts: result_path 配下の証跡のパス(子Notebookのものを除く)
+#
+# 複数のプロセス・スレッドから並行に追記されるため、書き込みはファイルロックで直列化する。
+# 表示順は実行の木構造(取りまとめNotebookの直後にその子Notebook)とし、兄弟間は開始日時の順とする。
+
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+FILENAME = 'run-manifest.jsonl'
+ENV_MANIFEST = 'GRDM_RUN_MANIFEST'
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def params_hash(parameters):
+    """パラメータ(JSONに変換できない値は文字列として扱う)のハッシュを返す。"""
+    data = json.dumps(parameters or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+def _is_within(path, directory):
+    path = os.path.abspath(path)
+    directory = os.path.abspath(directory)
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class Manifest:
+    """
+    実行マニフェストへの書き込みと読み込み。
+
+    :param path: マニフェストのパス。記録されるパスはこのファイルのあるディレクトリからの相対パスとなる
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+
+    def _relpath(self, path):
+        if path is None:
+            return None
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def entries(self):
+        """Notebookごとに開始・終了イベントをまとめたエントリを、記録された順に返す。"""
+        return merge_events(read_events(self.path))
+
+    def find_parent(self, path):
+        """pathを証跡の保存先に含む、実行中のNotebook(取りまとめNotebook)を返す。"""
+        parent = None
+        for entry in self.entries():
+            result_path = entry.get('result_path')
+            if entry['status'] != 'running' or result_path is None:
+                continue
+            if _is_within(path, os.path.join(self.base_dir, result_path)):
+                if parent is None or len(result_path) > len(parent['result_path']):
+                    parent = entry
+        return parent['notebook'] if parent is not None else None
+
+    def _artifacts(self, result_path):
+        if result_path is None or not os.path.isdir(result_path):
+            return []
+        artifacts = []
+        for root, dirs, files in os.walk(result_path):
+            # 子Notebookとその証跡は、子Notebookのエントリに記録される
+            child_notebooks = set(os.path.splitext(name)[0] for name in files if name.endswith('.ipynb'))
+            dirs[:] = [d for d in dirs if d not in child_notebooks and d != '.ipynb_checkpoints']
+            artifacts += [
+                self._relpath(os.path.join(root, name)) for name in sorted(files) if not name.endswith('.ipynb')
+            ]
+        return artifacts
+
+    @contextmanager
+    def record(self, notebook, input_notebook=None, parent=None, parameters=None, result_path=None):
+        """
+        ブロック内でのNotebookの実行を記録する。
+
+        :param notebook: 実行後のNotebookのパス
+        :param parent: 親のNotebookのパス(マニフェストからの相対パス)。ランナーが直接実行する場合はNone
+        """
+        event = dict(
+            notebook=self._relpath(notebook),
+            input=input_notebook,
+            parent=parent,
+            params_hash=params_hash(parameters),
+            result_path=self._relpath(result_path),
+            start=_now(),
+        )
+        self.append(dict(event, event='start', status='running'))
+        status = 'completed'
+        try:
+            yield event
+        except BaseException as e:
+            status = 'failed' if type(e).__name__ == 'PapermillExecutionError' else 'error'
+            raise
+        finally:
+            self.append(dict(
+                event,
+                event='end',
+                end=_now(),
+                status=status,
+                artifacts=self._artifacts(result_path),
+            ))
+
+
+def parse_events(text):
+    return [json.loads(line) for line in text.split('\n') if line.strip()]
+
+
+def read_events(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_events(f.read())
+
+
+def merge_events(events):
+    """開始・終了イベントを、Notebookごとの最新の状態にまとめる。"""
+    entries = {}
+    for event in events:
+        entry = entries.setdefault(event['notebook'], {})
+        entry.update(event)
+    return list(entries.values())
+
+
+def ordered(entries):
+    """エントリを実行の木構造の順(親の直後にその子、兄弟間は開始日時の順)に並べる。"""
+    notebooks = set(entry['notebook'] for entry in entries)
+    children = {}
+    for entry in entries:
+        parent = entry.get('parent') if entry.get('parent') in notebooks else None
+        children.setdefault(parent, []).append(entry)
+    result = []
+
+    def visit(parent):
+        for entry in sorted(children.get(parent, []), key=lambda e: (e['start'], e['notebook'])):
+            result.append(entry)
+            visit(entry['notebook'])
+    visit(None)
+    return result
+
+
+def find_manifests(result_dir):
+    """結果ディレクトリ、またはその直下の各実行(シャード)のディレクトリにあるマニフェストのパスを返す。"""
+    result_dir = Path(result_dir)
+    if (result_dir / FILENAME).exists():
+        return [result_dir / FILENAME]
+    return sorted(result_dir.glob(f'*/{FILENAME}'))
+
+
+def load_entries(result_dir):
+    """
+    結果ディレクトリのマニフェストを読み込み、実行の順に並べたエントリを返す。
+    notebook、result_path、artifacts は絶対パスに変換する。マニフェストがなければNoneを返す。
+    """
+    manifests = find_manifests(result_dir)
+    if len(manifests) == 0:
+        return None
+    entries = []
+    for manifest_path in manifests:
+        base_dir = manifest_path.parent
+        for entry in ordered(Manifest(str(manifest_path)).entries()):
+            entry = dict(entry)
+            entry['notebook'] = base_dir / entry['notebook']
+            if entry.get('result_path') is not None:
+                entry['result_path'] = base_dir / entry['result_path']
+            entry['artifacts'] = [base_dir / artifact for artifact in entry.get('artifacts', [])]
+            entries.append(entry)
+    return entries
+
+
+def collect_notebooks(result_dir):
+    """マニフェストに記録された実行済みNotebookのパスを実行の順に返す。マニフェストがなければNoneを返す。"""
+    entries = load_entries(result_dir)
+    if entries is None:
+        return None
+    return [entry['notebook'] for entry in entries if entry['notebook'].exists()]
+
+
+def from_environ():
+    """環境変数でマニフェストが指定されていればManifestを返す。指定がなければNoneを返す。"""
+    path = os.environ.get(ENV_MANIFEST)
+    if not path:
+        return None
+    return Manifest(path)
+
+
+def configure_environ(result_dir):
+    """結果ディレクトリにマニフェストを作成し、以降に起動されるカーネルが追記できるよう環境変数を設定する。"""
+    manifest = Manifest(os.path.join(result_dir, FILENAME))
+    os.environ[ENV_MANIFEST] = os.path.abspath(manifest.path)
+    return manifest
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Sanitize Jupyter notebooks before commit in a single pass.
+
+Applies the rules of clean_notebook_metadata.py, replace_rdm_url.py and
+clean_output.py (in that order) while loading and writing each notebook once:
+- remove lc_notebook_meme/lc_cell_meme lc_server_signature.history
+- replace rdm.nii.ac.jp URLs and email addresses in markdown and parameters cells
+- remove outputs of cells containing rdm.nii.ac.jp, email addresses or AWS access tokens
+
+Base64 image payloads in outputs are not scanned.
+
+Notebooks verified clean are recorded in a cache (under .git/, or ~/.cache if the
+repository has no .git directory) together with the ruleset version, so unchanged
+notebooks are skipped without being parsed.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+RDM_URL_PATTERN = re.compile(r'https?://([^/]*\.)?(rdm\.nii\.ac\.jp)')
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+SENSITIVE_OUTPUT_PATTERN = re.compile(
+    r'rdm\.nii\.ac\.jp'
+    r'|[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    r'|\b(?:AKIA|ABIA|ACCA|ASIA)[A-Z0-9]{16}\b'
+)
+
+
+def is_binary_image(mime_type):
+    """Check if a mime bundle key holds a base64 encoded image."""
+    return mime_type.startswith('image/') and mime_type != 'image/svg+xml'
+
+
+def contains_sensitive(content):
+    """Check if content contains rdm.nii.ac.jp URL, email address or AWS access token."""
+    if isinstance(content, str):
+        return SENSITIVE_OUTPUT_PATTERN.search(content) is not None
+    elif isinstance(content, list):
+        return any(contains_sensitive(item) for item in content)
+    elif isinstance(content, dict):
+        return any(
+            contains_sensitive(v) for k, v in content.items()
+            if not is_binary_image(k)
+        )
+    else:
+        return False
+
+
+def replace_email(match):
+    email = match.group(0)
+    if email.endswith('@example.com'):
+        return email
+    username = email.split('@')[0]
+    return f"{username}@example.com"
+
+
+def replace_in_content(content):
+    """Replace rdm.nii.ac.jp URLs with rdm.example.com, then emails with example.com domains."""
+    if isinstance(content, str):
+        content = RDM_URL_PATTERN.sub(r'https://\1rdm.example.com', content)
+        return EMAIL_PATTERN.sub(replace_email, content)
+    elif isinstance(content, list):
+        return [replace_in_content(item) for item in content]
+    else:
+        return content
+
+
+def remove_signature_history(metadata, key):
+    """Remove metadata[key].lc_server_signature.history. Return True if removed."""
+    signature = metadata.get(key, {}).get('lc_server_signature')
+    if signature is None or 'history' not in signature:
+        return False
+    del signature['history']
+    return True
+
+
+def sanitize_notebook(notebook):
+    """Apply all rules to a loaded notebook in place. Return a list of change descriptions."""
+    changes = []
+    if 'metadata' in notebook and remove_signature_history(notebook['metadata'], 'lc_notebook_meme'):
+        changes.append('removed lc_server_signature.history')
+
+    cleaned_count = 0
+    for i, cell in enumerate(notebook.get('cells', [])):
+        if 'metadata' in cell and remove_signature_history(cell['metadata'], 'lc_cell_meme'):
+            changes.append(f'removed lc_server_signature.history from cell {i}')
+
+        if 'source' in cell:
+            is_markdown = cell.get('cell_type') == 'markdown'
+            is_parameters_code = (
+                cell.get('cell_type') == 'code' and
+                'parameters' in cell.get('metadata', {}).get('tags', [])
+            )
+            if is_markdown or is_parameters_code:
+                replaced = replace_in_content(cell['source'])
+                if replaced != cell['source']:
+                    cell['source'] = replaced
+                    changes.append(f'replaced URLs/emails in cell {i}')
+
+        if 'outputs' in cell and len(cell['outputs']) > 0:
+            if any(contains_sensitive(output) for output in cell['outputs']):
+                cell['outputs'] = []
+                cleaned_count += 1
+    if cleaned_count > 0:
+        changes.append(f'cleaned outputs from {cleaned_count} cells containing sensitive information')
+    return changes
+
+
+def sanitize_file(notebook_path):
+    """Sanitize a notebook file, writing it back only when changed. Return a list of change descriptions."""
+    with open(notebook_path, 'r', encoding='utf-8') as f:
+        notebook = json.load(f)
+    changes = sanitize_notebook(notebook)
+    if changes:
+        with open(notebook_path, 'w', encoding='utf-8') as f:
+            json.dump(notebook, f, indent=1, ensure_ascii=False)
+    return changes
+
+
+def ruleset_version():
+    """Version of the sanitizing rules; any change to this file invalidates the cache."""
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def default_cache_path():
+    """Return .git/sanitize-notebooks-cache.json of the enclosing repository, or a file under ~/.cache."""
+    for directory in [Path.cwd(), *Path.cwd().parents]:
+        if (directory / '.git').is_dir():
+            return directory / '.git' / 'sanitize-notebooks-cache.json'
+    return Path.home() / '.cache' / 'grdm-e2e-test' / 'sanitize-notebooks-cache.json'
+
+
+def file_fingerprint(notebook_path):
+    """Return (size, mtime_ns, sha256) of a file."""
+    stat = os.stat(notebook_path)
+    with open(notebook_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return (stat.st_size, stat.st_mtime_ns, digest)
+
+
+class SanitizeCache:
+    """Content hashes of notebooks verified clean under a given ruleset version."""
+
+    def __init__(self, cache_path, version):
+        self.cache_path = Path(cache_path)
+        self.version = version
+        self.files = {}
+        self.clean_hashes = set()
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+            if data.get('version') == version:
+                self.files = data.get('files', {})
+                self.clean_hashes = set(data.get('clean_hashes', []))
+
+    def is_clean(self, notebook_path):
+        """Check whether the file is known to be clean, hashing it only if its size or mtime changed."""
+        key = os.path.abspath(notebook_path)
+        stat = os.stat(notebook_path)
+        entry = self.files.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2] in self.clean_hashes
+        fingerprint = file_fingerprint(notebook_path)
+        if fingerprint[2] in self.clean_hashes:
+            self.files[key] = list(fingerprint)
+            return True
+        return False
+
+    def add(self, notebook_path, fingerprint):
+        self.files[os.path.abspath(notebook_path)] = list(fingerprint)
+        self.clean_hashes.add(fingerprint[2])
+
+    def save(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': self.version,
+                'files': self.files,
+                'clean_hashes': sorted(self.clean_hashes),
+            }, f)
+        os.replace(tmp_path, self.cache_path)
+
+
+def sanitize_and_fingerprint(notebook_path):
+    """Sanitize a notebook file and return (changes, fingerprint of the resulting file)."""
+    changes = sanitize_file(notebook_path)
+    return changes, file_fingerprint(notebook_path)
+
+
+def sanitize_files(notebook_paths, max_workers=None, cache=None):
+    """Sanitize notebooks in a process pool. Return {path: changes} for paths that were not skipped by the cache."""
+    if cache is not None:
+        notebook_paths = [path for path in notebook_paths if not cache.is_clean(path)]
+    if len(notebook_paths) <= 1:
+        results = [sanitize_and_fingerprint(path) for path in notebook_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            results = list(executor.map(sanitize_and_fingerprint, notebook_paths))
+    if cache is not None:
+        for path, (_, fingerprint) in zip(notebook_paths, results):
+            cache.add(path, fingerprint)
+        cache.save()
+    return dict((path, changes) for path, (changes, _) in zip(notebook_paths, results))
+
+
+def main():
+    args = sys.argv[1:]
+    use_cache = '--no-cache' not in args
+    args = [arg for arg in args if arg != '--no-cache']
+    if len(args) < 1:
+        print("Usage: python sanitize_notebooks.py [--no-cache] <notebook1.ipynb> [notebook2.ipynb ...]")
+        sys.exit(1)
+
+    notebook_paths = [path for path in args if path.endswith('.ipynb') and os.path.exists(path)]
+    for path in args:
+        if path not in notebook_paths:
+            print(f"Warning: {path} is not a valid notebook file or doesn't exist")
+
+    cache = SanitizeCache(default_cache_path(), ruleset_version()) if use_cache else None
+    results = sanitize_files(notebook_paths, cache=cache)
+    updated = 0
+    for path, changes in results.items():
+        if changes:
+            updated += 1
+            print(f"Updated: {path} ({'; '.join(changes)})")
+    print(f"\nSanitized {updated} of {len(results)} notebook(s), skipped {len(notebook_paths) - len(results)} unchanged")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
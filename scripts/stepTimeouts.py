@@ -0,0 +1,152 @@
+# 過去の所要時間に基づくステップごとのタイムアウト
+#
+# run_pw で実行した各ステップの所要時間と成否を、証跡の保存先の step-timings.jsonl に記録する。
+# ステップは「証跡の保存先のディレクトリ名(結果ID)#ステップの識別子」で識別する。
+# 識別子は run_pw の step_name で明示するか、省略した場合はステップ関数のコードのハッシュとする
+# (同じコードのステップがセッション内で複数回実行される場合は、その出現順を付加する)。
+# 実行順に依存しないため、ステップを追加・削除しても他のステップの履歴は引き継がれる。
+# ステップのコードを変更した場合は、新しいステップとして履歴を取り直す。
+# テスト実行の終了時に、成功したステップの所要時間を履歴ファイル(ステップごとに直近 MAX_SAMPLES 件)に追加する。
+#
+# 履歴ファイルを指定して実行すると、履歴が MIN_SAMPLES 件以上あるステップには、
+# 所要時間のp99に倍率を掛け、下限(floor)と上限(ceiling)の範囲に収めた時間をステップ全体のタイムアウトとして適用する。
+# タイムアウトしたステップは StepTimeout で失敗し、個々の expect(..., timeout=transition_timeout) を待たずに終了する。
+# 履歴の少ないステップには適用せず、従来どおり transition_timeout のみで待つ。
+
+import hashlib
+import json
+import math
+import os
+import sys
+from pathlib import Path
+
+ENV_HISTORY = 'GRDM_STEP_TIMEOUT_HISTORY'
+ENV_MULTIPLIER = 'GRDM_STEP_TIMEOUT_MULTIPLIER'
+ENV_FLOOR = 'GRDM_STEP_TIMEOUT_FLOOR'
+ENV_CEILING = 'GRDM_STEP_TIMEOUT_CEILING'
+RECORDS_FILENAME = 'step-timings.jsonl'
+
+DEFAULT_MULTIPLIER = 3.0
+DEFAULT_FLOOR = 15.0
+DEFAULT_CEILING = 300.0
+MIN_SAMPLES = 5
+MAX_SAMPLES = 50
+
+
+class StepTimeout(Exception):
+    """ステップが過去の所要時間から求めたタイムアウトを超えたことを示す。"""
+    pass
+
+
+def _update_code_digest(digest, code):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _update_code_digest(digest, const)
+        elif isinstance(const, frozenset):
+            # 要素の順序はハッシュのランダム化によりプロセスごとに異なる
+            digest.update(repr(sorted(repr(c) for c in const)).encode('utf-8'))
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+
+def code_digest(f):
+    """ステップ関数のコードのハッシュ(12桁)を返す。関数を定義し直してもコードが同じであれば同じ値となる。"""
+    digest = hashlib.sha1()
+    _update_code_digest(digest, f.__code__)
+    return digest.hexdigest()[:12]
+
+
+def step_key(last_path, step):
+    return f'{os.path.basename(os.path.normpath(last_path))}#{step}'
+
+
+def p99(values):
+    """p99(最近傍順位法)を返す。"""
+    values = sorted(values)
+    return values[max(1, math.ceil(0.99 * len(values))) - 1]
+
+
+class TimeoutAdvisor:
+    """
+    ステップの所要時間の履歴からタイムアウト(秒)を求める。
+
+    :param history: ステップの識別子から所要時間(秒)のリストへの辞書
+    :param multiplier: p99に掛ける倍率
+    :param floor: タイムアウトの下限(秒)
+    :param ceiling: タイムアウトの上限(秒)
+    """
+
+    def __init__(self, history, multiplier=DEFAULT_MULTIPLIER, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING):
+        self.history = history
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+
+    def timeout(self, key):
+        """ステップのタイムアウト(秒)を返す。履歴が不足している場合はNoneを返す。"""
+        samples = self.history.get(key, [])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return min(max(p99(samples) * self.multiplier, self.floor), self.ceiling)
+
+
+def load_history(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_records(result_dir):
+    """結果ディレクトリ配下の全ての step-timings.jsonl を読み込む。"""
+    records = []
+    for path in sorted(Path(result_dir).rglob(RECORDS_FILENAME)):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def update_history(history_path, result_dir):
+    """結果ディレクトリで成功したステップの所要時間を履歴ファイルに追加し、追加した件数を返す。"""
+    history = load_history(history_path)
+    records = [record for record in load_records(result_dir) if record['status'] == 'succeeded']
+    for record in sorted(records, key=lambda r: r['start_epoch']):
+        samples = history.setdefault(record['step'], [])
+        samples.append(round(record['duration'], 3))
+        del samples[:-MAX_SAMPLES]
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=1, ensure_ascii=False, sort_keys=True)
+    return len(records)
+
+
+def from_environ():
+    """環境変数で履歴ファイルが指定されていればTimeoutAdvisorを返す。指定がなければNoneを返す。"""
+    history_path = os.environ.get(ENV_HISTORY)
+    if not history_path:
+        return None
+    return TimeoutAdvisor(
+        load_history(history_path),
+        multiplier=float(os.environ.get(ENV_MULTIPLIER, DEFAULT_MULTIPLIER)),
+        floor=float(os.environ.get(ENV_FLOOR, DEFAULT_FLOOR)),
+        ceiling=float(os.environ.get(ENV_CEILING, DEFAULT_CEILING)),
+    )
+
+
+def configure_environ(history_path, multiplier=DEFAULT_MULTIPLIER, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING):
+    """以降に起動されるカーネルが同一の履歴からタイムアウトを求めるよう、環境変数を設定する。"""
+    os.environ[ENV_HISTORY] = os.path.abspath(history_path)
+    os.environ[ENV_MULTIPLIER] = str(multiplier)
+    os.environ[ENV_FLOOR] = str(floor)
+    os.environ[ENV_CEILING] = str(ceiling)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python -m scripts.stepTimeouts <history.json> <result_dir> [<result_dir> ...]', file=sys.stderr)
+        sys.exit(2)
+    for result_dir in sys.argv[2:]:
+        print(f'{update_history(sys.argv[1], result_dir)} step timing(s) added from {result_dir}')
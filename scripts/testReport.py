@@ -0,0 +1,478 @@
+# 実行済みNotebookからのテスト結果報告書(Excel、JSON、HTML)の作成
+#
+# Notebookのレベル1見出しをテストケース、レベル2見出しをステップとして扱う。
+# 報告書の作成は次の2段階に分かれる。
+# - extract_cases: Notebookを1回だけ読み込み、テストケースとステップの結果、スクリーンショットを取り出す
+# - assign_test_ids 以降: 取り出した結果に実行順のテストIDを割り当て、各形式の報告書を出力する
+# 取り出した結果はNotebookごとに独立しているため、実行中に終了したNotebookから順に処理し、
+# 報告書だけを作り直すことができる(liveReport)。
+#
+# ステップの状態は、成功・失敗に加えて、前提条件の失敗(scripts/prerequisites.py の StepBlocked)により
+# 実行されなかった場合を「ブロック」とし、失敗とは区別する。
+# 前のセルの失敗によりNotebookの実行が打ち切られ、出力のないステップは従来どおり失敗とする。
+#
+# ワークブックに貼り付けるスクリーンショットは、prepare_thumbnails で表示サイズに縮小・再圧縮したものを使う。
+# 元の画像(screenshots/ にコピーするもの)はそのまま残る。
+
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from base64 import b64decode
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import nbformat
+import openpyxl
+from openpyxl.drawing.image import Image as SheetImage
+from openpyxl.styles import Alignment
+from PIL import Image
+
+from scripts.workbook import header_bgcolor, summary_columns
+
+SUMMARY_JSON_FILENAME = 'test-summary.json'
+INDEX_HTML_FILENAME = 'test-summary.html'
+
+# ステップの行の高さ(既定の列幅13の12倍)と、そこに貼り付けるスクリーンショットの最大の表示サイズ(ピクセル)
+STEP_ROW_HEIGHT = 13 * 12
+SCREENSHOT_SIZE = (int(STEP_ROW_HEIGHT / 1080 * 1920), STEP_ROW_HEIGHT)
+THUMBNAIL_QUALITY = 85
+
+# ステップとテストケースの状態と、報告書での表記
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+RESULT_LABELS = {SUCCEEDED: '成功', FAILED: '失敗', BLOCKED: 'ブロック'}
+STEP_MARKS = {SUCCEEDED: '■', FAILED: '□', BLOCKED: '－'}
+BLOCKED_ENAME = 'StepBlocked'
+
+
+def workbook_filename(date=None):
+    date = date or datetime.now()
+    return f'test-summary-{date.strftime("%Y-%m-%d")}.xlsx'
+
+
+def has_header1(cell):
+    if cell['cell_type'] != 'markdown':
+        return False
+    line = cell['source'].split('\n')[0]
+    return re.match(r'^#\s+(.+)', line) is not None
+
+
+def has_header2(cell):
+    if cell['cell_type'] != 'markdown':
+        return False
+    line = cell['source'].split('\n')[0]
+    return re.match(r'^##\s+(.+)', line) is not None
+
+
+def parse_cells(notebook_path):
+    """Notebookを読み込み、(セルのリスト, テストケースの見出しの(セル番号, セル)のリスト)を返す。"""
+    with open(notebook_path, 'r', encoding='utf-8') as f:
+        nb = nbformat.read(f, as_version=nbformat.NO_CONVERT)
+
+    cells = nb['cells']
+    test_sets = []
+    for i, cell in enumerate(cells):
+        if has_header1(cell):
+            m = re.match(r'^#\s+(.+)', cell['source'].split('\n')[0])
+            if '報告書出力' in m.group(1):
+                break
+            test_sets.append((i, cell))
+
+    if len(test_sets) == 0 or test_sets[-1][0] != len(cells) - 1:
+        test_sets.append((len(cells), None))
+    return (cells, test_sets)
+
+
+def sheet_name(notebook_path):
+    """Notebookのファイル名からシート名の接尾辞を作る(例: テスト手順-ログイン-Dropbox → Dropbox_ログイン)。"""
+    return '_'.join(os.path.splitext(os.path.split(str(notebook_path))[-1])[0].split('-')[1:][::-1][:2])
+
+
+def _save_first_image(image_dir, cellindex, cell):
+    """セルの出力の最初の画像を保存してパスを返す。画像がなければNoneを返す。"""
+    for out in cell.get('outputs', []):
+        if 'data' in out and 'image/png' in out['data']:
+            filename = os.path.join(image_dir, f'screenshot-{cellindex}.png')
+            with open(filename, 'wb') as f:
+                f.write(b64decode(out['data']['image/png']))
+            return filename
+    return None
+
+
+def _parse_attrs(header):
+    source = header['source'].split('\n')
+    m = re.match(r'#\s+(.+)', source[0])
+    title = m.group(1) if m else ''
+    attrs = {}
+    for line in source:
+        m = re.match(r'-\s+([^:]+):\s*(.+)', line)
+        if m:
+            attrs[m.group(1)] = m.group(2)
+    return title, attrs
+
+
+def _step_status(outputs):
+    errors = [o for o in outputs if o['output_type'] == 'error']
+    if len(errors) > 0:
+        return BLOCKED if all(o.get('ename') == BLOCKED_ENAME for o in errors) else FAILED
+    if len(outputs) > 0:
+        return SUCCEEDED
+    return FAILED
+
+
+def extract_cases(notebook_path, image_dir):
+    """
+    実行済みNotebookからテストケースを取り出す。
+
+    :param notebook_path: 実行済みNotebookのパス
+    :param image_dir: スクリーンショットの保存先(Notebookごとに別のディレクトリを指定する)
+    :return: テストケースのリスト。各テストケースは notebook, sheetname, title, attrs, status, has_error(失敗の有無)と、
+        steps(index, title, purpose, status, succeeded, comment)、screenshots(ステップ番号, 画像のパス)を持つ。
+        スクリーンショットのステップ番号は、その画像を出力したセルの直前のステップ(最初のステップより前は0)
+    """
+    cells, test_sets = parse_cells(notebook_path)
+    os.makedirs(image_dir, exist_ok=True)
+    cases = []
+    for (start, header), (end, _) in zip(test_sets, test_sets[1:]):
+        title, attrs = _parse_attrs(header)
+        steps = []
+        screenshots = []
+        last_image = None
+        for cellindex in range(start + 1, end):
+            cell = cells[cellindex]
+            if not has_header2(cell):
+                image = _save_first_image(image_dir, cellindex, cell)
+                if image is not None:
+                    last_image = image
+                continue
+            if last_image is not None:
+                screenshots.append((len(steps), last_image))
+                last_image = None
+            # 次のステップまでのセルの出力から成否を判定する
+            outputs = []
+            for next_cell in cells[cellindex + 1:end]:
+                if has_header2(next_cell):
+                    break
+                outputs += list(next_cell.get('outputs', []))
+            status = _step_status(outputs)
+            source = cell['source'].split('\n')
+            steps.append(dict(
+                index=len(steps) + 1,
+                title=re.match(r'##\s+(.+)', source[0]).group(1),
+                purpose='\n'.join(source[1:]).strip(),
+                status=status,
+                succeeded=status == SUCCEEDED,
+                comment='\n'.join(
+                    o['evalue'] if 'evalue' in o else o['ename'] for o in outputs if o['output_type'] == 'error'
+                ),
+            ))
+        if last_image is not None:
+            screenshots.append((len(steps), last_image))
+        statuses = set(step['status'] for step in steps)
+        status = FAILED if FAILED in statuses else BLOCKED if BLOCKED in statuses else SUCCEEDED
+        cases.append(dict(
+            notebook=str(notebook_path),
+            sheetname=sheet_name(notebook_path),
+            title=title,
+            attrs=attrs,
+            steps=steps,
+            screenshots=screenshots,
+            status=status,
+            has_error=status == FAILED,
+        ))
+    return cases
+
+
+def assign_test_ids(cases, id_prefix='T'):
+    """実行順に並べたテストケースに、テストID(例: T001Dropbox_ログイン)を割り当てたコピーを返す。"""
+    return [
+        dict(case, id=f'{id_prefix}{index:03d}{case["sheetname"]}')
+        for index, case in enumerate(cases, start=1)
+    ]
+
+
+def screenshot_path(result_dir, test_id, stepindex):
+    return os.path.join(result_dir, 'screenshots', test_id, f'{stepindex:05d}.png')
+
+
+def copy_screenshots(cases, result_dir):
+    """スクリーンショットを screenshots/<テストID>/<ステップ番号>.png にコピーする。"""
+    for case in cases:
+        os.makedirs(os.path.join(result_dir, 'screenshots', case['id']), exist_ok=True)
+        for stepindex, image in case['screenshots']:
+            shutil.copy(image, screenshot_path(result_dir, case['id'], stepindex))
+
+
+def _make_thumbnail(task):
+    source, dest = task
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        image.thumbnail(SCREENSHOT_SIZE, Image.LANCZOS)
+        image.save(dest, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    return dest
+
+
+def process_pool(workers=None):
+    """
+    画像処理用のプロセスプールを返す。
+
+    liveReport はバックグラウンドのスレッドから報告書を作成し、ランナーは他にもスレッドを持つため、
+    fork ではなく spawn でプロセスを起動する。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def prepare_thumbnails(cases, thumbnail_dir, workers=None):
+    """
+    ワークブックに貼り付けるため、スクリーンショットを表示サイズ(SCREENSHOT_SIZE)に縮小したJPEGを並列に作成する。
+
+    :param thumbnail_dir: 縮小画像の保存先。既に縮小画像のあるスクリーンショットは作り直さない
+    :param workers: 並列に処理するプロセスの数。Noneの場合はCPUの数
+    :return: スクリーンショットのパスから縮小画像のパスへの辞書
+    """
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    thumbnails = {}
+    tasks = []
+    for case in cases:
+        for _, image in case['screenshots']:
+            name = hashlib.sha1(os.path.abspath(image).encode('utf-8')).hexdigest()[:16]
+            dest = os.path.join(thumbnail_dir, f'{name}.jpg')
+            thumbnails[image] = dest
+            if not os.path.exists(dest):
+                tasks.append((image, dest))
+    if len(tasks) > 0:
+        with process_pool(workers) as executor:
+            for _ in executor.map(_make_thumbnail, tasks, chunksize=8):
+                pass
+    return thumbnails
+
+
+def summary_row(case, author, ticket_number, date):
+    """サマリの1行を、workbook.summary_columns のキーを持つ辞書として返す。"""
+    attrs = case['attrs']
+    return dict(
+        id=case['id'],
+        sheet=case['id'],
+        subsystem_name=attrs.get('サブシステム名', ''),
+        target_type=attrs.get('ページ/アドオン', ''),
+        category=attrs.get('機能分類', ''),
+        scenario_name=attrs.get('シナリオ名', ''),
+        description=case['title'],
+        link=f'参照: {case["id"]}',
+        result=RESULT_LABELS[case['status']],
+        ticket=ticket_number,
+        owner=author,
+        date=date,
+        comment='',
+        confirmed='',
+        confirm_date='',
+    )
+
+
+def create_workbook(cases, author, ticket_number, thumbnails=None):
+    """
+    テストIDを割り当てたテストケースから、サマリとテストケースごとのシートを持つワークブックを作成する。
+
+    :param thumbnails: prepare_thumbnails の結果。指定した場合は各ステップの行にスクリーンショットを貼り付ける
+    """
+    date = datetime.now().strftime('%Y-%m-%d')
+    wb = openpyxl.Workbook()
+    fill = header_bgcolor
+
+    summary_sheet = wb.active
+    summary_sheet.title = 'サマリ'
+    summary_sheet.column_dimensions['A'].width = summary_sheet.column_dimensions['A'].width * 1.25
+    headers = ['ID', 'シート', 'サブシステム', 'ページ/アドオン', '機能分類', 'シナリオ名', '概要', 'リンク', 'テスト結果',
+               '関連チケット', '担当', '実施日', 'コメント', '修正確認', '確認日']
+    for colname, text in zip('ABCDEFGHIJKLMNO', headers):
+        summary_sheet.column_dimensions[colname].width = summary_sheet.column_dimensions['A'].width
+        summary_sheet[f'{colname}1'] = text
+        summary_sheet[f'{colname}1'].fill = fill
+
+    for index, case in enumerate(cases, start=1):
+        test_id = case['id']
+        attrs = case['attrs']
+        result = RESULT_LABELS[case['status']]
+        sheet = wb.create_sheet(test_id)
+
+        for colname in 'ABCDEFGHIJ':
+            sheet[f'{colname}1'].fill = fill
+            sheet[f'{colname}4'].fill = fill
+        sheet['A6'].fill = fill
+
+        sheet['A1'] = 'ID'
+        sheet['A2'] = test_id
+        sheet['B1'] = 'サブシステム名'
+        sheet['B2'] = attrs.get('サブシステム名', '')
+        sheet['C1'] = '分類'
+        sheet['C2'] = attrs.get('機能分類', '')
+        sheet['D2'] = attrs.get('ページ/アドオン', '')
+        sheet['H1'] = '作成者'
+        sheet['H2'] = author
+        sheet['I1'] = '作成日'
+        sheet['I2'] = date
+        sheet['J1'] = '修正日'
+        sheet['J2'] = ''
+
+        sheet['A4'] = '概要'
+        sheet['A5'] = attrs.get('概要', case['title'])
+        sheet['A5'].alignment = Alignment(wrap_text=True)
+        sheet.merge_cells('A4:B4')
+        sheet.merge_cells('A5:B5')
+        sheet['C4'] = '用意するテストデータ'
+        sheet['C5'] = attrs.get('用意するテストデータ', '')
+        sheet['C5'].alignment = Alignment(wrap_text=True)
+        sheet['D4'] = 'テスト結果'
+        sheet['D5'] = result
+        sheet['E4'] = '関連チケットURL'
+        sheet['E5'] = ticket_number
+        sheet['F4'] = '担当'
+        sheet['F5'] = author
+        sheet['G4'] = '実施日'
+        sheet['G5'] = date
+        sheet['H4'] = 'コメント'
+        sheet['H5'] = ''
+        sheet['I4'] = '修正確認'
+        sheet['I5'] = ''
+        sheet['J4'] = '確認日'
+        sheet['J5'] = ''
+        for cell in sheet['A5:J5'][0]:
+            cell.alignment = Alignment(wrap_text=True, vertical='top')
+
+        sheet['A6'] = '確認環境'
+        sheet['B6'] = 'Ubuntu'
+        sheet['C6'] = 'Chrome(Playwright)'
+        sheet['D6'] = 'ja-JP'
+
+        sheet.column_dimensions['B'].width = sheet.column_dimensions['A'].width * 4
+        sheet.column_dimensions['C'].width = sheet.column_dimensions['A'].width * 5
+        for colname in 'EGHIJ':
+            sheet.column_dimensions[colname].width = sheet.column_dimensions['A'].width * 2
+        sheet.row_dimensions[5].height = sheet.column_dimensions['A'].width * 3
+
+        startrow = 8
+        for colname, text in zip('ABCDEFGH', ['No.', 'テスト手順', '確認内容', '実施', 'コメント', '実施者', '実施日',
+                                              'スクリーンショット']):
+            sheet[f'{colname}{startrow}'] = text
+        for colname in 'ABCDEFGHIJ':
+            sheet[f'{colname}{startrow}'].fill = fill
+
+        screenshots = dict(case['screenshots'])
+        for step in case['steps']:
+            row = startrow + step['index']
+            sheet[f'A{row}'] = str(step['index'])
+            sheet[f'B{row}'] = step['title']
+            sheet[f'C{row}'] = step['purpose']
+            sheet[f'D{row}'] = STEP_MARKS[step['status']]
+            sheet[f'E{row}'] = step['comment']
+            sheet[f'F{row}'] = 'Playwright'
+            sheet[f'G{row}'] = date
+            sheet[f'H{row}'] = ''
+            for cell in sheet[f'A{row}:H{row}'][0]:
+                cell.alignment = Alignment(wrap_text=True, vertical='top')
+            sheet[f'D{row}'].alignment = Alignment(wrap_text=True, vertical='top', horizontal='center')
+            sheet.row_dimensions[row].height = STEP_ROW_HEIGHT
+            if thumbnails is not None and step['index'] in screenshots:
+                # ステップの結果を示すスクリーンショットは、そのステップのセルの出力(次のステップの直前)にある
+                sheet.add_image(SheetImage(thumbnails[screenshots[step['index']]]), f'H{row}')
+
+        summaryrow = index + 1
+        row = summary_row(case, author, ticket_number, date)
+        for colname, (key, _) in zip('ABCDEFGHIJKLMNO', summary_columns):
+            summary_sheet[f'{colname}{summaryrow}'] = row[key]
+        summary_sheet[f'H{summaryrow}'].hyperlink = f'#{test_id}!A1'
+        for cell in summary_sheet[f'A{summaryrow}:O{summaryrow}'][0]:
+            cell.alignment = Alignment(wrap_text=True, vertical='top')
+    return wb
+
+
+def _replace(path, write, mode='w'):
+    """一時ファイルに書き込んでから置き換える。実行中に報告書を開いても、書きかけのファイルが見えないようにする。"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **({} if 'b' in mode else dict(encoding='utf-8'))) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def save_workbook(wb, path):
+    _replace(path, wb.save, mode='wb')
+
+
+def write_summary_json(cases, path, author, ticket_number, notebooks=None):
+    """
+    テストケースの結果をJSONで保存する。
+
+    :param notebooks: 実行マニフェストのエントリ(notebook, status, start, end)のリスト。進捗として併せて保存する
+    """
+    date = datetime.now().strftime('%Y-%m-%d')
+    data = dict(
+        generated=datetime.now().isoformat(),
+        total=len(cases),
+        failed=sum(1 for case in cases if case['status'] == FAILED),
+        blocked=sum(1 for case in cases if case['status'] == BLOCKED),
+        notebooks=notebooks or [],
+        cases=[
+            dict(summary_row(case, author, ticket_number, date), notebook=case['notebook'], steps=case['steps'])
+            for case in cases
+        ],
+    )
+    _replace(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+
+
+def write_html_index(cases, path, author, ticket_number, running=False):
+    """テストケースの一覧(サマリと同じ列)をHTMLで保存する。runningの場合は一定間隔で再読み込みする。"""
+    date = datetime.now().strftime('%Y-%m-%d')
+    base_dir = os.path.dirname(os.path.abspath(path))
+    rows = []
+    for case in cases:
+        row = summary_row(case, author, ticket_number, date)
+        cells = []
+        for key, _ in summary_columns:
+            value = html.escape(str(row[key]))
+            if key == 'link':
+                href = html.escape(os.path.relpath(case['notebook'], base_dir))
+                value = f'<a href="{href}">{html.escape(os.path.basename(case["notebook"]))}</a>'
+            cells.append(f'<td class="{key}">{value}</td>')
+        rows.append(f'<tr class="{case["status"]}">{"".join(cells)}</tr>')
+    headers = ''.join(f'<th>{html.escape(text)}</th>' for _, text in summary_columns)
+    failed = sum(1 for case in cases if case['status'] == FAILED)
+    blocked = sum(1 for case in cases if case['status'] == BLOCKED)
+    refresh = '<meta http-equiv="refresh" content="30">' if running else ''
+    status = '実行中' if running else '完了'
+    document = f'''<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+{refresh}
+<title>テスト結果</title>
+<style>
+body {{ font-family: sans-serif; font-size: 13px; }}
+table {{ border-collapse: collapse; }}
+th {{ background: #AED6F1; }}
+th, td {{ border: 1px solid #ccc; padding: 2px 6px; vertical-align: top; }}
+tr.failed .result {{ color: #c0392b; font-weight: bold; }}
+tr.blocked .result {{ color: #7f8c8d; font-weight: bold; }}
+</style>
+</head>
+<body>
+<p>{status}: {len(cases)}件(失敗 {failed}件、ブロック {blocked}件) {html.escape(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))}</p>
+<table>
+<thead><tr>{headers}</tr></thead>
+<tbody>
+{chr(10).join(rows)}
+</tbody>
+</table>
+</body>
+</html>
+'''
+    _replace(path, lambda f: f.write(document))
@@ -0,0 +1,175 @@
+# GRDMへのリクエスト流量をテスト実行全体で調整するためのユーティリティ
+#
+# 並列実行される複数のカーネル(プロセス)間で、ファイルロックを用いてトークンバケットの状態を共有する。
+# 429 Too Many Requests を観測すると補充レートを下げて一定時間リクエストを止め、
+# 成功が続くと設定されたレートまで徐々に回復させる。
+#
+# ブラウザコンテキストでは、GRDMのホスト(静的アセットのパスを除く)へのリクエストのみを横取りする。
+# 状態ファイルの読み書きはイベントループを止めないよう、別スレッドで行う。
+
+import asyncio
+import fcntl
+import json
+import os
+import re
+import time
+
+ENV_STATE_PATH = 'GRDM_RATE_LIMIT_STATE'
+ENV_RATE = 'GRDM_RATE_LIMIT_RATE'
+ENV_BURST = 'GRDM_RATE_LIMIT_BURST'
+ENV_HOSTS = 'GRDM_RATE_LIMIT_HOSTS'
+
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 10.0
+DEFAULT_RETRY_AFTER = 60.0
+MIN_RATE = 0.2
+GOVERNED_RESOURCE_TYPES = ('document', 'xhr', 'fetch')
+# 流量の調整から除外するパス(静的アセット)
+UNGOVERNED_PATH_PREFIXES = ('/static/',)
+
+
+class RateGovernor:
+    """
+    プロセス間で共有されるトークンバケット。
+
+    :param state_path: 状態を保存するJSONファイルのパス。同一パスを指定した全てのプロセスで状態が共有される
+    :param rate: 1秒あたりに許可するリクエスト数の上限
+    :param burst: バケットの容量(連続して許可するリクエスト数)
+    :param hosts: 流量を調整するホスト(GRDMのWeb、API、管理者ページ)。空の場合は全てのホストを対象とする
+    """
+
+    def __init__(self, state_path, rate=DEFAULT_RATE, burst=DEFAULT_BURST, hosts=None):
+        self.state_path = state_path
+        self.lock_path = state_path + '.lock'
+        self.max_rate = float(rate)
+        self.burst = float(burst)
+        self.hosts = list(hosts or [])
+
+    def _update(self, f):
+        """ロックを取得した状態で状態を読み出し、f(state, now)で更新して書き戻す。fの戻り値を返す。"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = None
+                if os.path.exists(self.state_path):
+                    with open(self.state_path, 'r') as sf:
+                        try:
+                            state = json.load(sf)
+                        except ValueError:
+                            state = None
+                now = time.time()
+                if state is None:
+                    state = {
+                        'tokens': self.burst,
+                        'rate': self.max_rate,
+                        'updated': now,
+                        'blocked_until': 0.0,
+                        'rate_limited_count': 0,
+                    }
+                elapsed = max(0.0, now - state['updated'])
+                state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate'])
+                state['updated'] = now
+                result = f(state, now)
+                tmp_path = self.state_path + '.tmp'
+                with open(tmp_path, 'w') as sf:
+                    json.dump(state, sf)
+                os.replace(tmp_path, self.state_path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def try_acquire(self):
+        """トークンを1つ取得する。取得できた場合は0を、できなかった場合は次に試行するまでの待ち時間(秒)を返す。"""
+        def take(state, now):
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            if state['tokens'] >= 1.0:
+                state['tokens'] -= 1.0
+                return 0.0
+            return (1.0 - state['tokens']) / state['rate']
+        return self._update(take)
+
+    async def acquire(self):
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def observe(self, status, retry_after=None):
+        """レスポンスのステータスを記録する。429の場合はレートを半減させ、Retry-Afterの間リクエストを止める。"""
+        def record(state, now):
+            if status == 429:
+                state['rate'] = max(MIN_RATE, state['rate'] / 2)
+                state['tokens'] = 0.0
+                state['blocked_until'] = max(state['blocked_until'], now + (retry_after or DEFAULT_RETRY_AFTER))
+                state['rate_limited_count'] += 1
+            elif state['rate'] < self.max_rate:
+                # 成功が続く限り、上限のレートまで少しずつ戻す
+                state['rate'] = min(self.max_rate, state['rate'] + 0.1)
+        self._update(record)
+
+    def blocked_for(self):
+        """429によりリクエストが止められている残り時間(秒)を返す。"""
+        return self._update(lambda state, now: max(0.0, state['blocked_until'] - now))
+
+    def url_pattern(self):
+        """流量を調整するURLの正規表現。関数ではなく正規表現で指定し、Playwrightが対象外のリクエストを横取りしないようにする。"""
+        hosts = '|'.join(re.escape(host) for host in self.hosts) if len(self.hosts) > 0 else '[^/]+'
+        excluded = '|'.join(re.escape(prefix.lstrip('/')) for prefix in UNGOVERNED_PATH_PREFIXES)
+        return re.compile(rf'^https?://({hosts})(:\d+)?(/(?!({excluded}))|$)')
+
+    def is_governed(self, url):
+        """流量を調整するURLであればTrueを返す。"""
+        return self.url_pattern().match(url) is not None
+
+    async def attach(self, context, resource_types=GOVERNED_RESOURCE_TYPES):
+        """ブラウザコンテキストのGRDMへのリクエストをトークンバケットで制御し、レスポンスを観測する。"""
+        async def route(route):
+            if route.request.resource_type in resource_types:
+                await self.acquire()
+            await route.fallback()
+
+        async def on_response(response):
+            if not self.is_governed(response.url):
+                return
+            if response.status == 429:
+                retry_after = response.headers.get('retry-after')
+                await asyncio.to_thread(
+                    self.observe, 429, float(retry_after) if retry_after and retry_after.isdigit() else None,
+                )
+            elif response.request.resource_type in resource_types:
+                await asyncio.to_thread(self.observe, response.status)
+
+        await context.route(self.url_pattern(), route)
+        context.on('response', on_response)
+
+
+def from_environ():
+    """環境変数で状態ファイルが指定されていればRateGovernorを返す。指定がなければNoneを返す。"""
+    state_path = os.environ.get(ENV_STATE_PATH)
+    if not state_path:
+        return None
+    return RateGovernor(
+        state_path,
+        rate=float(os.environ.get(ENV_RATE, DEFAULT_RATE)),
+        burst=float(os.environ.get(ENV_BURST, DEFAULT_BURST)),
+        hosts=[host for host in os.environ.get(ENV_HOSTS, '').split(',') if host],
+    )
+
+
+def configure_environ(state_path, rate=DEFAULT_RATE, burst=DEFAULT_BURST, hosts=None):
+    """以降に起動されるカーネルが同一の状態ファイルを共有するよう、環境変数を設定する。"""
+    os.environ[ENV_STATE_PATH] = os.path.abspath(state_path)
+    os.environ[ENV_RATE] = str(rate)
+    os.environ[ENV_BURST] = str(burst)
+    os.environ[ENV_HOSTS] = ','.join(hosts or [])
+
+
+async def wait_after_rate_limited(default_wait=60):
+    """429により表示できなかった場合の待機。RateGovernorが有効ならブロック解除まで、無効ならdefault_wait秒待つ。"""
+    governor = from_environ()
+    if governor is None:
+        await asyncio.sleep(default_wait)
+        return
+    await asyncio.sleep(max(1.0, await asyncio.to_thread(governor.blocked_for)))
@@ -0,0 +1,247 @@
+# ステップごとのフロントエンド性能(Navigation Timing、Resource Timing、Long Tasks、LCP、CLS、CDPのパフォーマンスメトリクス)の計測
+#
+# コンテキストに INIT_SCRIPT を登録しておき、ステップの終了時に collect でページとCDPから値を取得する。
+# 計測値はセッションの証跡とともに web-perf.jsonl としてNotebookの結果ディレクトリに保存され、
+# write_report でテスト実行全体の値をページ種別(URLのパスからGUIDなどを除いたもの)ごとに集計する。
+#
+# Resource Timing と Long Tasks は、前回の取得以降(SPA内の画面遷移を含む)のもののみを対象とする。
+# Navigation Timing はドキュメントの読み込み後、最初の取得時のみ報告する。
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pandas as pd
+
+ENV_WEB_PERF = 'GRDM_WEB_PERF'
+RECORDS_FILENAME = 'web-perf.jsonl'
+SUMMARY_FILENAME = 'web-perf-summary.csv'
+
+INIT_SCRIPT = '''
+(() => {
+  if (window.__grdmWebPerf) {
+    return;
+  }
+  const state = window.__grdmWebPerf = {longTasks: [], lcp: null, cls: 0, collectedAt: 0};
+  try {
+    performance.setResourceTimingBufferSize(10000);
+  } catch (e) {
+  }
+  const observe = (type, callback) => {
+    try {
+      new PerformanceObserver((list) => list.getEntries().forEach(callback)).observe({type, buffered: true});
+    } catch (e) {
+      // 未対応のエントリ種別
+    }
+  };
+  observe('longtask', (entry) => state.longTasks.push({startTime: entry.startTime, duration: entry.duration}));
+  observe('largest-contentful-paint', (entry) => {
+    state.lcp = entry.renderTime || entry.loadTime || entry.startTime;
+  });
+  observe('layout-shift', (entry) => {
+    if (!entry.hadRecentInput) {
+      state.cls += entry.value;
+    }
+  });
+})();
+'''
+
+COLLECT_SCRIPT = '''
+() => {
+  const state = window.__grdmWebPerf || {longTasks: [], lcp: null, cls: 0, collectedAt: 0};
+  const since = state.collectedAt;
+  state.collectedAt = performance.now();
+  const nav = performance.getEntriesByType('navigation')[0];
+  const resources = performance.getEntriesByType('resource').filter((e) => e.startTime >= since);
+  const longTasks = state.longTasks.filter((t) => t.startTime >= since);
+  const byType = {};
+  resources.forEach((e) => {
+    const t = byType[e.initiatorType] = byType[e.initiatorType] || {count: 0, transferSize: 0, maxDuration: 0};
+    t.count += 1;
+    t.transferSize += e.transferSize || 0;
+    t.maxDuration = Math.max(t.maxDuration, e.duration);
+  });
+  return {
+    url: location.href,
+    navigation: nav && since === 0 ? {
+      type: nav.type,
+      ttfb: nav.responseStart - nav.startTime,
+      domContentLoaded: nav.domContentLoadedEventEnd - nav.startTime,
+      load: nav.loadEventEnd > 0 ? nav.loadEventEnd - nav.startTime : null,
+      transferSize: nav.transferSize,
+    } : null,
+    resources: {
+      count: resources.length,
+      transferSize: resources.reduce((sum, e) => sum + (e.transferSize || 0), 0),
+      byType,
+      slowest: resources.slice().sort((a, b) => b.duration - a.duration).slice(0, 5)
+        .map((e) => ({name: e.name, duration: e.duration})),
+    },
+    longTasks: {
+      count: longTasks.length,
+      duration: longTasks.reduce((sum, t) => sum + t.duration, 0),
+    },
+    lcp: state.lcp,
+    cls: state.cls,
+  };
+}
+'''
+
+# Performance.getMetrics のうち記録する値。累積値はステップ間の差分も記録する
+CDP_METRICS = ('JSHeapUsedSize', 'JSHeapTotalSize', 'Nodes', 'Documents')
+CDP_CUMULATIVE_METRICS = ('LayoutCount', 'RecalcStyleCount', 'LayoutDuration', 'RecalcStyleDuration',
+                          'ScriptDuration', 'TaskDuration')
+
+# 5文字のGUIDと区別できない、GRDMのパスの固定部分
+KNOWN_SEGMENTS = ('users', 'share', 'terms', 'store')
+GUID_PATTERN = re.compile(r'^[23456789abcdefghjkmnpqrstuvwxyz]{5}$')
+
+
+def enabled_by_environ():
+    return os.environ.get(ENV_WEB_PERF, '').lower() in ('1', 'true', 'yes')
+
+
+def page_type(url):
+    """URLをページ種別(ホストとパスの先頭部分。GUIDは {guid} に置き換える)に変換する。"""
+    parsed = urlparse(url)
+    segments = [s for s in parsed.path.split('/') if s]
+    if len(segments) > 0 and GUID_PATTERN.match(segments[0]) and segments[0] not in KNOWN_SEGMENTS:
+        # プロジェクト配下のページは機能名(files, metadata など)までとし、ファイルパスなどは除く
+        segments = ['{guid}'] + segments[1:2]
+    else:
+        segments = segments[:2]
+    return f'{parsed.netloc}/' + '/'.join(segments)
+
+
+class Collector:
+    """ページごとにCDPセッションを保持し、ステップ間のメトリクスの差分を求める。"""
+
+    def __init__(self):
+        self._cdp_sessions = {}
+        self._last_metrics = {}
+
+    async def _cdp_metrics(self, context, page):
+        cdp = self._cdp_sessions.get(page)
+        if cdp is None:
+            cdp = await context.new_cdp_session(page)
+            await cdp.send('Performance.enable')
+            self._cdp_sessions[page] = cdp
+        response = await cdp.send('Performance.getMetrics')
+        values = dict((m['name'], m['value']) for m in response['metrics'])
+        last = self._last_metrics.get(page, {})
+        self._last_metrics[page] = values
+        metrics = dict((name, values.get(name)) for name in CDP_METRICS + CDP_CUMULATIVE_METRICS)
+        for name in CDP_CUMULATIVE_METRICS:
+            if name in values:
+                metrics[f'{name}Delta'] = values[name] - last.get(name, 0)
+        return metrics
+
+    async def collect(self, context, page):
+        """ページとCDPから計測値を取得する。"""
+        record = await page.evaluate(COLLECT_SCRIPT)
+        record['page_type'] = page_type(record['url'])
+        try:
+            record['cdp'] = await self._cdp_metrics(context, page)
+        except Exception as e:
+            # Chromium以外、またはページが閉じられた
+            record['cdp'] = None
+            record['cdp_error'] = str(e)
+        return record
+
+    def forget(self, page):
+        self._cdp_sessions.pop(page, None)
+        self._last_metrics.pop(page, None)
+
+
+def format_record(record):
+    """計測値の1行の要約を返す。"""
+    items = [record['page_type']]
+    navigation = record.get('navigation')
+    if navigation is not None:
+        items.append(f'TTFB {navigation["ttfb"]:.0f}ms')
+        if navigation['load'] is not None:
+            items.append(f'load {navigation["load"]:.0f}ms')
+    if record.get('lcp') is not None:
+        items.append(f'LCP {record["lcp"]:.0f}ms')
+    items.append(f'CLS {record.get("cls") or 0:.3f}')
+    items.append(f'long tasks {record["longTasks"]["count"]} ({record["longTasks"]["duration"]:.0f}ms)')
+    items.append(f'{record["resources"]["count"]} resources')
+    cdp = record.get('cdp')
+    if cdp is not None and cdp.get('JSHeapUsedSize') is not None:
+        items.append(f'heap {cdp["JSHeapUsedSize"] / 1024 / 1024:.1f}MB')
+        items.append(f'script {cdp.get("ScriptDurationDelta", 0) * 1000:.0f}ms')
+    return 'Web perf: ' + ', '.join(items)
+
+
+def _flatten(record):
+    navigation = record.get('navigation') or {}
+    cdp = record.get('cdp') or {}
+    return dict(
+        page_type=record['page_type'],
+        ttfb=navigation.get('ttfb'),
+        dom_content_loaded=navigation.get('domContentLoaded'),
+        load=navigation.get('load'),
+        lcp=record.get('lcp'),
+        cls=record.get('cls'),
+        long_tasks=record['longTasks']['count'],
+        long_task_duration=record['longTasks']['duration'],
+        resources=record['resources']['count'],
+        transfer_size=record['resources']['transferSize'],
+        js_heap_used=cdp.get('JSHeapUsedSize'),
+        layout_count=cdp.get('LayoutCountDelta'),
+        script_duration=(cdp['ScriptDurationDelta'] * 1000) if cdp.get('ScriptDurationDelta') is not None else None,
+    )
+
+
+def load_records(result_dir):
+    """結果ディレクトリ配下の全ての web-perf.jsonl を読み込む。"""
+    records = []
+    for path in sorted(Path(result_dir).rglob(RECORDS_FILENAME)):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def aggregate(records):
+    """計測値をページ種別ごとに集計する(中央値とp90、CLSは最大値も)。"""
+    if len(records) == 0:
+        return pd.DataFrame()
+    df = pd.DataFrame([_flatten(record) for record in records])
+    grouped = df.groupby('page_type')
+    summary = grouped.size().to_frame('samples')
+    for column in df.columns:
+        if column == 'page_type':
+            continue
+        summary[f'{column}_p50'] = grouped[column].median()
+        summary[f'{column}_p90'] = grouped[column].quantile(0.9)
+    summary['cls_max'] = grouped['cls'].max()
+    return summary.sort_values('samples', ascending=False)
+
+
+def write_report(result_dir):
+    """結果ディレクトリの計測値を集計し、web-perf-summary.csv として保存する。計測値がなければNoneを返す。"""
+    records = load_records(result_dir)
+    if len(records) == 0:
+        return None
+    summary = aggregate(records)
+    summary_path = os.path.join(result_dir, SUMMARY_FILENAME)
+    summary.to_csv(summary_path)
+    columns = ['samples', 'ttfb_p50', 'load_p50', 'lcp_p50', 'lcp_p90', 'cls_max', 'long_task_duration_p90',
+               'script_duration_p50', 'js_heap_used_p90']
+    print(summary[columns].to_string(float_format=lambda v: f'{v:.1f}'))
+    print(f'Web performance summary: {summary_path}')
+    return summary_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python -m scripts.webPerf <result_dir>', file=sys.stderr)
+        sys.exit(2)
+    if write_report(sys.argv[1]) is None:
+        print('No web performance records found', file=sys.stderr)
+        sys.exit(1)